@@ -0,0 +1 @@
+# Offline benchmark suite for the example flows - see bench/benchmark.py.
@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from hello_autogen.examples import FLOW_EXAMPLES, build_flow, load_example, run_flow_chat
+
+# == Example flow benchmark ==============================================================================
+#
+# Drives the agent graphs of example-01 to example-04 against the replay stub (bench/stub_server.py) and
+# reports end-to-end latency, turns, tokens and throughput per flow:
+#
+#     python -m bench.benchmark --iterations 20 --concurrency 4 --latency 0.2 --json results.json
+#     python -m bench.benchmark --compare results.json --tolerance 0.2    # exits 1 on a regression
+#
+# The stub replies from a recording, so runs need no network, no Ollama and no API key, and the numbers only
+# move when the code around the model calls does. Panel flows (chatbot, multimodal) run `build_session` with a
+# chat interface that drops messages.
+
+DEFAULT_TASKS = {
+    'two-agent': ['Tell me a joke.', 'Tell me a very short story.'],
+    'group-chat': [
+        'Tell me a very short story.',
+        'Write python code to output numbers from 1 to 100',
+        'Write javascript function to output numbers from 1 to n',
+        'How do I create a dataframe?',
+    ],
+    'chatbot': [
+        'Tell me a joke.',
+        'Write python code to output numbers from 1 to 100',
+        'How do I create a dataframe?',
+    ],
+    'multimodal': ['Suggest a quick lunch recipe.', 'Tell me a very short story.'],
+    'fan-out': [
+        'Write python code to output numbers from 1 to 100',
+        'Write javascript function to output numbers from 1 to n',
+    ],
+}
+
+# metrics compared against a baseline, all "lower is better"
+COMPARED = ('p50', 'p99', 'turns_mean', 'tokens_per_conversation')
+
+
+class NullChat:
+    def send(self, *args, **kwargs):
+        return None
+
+    def stream(self, *args, **kwargs):
+        return kwargs.get('message')
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def stub_stats(base_url):
+    with urllib.request.urlopen(base_url.rstrip('/') + '/stats', timeout=5) as response:
+        return json.load(response)
+
+
+# == Flows
+#
+# Each worker thread builds its agents once and reuses them, like a Panel session reused across messages.
+
+class Flow:
+    def __init__(self, name, module, clear_cache=True):
+        self.name = name
+        self.module = module
+        self.clear_cache = clear_cache
+        self._local = threading.local()
+
+    def _agents(self):
+        if not hasattr(self._local, 'agents'):
+            self._local.agents = build_flow(self.name, NullChat())
+        return self._local.agents
+
+    def run(self, task):
+        agents = self._agents()
+        if self.clear_cache and hasattr(self.module, 'response_cache'):
+            self.module.response_cache.clear()
+
+        started = time.monotonic()
+        result = run_flow_chat(self.name, agents, task)
+        return time.monotonic() - started, len(result.chat_history)
+
+
+def run_flow(flow, tasks, iterations, concurrency, base_url):
+    jobs = [task for _ in range(iterations) for task in tasks]
+    before = stub_stats(base_url)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(flow.run, jobs))
+    elapsed = time.monotonic() - started
+    after = stub_stats(base_url)
+
+    latencies = [latency for latency, _ in results]
+    turns = [count for _, count in results]
+    tokens = (after['prompt_tokens'] - before['prompt_tokens']) + (after['completion_tokens'] - before['completion_tokens'])
+    return {
+        'conversations': len(results),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'mean': sum(latencies) / len(latencies),
+        'turns_mean': sum(turns) / len(turns),
+        'turns_max': max(turns),
+        'llm_requests': after['requests'] - before['requests'],
+        'prompt_tokens': after['prompt_tokens'] - before['prompt_tokens'],
+        'completion_tokens': after['completion_tokens'] - before['completion_tokens'],
+        'tokens_per_conversation': tokens / len(results),
+        'conversations_per_second': len(results) / elapsed if elapsed else 0.0,
+        'unmatched_requests': after['defaulted'] - before['defaulted'],
+    }
+
+
+# == Reporting
+
+def print_report(report):
+    header = f"{'flow':<12} {'convs':>6} {'p50 s':>8} {'p99 s':>8} {'turns':>6} {'tokens':>8} {'conv/s':>7} {'unmatched':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, r in report['flows'].items():
+        print(
+            f"{name:<12} {r['conversations']:>6} {r['p50']:>8.3f} {r['p99']:>8.3f} {r['turns_mean']:>6.1f} "
+            f"{r['tokens_per_conversation']:>8.0f} {r['conversations_per_second']:>7.2f} {r['unmatched_requests']:>9}"
+        )
+
+
+# Metrics more than `tolerance` (a fraction) above the baseline count as regressions
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, result in report['flows'].items():
+        previous = baseline.get('flows', {}).get(name)
+        if previous is None:
+            continue
+        for metric in COMPARED:
+            if previous.get(metric) and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {previous[metric]:.3f} -> {result[metric]:.3f}")
+        if previous.get('conversations_per_second') and \
+                result['conversations_per_second'] < previous['conversations_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{name} conversations_per_second: "
+                f"{previous['conversations_per_second']:.2f} -> {result['conversations_per_second']:.2f}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the example flows against the replay stub')
+    parser.add_argument('--flows', default='two-agent,group-chat,fan-out,chatbot,multimodal')
+    parser.add_argument('--iterations', type=int, default=5, help='runs of each task')
+    parser.add_argument('--concurrency', type=int, default=1, help='conversations in flight per flow')
+    parser.add_argument('--recording', default=os.path.join(os.path.dirname(__file__), 'recordings', 'sample.jsonl'))
+    parser.add_argument('--latency', type=float, default=0.05, help='stub seconds before the first token')
+    parser.add_argument('--per-token', type=float, default=0.0, help='stub seconds per completion token')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--base-url', help='use an already running stub instead of starting one')
+    parser.add_argument('--warm-cache', action='store_true', help="keep the examples' response caches between runs")
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if base_url is None:
+        from bench.stub_server import Recording, StubState, serve
+
+        state = StubState(Recording(args.recording), latency=args.latency, per_token=args.per_token, jitter=args.jitter)
+        _, base_url = serve(state)
+
+    # must be set before the examples are loaded and build their configs
+    os.environ['MODEL_BASE_URL'] = base_url
+
+    report = {
+        'settings': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+        'flows': {},
+    }
+    for name in args.flows.split(','):
+        module = load_example(FLOW_EXAMPLES[name])
+        # the examples log every message at INFO
+        logging.getLogger().setLevel(logging.WARNING)
+        flow = Flow(name, module, clear_cache=not args.warm_cache)
+        report['flows'][name] = run_flow(flow, DEFAULT_TASKS[name], args.iterations, args.concurrency, base_url)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
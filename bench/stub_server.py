@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hello_autogen.history import count_tokens
+
+# == OpenAI-compatible replay stub =======================================================================
+#
+# Serves `/chat/completions` (streaming and non-streaming) and `/models` from a recording, with configurable
+# latency, so the examples can be driven with no network, no Ollama and no API key:
+#
+#     python -m bench.stub_server --port 59990 --latency 0.5 --per-token 0.02
+#     MODEL_BASE_URL=http://127.0.0.1:59990 python example-01-autogen-intro.py
+#
+# A recording is a JSONL file whose lines are either recorded completions
+#     {"key": "<hash of the request messages>", "content": "..."}
+# or hand-written rules, tried in file order, matching the system message and/or the latest message:
+#     {"system": "regex", "last": "regex", "content": "..."}
+# With `--upstream`, requests without a recorded completion are forwarded to a real endpoint and recorded.
+
+
+def request_key(messages):
+    normalized = [{'role': m.get('role'), 'content': m.get('content')} for m in messages]
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def _text(content):
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+class Recording:
+    def __init__(self, path=None, default_reply='Done.'):
+        self.path = path
+        self.default_reply = default_reply
+        self.exact = {}
+        self.rules = []
+        self._lock = threading.Lock()
+        if path:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+
+    def _add(self, entry):
+        if 'key' in entry:
+            self.exact[entry['key']] = entry['content']
+        else:
+            self.rules.append((
+                re.compile(entry['system'], re.S) if entry.get('system') else None,
+                re.compile(entry['last'], re.S | re.I) if entry.get('last') else None,
+                entry['content'],
+            ))
+
+    def lookup(self, messages):
+        key = request_key(messages)
+        if key in self.exact:
+            return self.exact[key]
+        system = _text(messages[0].get('content')) if messages and messages[0].get('role') == 'system' else ''
+        last = _text(messages[-1].get('content')) if messages else ''
+        for system_pattern, last_pattern, content in self.rules:
+            if system_pattern is not None and not system_pattern.search(system):
+                continue
+            if last_pattern is not None and not last_pattern.search(last):
+                continue
+            return content
+        return None
+
+    def record(self, messages, content):
+        entry = {'key': request_key(messages), 'content': content}
+        with self._lock:
+            self.exact[entry['key']] = content
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+
+
+class StubState:
+    def __init__(self, recording, latency=0.0, per_token=0.0, jitter=0.0, upstream=None, upstream_key=None):
+        self.recording = recording
+        self.latency = latency
+        self.per_token = per_token
+        self.jitter = jitter
+        self.upstream = upstream
+        self.upstream_key = upstream_key
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'recorded': 0, 'defaulted': 0}
+
+    def delay(self, tokens=0):
+        return max(0.0, self.latency + self.per_token * tokens + random.uniform(-self.jitter, self.jitter))
+
+    def complete(self, body):
+        messages = body.get('messages', [])
+        content = self.recording.lookup(messages)
+        counter = None
+        if content is None and self.upstream:
+            content = self._forward(body)
+            self.recording.record(messages, content)
+            counter = 'recorded'
+        elif content is None:
+            content = self.recording.default_reply
+            counter = 'defaulted'
+
+        prompt_tokens = sum(count_tokens(_text(m.get('content'))) + 4 for m in messages)
+        completion_tokens = count_tokens(content)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+            if counter:
+                self.stats[counter] += 1
+        return content, prompt_tokens, completion_tokens
+
+    def _forward(self, body):
+        request = urllib.request.Request(
+            self.upstream.rstrip('/') + '/chat/completions',
+            data=json.dumps(dict(body, stream=False)).encode(),
+            headers={'Content-Type': 'application/json', 'Authorization': f"Bearer {self.upstream_key or 'NULL'}"},
+        )
+        with urllib.request.urlopen(request, timeout=600) as response:
+            return json.load(response)['choices'][0]['message']['content']
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path in ('/models', '/v1/models'):
+            self._json({'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]})
+        elif path == '/stats':
+            with self.server.state._lock:
+                self._json(dict(self.server.state.stats))
+        else:
+            self._json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/chat/completions', '/v1/chat/completions'):
+            self._json({'error': 'not found'}, 404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        state = self.server.state
+        content, prompt_tokens, completion_tokens = state.complete(body)
+        completion_id = f"chatcmpl-stub-{state.stats['requests']}"
+        created = int(time.time())
+        model = body.get('model', 'stub')
+
+        if not body.get('stream'):
+            time.sleep(state.delay(completion_tokens))
+            self._json({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+            return
+
+        # time to first token is the base latency, then `per_token` between chunks
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        time.sleep(state.delay())
+        pieces = re.findall(r"\S+\s*|\s+", content) or ['']
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(state.per_token)
+            self._event({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}, 'finish_reason': None}],
+            })
+        self._event({
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        })
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        self.wfile.flush()
+
+
+# Start a stub in a background thread; returns the server and its base URL (port 0 picks a free port)
+def serve(state, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI-compatible replay stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=59990)
+    parser.add_argument('--recording', default='bench/recordings/sample.jsonl')
+    parser.add_argument('--default-reply', default='Done.')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--per-token', type=float, default=0.0, help='seconds per completion token')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of uniform noise')
+    parser.add_argument('--upstream', help='forward and record requests the recording does not cover')
+    parser.add_argument('--upstream-key', help='API key for --upstream')
+    args = parser.parse_args()
+
+    state = StubState(
+        Recording(args.recording, args.default_reply),
+        latency=args.latency,
+        per_token=args.per_token,
+        jitter=args.jitter,
+        upstream=args.upstream,
+        upstream_key=args.upstream_key,
+    )
+    server, url = serve(state, args.host, args.port)
+    print(f"replaying {args.recording} at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
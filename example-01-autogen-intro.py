@@ -1,101 +1,76 @@
 import autogen
 import logging
-from pprint import pformat
-import os
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from hello_autogen.executors import PooledUserProxyAgent, get_executor_pool
+from hello_autogen.logging_setup import pretty, setup_logging
+from hello_autogen.models import ModelRegistry
+from hello_autogen.termination import TerminationDetector
 
 load_dotenv()
-OPEN_AI_API_KEY = os.getenv('OPEN_AI_API_KEY')
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+# formatting and file writes happen on a background thread; debug.log rotates at 10MB
+setup_logging("debug.log", level=logging.INFO)
 
-# == Model Config ====================================================================================
+# == LLM Config ====================================================================================
+#
+# Models are defined once in hello_autogen/models.py. Listing fallbacks lets autogen fail over (e.g. from the
+# local LiteLLM proxy to OpenAI) and the registry drops fallbacks that are down or not configured.
 
-model_configs = {
-    'mistral': {
-        'llm_config': {
-            'base_url': 'http://0.0.0.0:59991',
-            'model': 'mistral',
-            'api_key': 'NULL',
-        },
-        'cache_seed': 1000,
-        # 'cache_seed': False, # disables cache
-    },
-    'oai-gpt35': {
-        'llm_config': {
-            'model': 'gpt-3.5-turbo-16k',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed':  1001,
-    },
-    'oai-gpt4': {
-        'llm_config': {
-            'model': 'gpt-4-turbo-preview',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed': 1002,
-    },
-}
+models = ModelRegistry(enable_cache=True)
 
-# == LLM Config ====================================================================================
+llm_config_conversational = models.llm_config('mistral', fallbacks=['oai-gpt35'], temperature=0.25)
+# llm_config_conversational_gpt35 = models.llm_config('oai-gpt35', temperature=0.25)
+# llm_config_conversational_gpt4 = models.llm_config('oai-gpt4', temperature=0.25)
 
-model_config_conversation = model_configs['mistral']
-llm_config_conversational = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation['cache_seed'],
-    'config_list': [model_config_conversation['llm_config']],
-    'temperature': 0.25,
-}
-
-model_config_conversation_gpt35 = model_configs['oai-gpt35']
-llm_config_conversational_gpt35 = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation_gpt35['cache_seed'],
-    'config_list': [model_config_conversation_gpt35['llm_config']],
-    'temperature': 0.25,
-}
-
-model_config_conversation_gpt4 = model_configs['oai-gpt4']
-llm_config_conversational_gpt4 = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation_gpt4['cache_seed'],
-    'config_list': [model_config_conversation_gpt4['llm_config']],
-    'temperature': 0.25,
-}
+# == Code execution ====================================================================================
+#
+# Code blocks run in a shared pool of pre-started Python/Node workers (hello_autogen/executors.py): one block per
+# process, each in its own temp dir with CPU/memory/time limits, at most 2 at once. Files they write are copied
+# to `output` as before.
+
+code_executors = get_executor_pool(warm=2, max_concurrency=2, timeout=60, cpu_seconds=30, memory_mb=512)
 
 # == Assistant Config ==================================================================================
 
 terminateKeyword = "TERMINATE"
 
-user_proxy = autogen.UserProxyAgent(
-    name="UserProxy",
-    is_termination_msg=lambda x: x.get("content", "").rstrip().endswith(terminateKeyword),
-    description="""an assistant with strong communication skills""",
-    system_message=f"""Reply {terminateKeyword} if the task has been solved at full satisfaction""",
-    code_execution_config={
-        'work_dir': 'output',
-        'use_docker': False,
-    },
-    human_input_mode="NEVER",
-    llm_config=llm_config_conversational,
-    # llm_config=llm_config_conversational_gpt35,
-    max_consecutive_auto_reply=10,
-)
-
-assistant = autogen.AssistantAgent(
-    name="Assistant",
-    llm_config=llm_config_conversational,
-    # llm_config=llm_config_conversational_gpt35,
-    # llm_config=llm_config_conversational_gpt4,
-    description="""an helpful assistant with strong writing skills who can communicate clearly and without fluff""",
-    system_message="""You are a senior editor and acclaimed writer and researcher""",
-)
+# Built by a function so other tools (bench/, batch runs) can create as many independent agent pairs as they
+# need; running this script builds one pair and chats once.
+def build_agents():
+    user_proxy_termination = termination_detector()
+    assistant_termination = termination_detector()
+
+    user_proxy = PooledUserProxyAgent(
+        name="UserProxy",
+        is_termination_msg=user_proxy_termination,
+        description="""an assistant with strong communication skills""",
+        system_message=f"""Reply {terminateKeyword} if the task has been solved at full satisfaction""",
+        code_execution_config={
+            'work_dir': 'output',
+            'use_docker': False,
+        },
+        executor_pool=code_executors,
+        human_input_mode="NEVER",
+        llm_config=llm_config_conversational,
+        # llm_config=llm_config_conversational_gpt35,
+        max_consecutive_auto_reply=10,
+    )
+
+    assistant = autogen.AssistantAgent(
+        name="Assistant",
+        is_termination_msg=assistant_termination,
+        llm_config=llm_config_conversational,
+        # llm_config=llm_config_conversational_gpt35,
+        # llm_config=llm_config_conversational_gpt4,
+        description="""an helpful assistant with strong writing skills who can communicate clearly and without fluff""",
+        system_message="""You are a senior editor and acclaimed writer and researcher""",
+    )
+
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        assistant=assistant,
+        terminations=[user_proxy_termination, assistant_termination],
+    )
 
 # == Prompt ====================================================================================
 
@@ -109,11 +84,24 @@ with_termination_notice = lambda task: task + (
 task = with_termination_notice("""Tell me a joke.""")
 # task = with_termination_notice("""Write python code to output numbers from 1 to 100 then store the python code in a file.""")
 
-# == Chat Execution ====================================================================================
+# == Termination ====================================================================================
+#
+# Chats end as soon as the answer is delivered - on the keyword, a thank-you, a repeated message or a "task is
+# done" reply - instead of after rounds of pleasantries. Every agent that checks for termination gets its own
+# detector, reset at the start of each chat.
 
-result = user_proxy.initiate_chat(
-    assistant,
-    message=task
+termination_detector = lambda: TerminationDetector(
+    terminateKeyword, boilerplate=[with_termination_notice('')], max_round=10,
 )
 
-logging.info(pformat(result))
+# == Chat Execution ====================================================================================
+
+if __name__ == "__main__":
+    agents = build_agents()
+    result = agents.user_proxy.initiate_chat(
+        agents.assistant,
+        message=task
+    )
+
+    logging.info("%s", pretty(result))
+    logging.info("termination: %s", [termination.stats for termination in agents.terminations])
@@ -1,133 +1,62 @@
 import autogen
-import os
 import logging
-from pprint import pformat
+import os
+import uuid
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from hello_autogen.admission import get_backend_limiter
+from hello_autogen.budgets import BudgetExceeded, ChatBudget
+from hello_autogen.executors import PooledUserProxyAgent, get_executor_pool
+from hello_autogen.fanout import FanOutManager
+from hello_autogen.history import HistoryCompactor
+from hello_autogen.logging_setup import lazy, pretty, setup_logging
+from hello_autogen.metrics import get_metrics
+from hello_autogen.models import ModelRegistry
+from hello_autogen.pipeline import ReplyPipeline
+from hello_autogen.prefix import PrefixTracker
+from hello_autogen.routing import ModelRouter
+from hello_autogen.speculative import SpeculativeRacer
+from hello_autogen.speaker_selection import HeuristicGroupChat, KeywordSpeakerSelector
+from hello_autogen.store import get_store, seed_group_chat
+from hello_autogen.termination import TerminationDetector
 
 load_dotenv()
-OPEN_AI_API_KEY = os.getenv('OPEN_AI_API_KEY')
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+
+# formatting and file writes happen on a background thread; debug.log rotates at 10MB
+setup_logging("debug.log", level=logging.INFO)
 
 # ENABLE_CACHE = True
 ENABLE_CACHE = False
 
-# == Model Config ====================================================================================
-
-model_configs = {
-    'oai-gpt35': {
-        'llm_config': {
-            'model': 'gpt-3.5-turbo-16k',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed':  1000 if ENABLE_CACHE else None,
-    },
-    'oai-gpt4': {
-        'llm_config': {
-            'model': 'gpt-4-turbo-preview',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed': 1001 if ENABLE_CACHE else None,
-    },
-    'mistral': {
-        'llm_config': {
-            'base_url': 'http://0.0.0.0:59991',
-            'model': 'mistral',
-            'api_key': 'NULL',
-        },
-        'cache_seed': 1003 if ENABLE_CACHE else None,
-    },
-    'codellama': {
-        'llm_config': {
-            'base_url': 'http://0.0.0.0:59993',
-            'model': 'codellama',
-            'api_key': 'NULL',
-        },
-        'cache_seed': 1005 if ENABLE_CACHE else None,
-    },
-}
-
 # == LLM Config ====================================================================================
+#
+# Models are defined once in hello_autogen/models.py. Listing fallbacks lets autogen fail over (e.g. from the
+# local LiteLLM proxy to OpenAI) and the registry drops fallbacks that are down or not configured.
 
-model_config_conversation = model_configs['mistral']
-llm_config_conversational = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation['cache_seed'],
-    'config_list': [model_config_conversation['llm_config']],
-    'temperature': 0,
-}
+models = ModelRegistry(enable_cache=ENABLE_CACHE)
 
-model_config_conversation_advanced = model_configs['oai-gpt4']
-llm_config_conversational_advanced = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation_advanced['cache_seed'],
-    'config_list': [model_config_conversation_advanced['llm_config']],
-    'temperature': 0,
-}
+llm_config_conversational = models.llm_config('mistral', fallbacks=['oai-gpt35'], temperature=0)
+llm_config_conversational_advanced = models.llm_config('oai-gpt4', fallbacks=['oai-gpt35'], temperature=0)
+llm_config_coding = models.llm_config('oai-gpt4', fallbacks=['codellama'], temperature=0)
 
-model_config_coding = model_configs['oai-gpt4']
-llm_config_coding = {
-    'timeout': 600,
-    'cache_seed': model_config_coding['cache_seed'],
-    'config_list': [model_config_coding['llm_config']],
-    'temperature': 0,
-}
+# == Code execution ====================================================================================
+#
+# Code blocks run in a shared pool of pre-started Python/Node workers (hello_autogen/executors.py): one block per
+# process, each in its own temp dir with CPU/memory/time limits, at most 2 at once. Files they write are copied
+# to `output` as before.
+
+code_executors = get_executor_pool(warm=2, max_concurrency=2, timeout=60, cpu_seconds=30, memory_mb=512)
 
 # == Assistant Config ==================================================================================
 
 terminateKeyword = "[TERMINATE]"
 
-user_proxy = autogen.UserProxyAgent(
-    name="UserProxy",
-    is_termination_msg=lambda x: x.get("content", "").rstrip().endswith(terminateKeyword),
-    description="""an assistant with strong communication skills""",
-    system_message=f"""Reply {terminateKeyword} without punctuation if the task has been solved at full satisfaction""",
-    code_execution_config={
-        'work_dir': 'output',
-        'use_docker': False,
-    },
-    human_input_mode="NEVER",
-    llm_config=llm_config_conversational,
-)
-
-writer = autogen.AssistantAgent(
-    name="Writer",
-    llm_config=llm_config_conversational,
-    description="""an helpful assistant with strong writing skills who can communicate clearly and without fluff""",
-    system_message="""You are a senior editor and acclaimed writer with exceptional skill in engaging and concise storytelling""",
-)
-
-engineer_python = autogen.AssistantAgent(
-    name="PythonEngineer",
-    llm_config=llm_config_coding,
-    description="""an assistant with strong software engineering skills specialized in python programming language""",
-    system_message="""You are a senior python engineer.""",
-)
-
-engineer_javascript = autogen.AssistantAgent(
-    name="JavascriptEngineer",
-    llm_config=llm_config_coding,
-    description="""an assistant with strong software engineering skills specialized in javascript programming language""",
-    system_message="""You are a senior javascript engineer.""",
-)
-
-groupchat = autogen.GroupChat(
-    agents=[user_proxy, writer, engineer_python, engineer_javascript],
-    messages=[],
-    max_round=10
-)
-
-manager = autogen.GroupChatManager(
-    groupchat=groupchat,
-    llm_config=llm_config_conversational_advanced
-)
+# Extra terms for local speaker selection, on top of each agent's name, description and system message
+speaker_keywords = {
+    'Writer': ['joke', 'story', 'poem', 'essay'],
+    'PythonEngineer': ['dataframe', 'pandas', 'numpy', 'django', 'flask', 'py'],
+    'JavascriptEngineer': ['react', 'node', 'typescript', 'js', 'html', 'css'],
+}
 
 # == Prompt ====================================================================================
 
@@ -144,11 +73,217 @@ task = with_termination_notice("""Tell me a very short story.""")
 # task = with_termination_notice("""Write a react js function to show 1 to n boxes on the screen. the variable n should come from a prop call "count" """)
 # task = with_termination_notice("""How do I create a dataframe? """)
 
-# == Chat Execution ====================================================================================
+# == Termination ====================================================================================
+#
+# Chats end as soon as the answer is delivered - on the keyword, a thank-you, a repeated message or a "task is
+# done" reply - instead of after rounds of pleasantries. Every agent that checks for termination gets its own
+# detector, reset at the start of each chat.
+
+termination_detector = lambda: TerminationDetector(
+    terminateKeyword, boilerplate=[with_termination_notice('')], max_round=10,
+)
 
-result = user_proxy.initiate_chat(
-    manager,
-    message=task
+# == Chat mode ====================================================================================
+#
+# "group-chat": the manager picks one speaker per round.
+# "fan-out": the task goes to the fan-out agents at the same time and their answers are merged, so a round takes
+# as long as the slowest of them - for tasks any of them can answer on their own.
+
+CHAT_MODE = "group-chat"
+# CHAT_MODE = "fan-out"
+
+# == History compaction ====================================================================================
+#
+# Before each LLM call (including the manager's "who speaks next" call) older rounds are summarised and the
+# termination notice is kept only once, so prompts stay within each model's `prompt_budget`.
+
+# summaries are redone every 4 turns rather than every turn, so the prompt prefix backends cache stays put
+history_compactor = HistoryCompactor(
+    models=models, keep_last=4, step=4, boilerplate=[with_termination_notice('')],
 )
+# counts the prompt tokens that repeat an agent's previous prompt (hello_autogen/prefix.py)
+prefix_tracker = PrefixTracker()
+# calls in flight per model are capped at the registry's `max_concurrency`, e.g. across the threads of a batch run
+backend_limiter = get_backend_limiter(models=models, timeout=30)
+# every LLM call is timed per agent and model; the table is logged after the chat
+call_metrics = get_metrics('example-02-autogen-group-chat')
+
+# == Model routing ====================================================================================
+#
+# With ROUTE_MODELS each LLM call goes to the cheapest model tier that should handle it - local mistral /
+# codellama, then gpt-3.5, then gpt-4 - based on the prompt length, the kind of task and the agent, and is sent
+# one tier up when the reply comes back empty, refused or cut off (hello_autogen/routing.py). The agents' own
+# configs below are only used for calls the router can't take (e.g. images). The user proxy only decides when
+# the chat is over, so it stays on the local tier.
+
+ROUTE_MODELS = True
+
+agent_roles = {'UserProxy': -0.5}
+
+# == Speculative replies ====================================================================================
+#
+# With RACE_REPLIES the Writer's and the PythonEngineer's calls go to a local model and gpt-3.5 at the same time
+# and the first reply that passes the router's checks wins (hello_autogen/speculative.py), so one slow backend
+# doesn't set the latency. The price is the losing model's compute, and its tokens when that is gpt-3.5.
+
+RACE_REPLIES = True
+
+race_candidates = {
+    'Writer': ['mistral', 'oai-gpt35'],
+    'PythonEngineer': ['codellama', 'oai-gpt35'],
+}
+
+# == Budgets ====================================================================================
+#
+# With BUDGET_CHATS the chat is held to chat_budget, and each agent to its agent_budgets entry, as it runs
+# (hello_autogen/budgets.py): from 80% of a budget on, the agent's calls go to the local mistral model, and when a
+# budget is used up the chat is stopped there. Dollars are estimated from the tokens.
+
+BUDGET_CHATS = True
+
+chat_budget = {'dollars': 0.50, 'tokens': 60000, 'seconds': 300}
+agent_budgets = {
+    'UserProxy': {'tokens': 8000},
+    'Writer': {'dollars': 0.20},
+    'PythonEngineer': {'dollars': 0.25},
+    'JavascriptEngineer': {'dollars': 0.25},
+}
+
+# == Conversation store ====================================================================================
+#
+# Running this script stores the group chat in conversations.db (hello_autogen/store.py) under a new session id,
+# which is logged at the end. Set RESUME_SESSION to that id to carry on from a summary of the conversation plus
+# its last RESUME_WINDOW messages instead of starting over. `build_agents` itself stores nothing, so batch runs
+# and benchmarks aren't recorded.
+
+RESUME_SESSION = os.getenv('RESUME_SESSION')
+RESUME_WINDOW = 12
+
+# == Agents ====================================================================================
+#
+# Built by a function so other tools (bench/, batch runs) can create as many independent agent graphs as they
+# need; running this script builds one and chats once.
+
+def build_agents():
+    user_proxy_termination = termination_detector()
+    manager_termination = termination_detector()
+    fan_out_termination = termination_detector()
+
+    user_proxy = PooledUserProxyAgent(
+        name="UserProxy",
+        is_termination_msg=user_proxy_termination,
+        description="""an assistant with strong communication skills""",
+        system_message=f"""Reply {terminateKeyword} without punctuation if the task has been solved at full satisfaction""",
+        code_execution_config={
+            'work_dir': 'output',
+            'use_docker': False,
+        },
+        executor_pool=code_executors,
+        human_input_mode="NEVER",
+        llm_config=llm_config_conversational,
+    )
+
+    writer = autogen.AssistantAgent(
+        name="Writer",
+        llm_config=llm_config_conversational,
+        description="""an helpful assistant with strong writing skills who can communicate clearly and without fluff""",
+        system_message="""You are a senior editor and acclaimed writer with exceptional skill in engaging and concise storytelling""",
+    )
+
+    engineer_python = autogen.AssistantAgent(
+        name="PythonEngineer",
+        llm_config=llm_config_coding,
+        description="""an assistant with strong software engineering skills specialized in python programming language""",
+        system_message="""You are a senior python engineer.""",
+    )
+
+    engineer_javascript = autogen.AssistantAgent(
+        name="JavascriptEngineer",
+        llm_config=llm_config_coding,
+        description="""an assistant with strong software engineering skills specialized in javascript programming language""",
+        system_message="""You are a senior javascript engineer.""",
+    )
+
+    # the manager's LLM is only asked to pick a speaker when the local selector isn't confident
+    groupchat = HeuristicGroupChat(
+        agents=[user_proxy, writer, engineer_python, engineer_javascript],
+        messages=[],
+        max_round=10,
+        speaker_selector=KeywordSpeakerSelector(keywords=speaker_keywords),
+        history_compactor=history_compactor,
+        metrics=call_metrics,
+    )
+
+    manager = autogen.GroupChatManager(
+        groupchat=groupchat,
+        llm_config=llm_config_conversational_advanced,
+        is_termination_msg=manager_termination,
+    )
+
+    fan_out = FanOutManager(
+        [engineer_python, engineer_javascript],
+        # [writer, engineer_python],
+        timeout=120,
+        is_termination_msg=fan_out_termination,
+    )
+
+    # one router per agent graph, so the cost of its calls can be told apart
+    router = ModelRouter(models, roles=agent_roles) if ROUTE_MODELS else None
+    racer = SpeculativeRacer(models, race_candidates) if RACE_REPLIES else None
+    budget = ChatBudget(models, session=chat_budget, agents=agent_budgets) if BUDGET_CHATS else None
+    # the racer picks the models of its agents' calls and the router those of the others, except for calls the
+    # budget downgraded; all go before compaction, which compacts to the chosen model's budget
+    stages = [call_metrics] + [stage for stage in (budget, racer, router) if stage is not None] + [
+        history_compactor, prefix_tracker, backend_limiter,
+    ]
+    reply_pipeline = ReplyPipeline(stages, models=models)
+    for agent in groupchat.agents:
+        reply_pipeline.install(agent)
+
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        writer=writer,
+        engineer_python=engineer_python,
+        engineer_javascript=engineer_javascript,
+        groupchat=groupchat,
+        manager=manager,
+        fan_out=fan_out,
+        router=router,
+        racer=racer,
+        budget=budget,
+        terminations=[user_proxy_termination, manager_termination, fan_out_termination],
+    )
+
+# == Chat Execution ====================================================================================
 
-logging.info(pformat(result))
+if __name__ == "__main__":
+    agents = build_agents()
+    session_id = RESUME_SESSION or uuid.uuid4().hex
+    conversation_log = get_store(window=RESUME_WINDOW).log(session_id, 'example-02-autogen-group-chat')
+    agents.groupchat.conversation_log = conversation_log
+    if RESUME_SESSION:
+        seed_group_chat(agents.manager, conversation_log.load())
+    if agents.budget is not None:
+        agents.budget.start()
+    try:
+        result = agents.user_proxy.initiate_chat(
+            agents.fan_out if CHAT_MODE == "fan-out" else agents.manager,
+            message=task,
+            clear_history=False,
+        )
+        logging.info("%s", pretty(result))
+    except BudgetExceeded as e:
+        logging.warning("chat stopped: %s", e)
+    logging.info("speaker selection: %s", agents.groupchat.speaker_selector.stats)
+    logging.info("fan-out: %s", agents.fan_out.stats)
+    logging.info("termination: %s", [termination.stats for termination in agents.terminations])
+    logging.info("history compaction: %s", history_compactor.stats)
+    logging.info("prompt prefixes: %s", prefix_tracker.stats)
+    if agents.budget is not None:
+        logging.info("budget: %s spent, %s", agents.budget.usage(), agents.budget.stats)
+    if agents.router is not None:
+        logging.info("model routing: %s (routed calls cost $%.4f)", agents.router.stats, agents.router.cost())
+    if agents.racer is not None:
+        logging.info("speculative replies: %s (candidates cost $%.4f)", agents.racer.stats, agents.racer.cost())
+    logging.info("LLM calls:\n%s", lazy(call_metrics.markdown))
+    logging.info("conversation stored, set RESUME_SESSION=%s to carry on", session_id)
@@ -1,200 +1,511 @@
-import autogen
-import panel
+import asyncio
 import os
+import time
+import panel
 import logging
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from hello_autogen.admission import AdmissionRejected, BackendBusy, RateLimited, get_admission_controller, get_backend_limiter
+from hello_autogen.clients import get_micro_batcher
+from hello_autogen.history import HistoryCompactor
+from hello_autogen.logging_setup import setup_logging
+from hello_autogen.metrics import get_metrics, metrics_pane
+from hello_autogen.models import HEALTH_TTL, ModelRegistry
+from hello_autogen.prefix import PrefixTracker
+from hello_autogen.response_cache import get_cache, hashed_embedding
+from hello_autogen.sessions import SessionPoolFull, current_session_id, get_pool, persistent_session_id
+from hello_autogen.startup import StartupTimer, lazy_import, lazy_value, prewarm
+from hello_autogen.store import get_store, seed_group_chat
+from hello_autogen.streaming import PanelStreamer
+from hello_autogen.termination import TerminationDetector
+from hello_autogen.ui import MessageBatcher
+
+# == Startup ====================================================================================
+#
+# Panel runs this script for every browser session, so it only defines things: autogen (imported inside
+# `build_session`), the model configs (which probe the endpoints) and the code executors load on first use, and
+# are pre-warmed in the background once the server is listening (hello_autogen/startup.py). `npm run
+# panel:example3` serves with `--warm`, so that happens at startup instead of on the first visit. Each run of the
+# script is timed against STARTUP_BUDGET.
+
+STARTUP_BUDGET = 0.5
+
+startup_timer = StartupTimer('example-03-chatbot', budget=STARTUP_BUDGET)
 
 load_dotenv()
-OPEN_AI_API_KEY = os.getenv('OPEN_AI_API_KEY')
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+
+# formatting and file writes happen on a background thread; debug.log rotates at 10MB
+setup_logging("debug.log", level=logging.INFO)
 
 # ENABLE_CACHE = True
 ENABLE_CACHE = False
 
-# == Model Config ====================================================================================
+# == LLM Config ====================================================================================
+#
+# Models are defined once in hello_autogen/models.py. Listing fallbacks lets autogen fail over (e.g. from the
+# local LiteLLM proxy to OpenAI) and the registry drops fallbacks that are down or not configured.
+#
+# The configs are built once per server and rebuilt in the background every HEALTH_TTL seconds, so a model that
+# goes down (or comes back) is still noticed.
 
-model_configs = {
-    'oai-gpt35': {
-        'llm_config': {
-            'model': 'gpt-3.5-turbo-16k',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed':  1000 if ENABLE_CACHE else None,
-    },
-    'oai-gpt4': {
-        'llm_config': {
-            'model': 'gpt-4-turbo-preview',
-            'api_key': OPEN_AI_API_KEY
-        },
-        'cache_seed': 1001 if ENABLE_CACHE else None,
-    },
-    'mistral': {
-        'llm_config': {
-            'base_url': 'http://0.0.0.0:59991',
-            'model': 'mistral',
-            'api_key': 'NULL',
-        },
-        'cache_seed': 1003 if ENABLE_CACHE else None,
-    },
-    'codellama': {
-        'llm_config': {
-            'base_url': 'http://0.0.0.0:59993',
-            'model': 'codellama',
-            'api_key': 'NULL',
-        },
-        'cache_seed': 1005 if ENABLE_CACHE else None,
-    },
-}
+models = ModelRegistry(enable_cache=ENABLE_CACHE)
 
-# == LLM Config ====================================================================================
+llm_config_conversational = lazy_value(
+    'example-03-chatbot:conversational', models.llm_config, 'mistral', fallbacks=['oai-gpt35'], temperature=0,
+    max_age=HEALTH_TTL,
+)
+llm_config_conversational_gpt4 = lazy_value(
+    'example-03-chatbot:conversational-gpt4', models.llm_config, 'oai-gpt4', fallbacks=['oai-gpt35'],
+    temperature=0, max_age=HEALTH_TTL,
+)
+llm_config_coding = lazy_value(
+    'example-03-chatbot:coding', models.llm_config, 'oai-gpt35', fallbacks=['codellama'], temperature=0,
+    max_age=HEALTH_TTL,
+)
 
-model_config_conversation = model_configs['mistral']
-llm_config_conversational = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation['cache_seed'],
-    'config_list': [model_config_conversation['llm_config']],
-    'temperature': 0,
-}
+# == Code execution ====================================================================================
+#
+# Code blocks run in a shared pool of pre-started Python/Node workers (hello_autogen/executors.py): one block per
+# process, each in its own temp dir with CPU/memory/time limits, at most 4 at once. Files they write are copied
+# to `output` as before.
+
+code_executors = lazy_value(
+    'example-03-chatbot:executors', 'hello_autogen.executors:get_executor_pool',
+    warm=2, max_concurrency=4, timeout=60, cpu_seconds=30, memory_mb=512,
+)
 
-model_config_conversation_gpt4 = model_configs['oai-gpt4']
-llm_config_conversational_gpt4 = {
-    'timeout': 600,
-    'cache_seed': model_config_conversation_gpt4['cache_seed'],
-    'config_list': [model_config_conversation_gpt4['llm_config']],
-    'temperature': 0,
+# everything `build_session` needs, loaded before the first session is built
+startup_values = [
+    lazy_import('autogen'),
+    lazy_import('hello_autogen.budgets'),
+    lazy_import('hello_autogen.executors'),
+    lazy_import('hello_autogen.pipeline'),
+    lazy_import('hello_autogen.routing'),
+    lazy_import('hello_autogen.speculative'),
+    lazy_import('hello_autogen.speaker_selection'),
+    llm_config_conversational,
+    llm_config_conversational_gpt4,
+    llm_config_coding,
+    code_executors,
+]
+prewarm(*startup_values)
+startup_timer.mark('config')
+
+# == Model routing ====================================================================================
+#
+# With ROUTE_MODELS each LLM call goes to the cheapest model tier that should handle it - local mistral /
+# codellama, then gpt-3.5, then gpt-4 - based on the prompt length, the kind of task and the agent, and is sent
+# one tier up when the reply comes back empty, refused or cut off (hello_autogen/routing.py). The agents' own
+# configs above are only used for calls the router can't take. The user proxy only decides when the chat is
+# over, so it stays on the local tier.
+
+ROUTE_MODELS = True
+
+agent_roles = {'UserProxy': -0.5}
+
+# == Speculative replies ====================================================================================
+#
+# With RACE_REPLIES the Writer's and the PythonEngineer's calls go to a local model and gpt-3.5 at the same time
+# and the first reply that passes the router's checks wins (hello_autogen/speculative.py), so one slow backend
+# doesn't set the latency. The price is the losing model's compute, and its tokens when that is gpt-3.5. Raced
+# replies aren't streamed.
+
+RACE_REPLIES = True
+
+race_candidates = {
+    'Writer': ['mistral', 'oai-gpt35'],
+    'PythonEngineer': ['codellama', 'oai-gpt35'],
 }
 
-model_config_coding = model_configs['oai-gpt35']
-llm_config_coding = {
-    'timeout': 600,
-    'cache_seed': model_config_coding['cache_seed'],
-    'config_list': [model_config_coding['llm_config']],
-    'temperature': 0,
+# == Budgets ====================================================================================
+#
+# With BUDGET_CHATS each chat sequence is held to chat_budget, and each agent within it to its agent_budgets
+# entry, as it runs (hello_autogen/budgets.py): from 80% of a budget on, the agent's calls go to the local
+# mistral model, and when a budget is used up the chat is stopped there. Dollars are estimated from the tokens.
+
+BUDGET_CHATS = True
+
+chat_budget = {'dollars': 0.50, 'tokens': 60000, 'seconds': 300}
+agent_budgets = {
+    'UserProxy': {'tokens': 8000},
+    'Writer': {'dollars': 0.20},
+    'PythonEngineer': {'dollars': 0.25},
+    'JavascriptEngineer': {'dollars': 0.25},
 }
 
 # == Assistant Config ==================================================================================
 
 terminateKeyword = "[TERMINATE]"
 
-user_proxy = autogen.UserProxyAgent(
-    name="UserProxy",
-    is_termination_msg=lambda x: x.get("content", "").rstrip().endswith(terminateKeyword),
-    description="""A project manager with strong communication skills that only interacts when assistants cannot answer or to terminate chat""",
-    system_message=f"""Reply {terminateKeyword} without punctuation if the task has been solved at full satisfaction. You only interact when assistants cannot answer satisfactorily or to terminate conversation""",
-    code_execution_config={
-        'work_dir': 'output',
-        'use_docker': False,
-    },
-    human_input_mode="NEVER",
-    llm_config=llm_config_conversational,
-)
+# Extra terms for local speaker selection, on top of each agent's name, description and system message
+speaker_keywords = {
+    'Writer': ['joke', 'story', 'poem', 'essay'],
+    'PythonEngineer': ['dataframe', 'pandas', 'numpy', 'django', 'flask', 'py'],
+    'JavascriptEngineer': ['react', 'node', 'typescript', 'js', 'html', 'css'],
+}
 
-writer = autogen.AssistantAgent(
-    name="Writer",
-    llm_config=llm_config_conversational,
-    description="""a helpful assistant with strong writing skills who can communicate clearly and without fluff""",
-    system_message="""You are a senior editor and acclaimed writer with exceptional skill in engaging and concise storytelling""",
-)
+agent_avatars = {
+    'UserProxy': "👨‍💼",
+    'Writer': "👩‍💻",
+    'PythonEngineer': "👩‍🔬",
+    'JavascriptEngineer': "👨‍🚀",
+}
 
-engineer_python = autogen.AssistantAgent(
-    name="PythonEngineer",
-    llm_config=llm_config_coding,
-    description="""an assistant with strong software engineering skills specialized in python programming language""",
-    system_message="""You are a senior python engineer.""",
+# == Prompt ====================================================================================
+
+with_termination_notice = lambda task: task + (
+        '\n\nDo not show appreciation in your responses, say only what is necessary. '
+        'if "Thank you" or "You\'re welcome" are said in the conversation, then say ' + terminateKeyword + ' '
+                                                                                                           'to indicate the conversation is finished and this is your last message.'
 )
 
-engineer_javascript = autogen.AssistantAgent(
-    name="JavascriptEngineer",
-    llm_config=llm_config_coding,
-    description="""an assistant with strong software engineering skills specialized in javascript programming language""",
-    system_message="""You are a senior javascript engineer.""",
+# == Termination ====================================================================================
+#
+# Chats end as soon as the answer is delivered - on the keyword, a thank-you, a repeated message or a "task is
+# done" reply - instead of after rounds of pleasantries. Every agent that checks for termination gets its own
+# detector, reset at the start of each chat.
+
+termination_detector = lambda: TerminationDetector(
+    terminateKeyword, boilerplate=[with_termination_notice('')], max_round=10,
 )
 
-groupchat = autogen.GroupChat(
-    agents=[user_proxy, writer, engineer_python, engineer_javascript],
-    messages=[],
-    max_round=10
+# == Reply pipeline ====================================================================================
+#
+# Replies are cached per model in memory for the whole server (on top of the cache_seed disk cache when ENABLE_CACHE
+# is on), so repeated or rephrased questions don't reach Ollama or OpenAI again (rephrasings match by
+# `hashed_embedding` similarity, at a threshold that keeps "... in reverse" apart). Histories are compacted to each
+# model's `prompt_budget` before every call, and with STREAM_REPLIES the replies that do go to a model are streamed
+# token by token into the chat window.
+#
+# Calls to the local models share keep-alive connections (set up by the registry), and with BATCH_REQUESTS the calls
+# several sessions make to the same local model within a few milliseconds are released to it at the same moment, so
+# a batching server (e.g. Ollama with OLLAMA_NUM_PARALLEL) schedules them in one go (hello_autogen/clients.py).
+
+STREAM_REPLIES = True
+BATCH_REQUESTS = True
+
+response_cache = get_cache(
+    'example-03-chatbot',
+    max_entries=1024,
+    ttl=60 * 60,
+    embed=hashed_embedding,
+    boilerplate=[with_termination_notice('')],
 )
-manager = autogen.GroupChatManager(
-    groupchat=groupchat,
-    llm_config=llm_config_conversational_gpt4
+# summaries are redone every 4 turns rather than every turn, so the prompt prefix backends cache stays put
+history_compactor = HistoryCompactor(
+    models=models, keep_last=4, step=4, boilerplate=[with_termination_notice('')],
 )
+# counts the prompt tokens that repeat an agent's previous prompt (hello_autogen/prefix.py)
+prefix_tracker = PrefixTracker()
+micro_batcher = get_micro_batcher('example-03-chatbot', models=models, window=0.02) if BATCH_REQUESTS else None
 
-# == Prompt ====================================================================================
+# == Admission control
+#
+# At most MAX_RUNNING_CHATS chat sequences run at once across all sessions. Further messages wait in a queue of
+# up to MAX_QUEUED_CHATS, and their senders see their place in it; beyond that, or after two minutes in the
+# queue, they are turned away with a "try again" instead of piling up. Each user (by the session id in the URL)
+# can start 6 chats a minute. Calls to each model are capped at its `max_concurrency` from the registry
+# (hello_autogen/admission.py): a call that gets no slot within 30s fails fast - or, when routed, moves up a tier.
+#
+# Run as several worker processes (`npm run deploy:example3`, hello_autogen/deploy.py), each worker takes its
+# share of these limits; a user's requests all go to the same worker, so the per-user rate holds as it is.
 
-with_termination_notice = lambda task: task + (
-        '\n\nDo not show appreciation in your responses, say only what is necessary. '
-        'if "Thank you" or "You\'re welcome" are said in the conversation, then say ' + terminateKeyword + ' '
-                                                                                                           'to indicate the conversation is finished and this is your last message.'
+MAX_RUNNING_CHATS = 4
+MAX_QUEUED_CHATS = 16
+WORKERS = int(os.getenv('PANEL_WORKERS', '1'))
+
+admission = get_admission_controller(
+    'example-03-chatbot', max_running=max(1, MAX_RUNNING_CHATS // WORKERS),
+    max_queue=max(1, MAX_QUEUED_CHATS // WORKERS), queue_timeout=120,
+    rate=6, per=60, burst=3,
 )
+backend_limiter = get_backend_limiter(models=models, timeout=30, workers=WORKERS)
+
+# == Call metrics
+#
+# Every LLM call is timed per agent and model (see hello_autogen/metrics.py). With SHOW_METRICS the calls of the
+# last chat sequence are shown under the chat; METRICS_JSONL appends every call to a JSON lines file and
+# METRICS_PROMETHEUS rewrites a Prometheus textfile after each sequence.
+
+SHOW_METRICS = True
+
+call_metrics = get_metrics('example-03-chatbot', jsonl_path=os.getenv('METRICS_JSONL'))
+
+# == Conversation store
+#
+# Every group chat message is appended to a SQLite file (hello_autogen/store.py, CONVERSATION_STORE to move it)
+# under the browser's persistent session id - the `?session=...` Panel adds to the URL - so a user who reloads
+# or reconnects sees where the conversation left off. With RESUME_CONVERSATIONS each chat sequence carries on
+# from a summary of the conversation plus its last RESUME_WINDOW messages rather than from an empty group chat;
+# the prompt still doesn't grow across sequences, and the full history is never loaded back.
+
+STORE_CONVERSATIONS = True
+RESUME_CONVERSATIONS = True
+RESUME_WINDOW = 12
+
+conversation_store = get_store(os.getenv('CONVERSATION_STORE'), window=RESUME_WINDOW) if STORE_CONVERSATIONS else None
 
 # === Panel integration ===========================================================================
 # === Thanks: https://github.com/yeyu2/Youtube_demos/blob/main/panel_autogen_2.py
 
-avatar = {
-    user_proxy.name: "👨‍💼",
-    writer.name: "👩‍💻",
-    engineer_python.name: "👩‍🔬",
-    engineer_javascript.name: "👨‍🚀",
-}
-
-# Print each agent message to chat window
-def print_messages(recipient, messages, sender, config):
+# Print each agent message to chat window as soon as the agent receives it. Registered as an async reply
+# function so it runs inside `a_generate_reply` without blocking the Panel event loop.
+async def print_messages(recipient, messages, sender, config):
+    batcher = config['batcher']
     content = messages[-1]['content']
 
+    # streamed replies are already on screen
+    if config['streamer'] is not None and config['streamer'].was_shown(content):
+        return False, None
+
+    # shown with whatever else is said within the same frame (hello_autogen/ui.py)
     if all(key in messages[-1] for key in ['name']):
-        chat_interface.send(content, user=messages[-1]['name'], avatar=avatar[messages[-1]['name']], respond=False)
+        batcher.post(content, messages[-1]['name'])
     else:
-        chat_interface.send(content, user=recipient.name, avatar=avatar[recipient.name], respond=False)
+        batcher.post(content, recipient.name)
 
     # tells autogen to continue agent communication
     return False, None
 
-# Kick off an autogen chat sequence on each message entered into chat UI & print cost message at end of sequence
-def perform_chat_sequence(contents: str, user: str, instance: panel.chat.ChatInterface):
-    result = user_proxy.initiate_chat(manager, message=with_termination_notice(contents))
-    total_cost = 0
+# == Session factory
+#
+# Every browser session gets its own agents, GroupChat and manager, so sessions never share (or grow) one
+# `groupchat.messages` list. Sessions are kept in a bounded pool that outlives script re-execution by Panel.
+
+session_pool = get_pool('example-03-chatbot', max_sessions=32, idle_timeout=15 * 60)
+
+def build_session(chat_interface):
+    # waits for the prewarm thread (or loads them here), so a session built right away (bench/) doesn't race it
+    for value in startup_values:
+        value.get()
+    import autogen
+    from hello_autogen.budgets import ChatBudget
+    from hello_autogen.executors import PooledUserProxyAgent
+    from hello_autogen.pipeline import ReplyPipeline
+    from hello_autogen.routing import ModelRouter
+    from hello_autogen.speculative import SpeculativeRacer
+    from hello_autogen.speaker_selection import HeuristicGroupChat, KeywordSpeakerSelector
+
+    session_metrics = call_metrics.for_session(current_session_id())
+    user_proxy_termination = termination_detector()
+    manager_termination = termination_detector()
+
+    user_proxy = PooledUserProxyAgent(
+        name="UserProxy",
+        is_termination_msg=user_proxy_termination,
+        description="""A project manager with strong communication skills that only interacts when assistants cannot answer or to terminate chat""",
+        system_message=f"""Reply {terminateKeyword} without punctuation if the task has been solved at full satisfaction. You only interact when assistants cannot answer satisfactorily or to terminate conversation""",
+        code_execution_config={
+            'work_dir': 'output',
+            'use_docker': False,
+        },
+        executor_pool=code_executors.get(),
+        human_input_mode="NEVER",
+        llm_config=llm_config_conversational.get(),
+    )
+
+    writer = autogen.AssistantAgent(
+        name="Writer",
+        llm_config=llm_config_conversational.get(),
+        description="""a helpful assistant with strong writing skills who can communicate clearly and without fluff""",
+        system_message="""You are a senior editor and acclaimed writer with exceptional skill in engaging and concise storytelling""",
+    )
+
+    engineer_python = autogen.AssistantAgent(
+        name="PythonEngineer",
+        llm_config=llm_config_coding.get(),
+        description="""an assistant with strong software engineering skills specialized in python programming language""",
+        system_message="""You are a senior python engineer.""",
+    )
+
+    engineer_javascript = autogen.AssistantAgent(
+        name="JavascriptEngineer",
+        llm_config=llm_config_coding.get(),
+        description="""an assistant with strong software engineering skills specialized in javascript programming language""",
+        system_message="""You are a senior javascript engineer.""",
+    )
+
+    # the session's messages are stored as they are said, under the id in the URL rather than Panel's session id
+    # (there is none when the flow is driven by bench/ or a batch run, which aren't recorded)
+    conversation_log = None
+    if conversation_store is not None and stored_session_id is not None:
+        conversation_log = conversation_store.log(stored_session_id, 'example-03-chatbot')
+
+    # the manager's LLM is only asked to pick a speaker when the local selector isn't confident
+    groupchat = HeuristicGroupChat(
+        agents=[user_proxy, writer, engineer_python, engineer_javascript],
+        messages=[],
+        max_round=10,
+        speaker_selector=KeywordSpeakerSelector(keywords=speaker_keywords),
+        history_compactor=history_compactor,
+        metrics=session_metrics,
+        conversation_log=conversation_log,
+    )
+    manager = autogen.GroupChatManager(
+        groupchat=groupchat,
+        llm_config=llm_config_conversational_gpt4.get(),
+        is_termination_msg=manager_termination,
+    )
+
+    streamer = PanelStreamer(
+        chat_interface, agent_avatars, batcher=message_batcher, models=models,
+    ) if STREAM_REPLIES else None
+    # one router per session, so the Accountant can add up what the session's routed calls cost
+    router = ModelRouter(models, roles=agent_roles) if ROUTE_MODELS else None
+    racer = SpeculativeRacer(models, race_candidates) if RACE_REPLIES else None
+    budget = ChatBudget(models, session=chat_budget, agents=agent_budgets) if BUDGET_CHATS else None
+    # the budget goes before racing and routing, which leave the calls it downgrades alone; racing and routing go
+    # before the cache and compaction, which work per chosen model; only calls that get past the cache take a
+    # backend slot
+    stages = [session_metrics] + [
+        stage for stage in (
+            budget, racer, router, response_cache, history_compactor, prefix_tracker, backend_limiter, micro_batcher, streamer,
+        ) if stage is not None
+    ]
+    reply_pipeline = ReplyPipeline(stages, models=models)
+    for agent in groupchat.agents:
+        reply_pipeline.install(agent)
+
+    # == Register message sending with each agent
+    for agent in [user_proxy, writer, engineer_python, engineer_javascript]:
+        agent.register_reply(
+            [autogen.Agent, None],
+            reply_func=print_messages,
+            config={"batcher": message_batcher, "streamer": streamer},
+        )
+
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        groupchat=groupchat,
+        manager=manager,
+        terminations=[user_proxy_termination, manager_termination],
+        router=router,
+        racer=racer,
+        streamer=streamer,
+        budget=budget,
+        conversation_log=conversation_log,
+    )
 
-    for costInfo in result.cost:
-        total_cost += costInfo['total_cost']
+# Kick off an autogen chat sequence on each message entered into chat UI & print cost message at end of sequence.
+# The callback is a coroutine built on `a_initiate_chat`: LLM calls are awaited (autogen runs the blocking OpenAI
+# client in an executor), so a long group chat in one session doesn't hold the Panel server for every other session.
+async def run_chat_sequence(contents: str, instance: panel.chat.ChatInterface):
+    # normally pre-warmed already; otherwise wait for the imports and configs off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, lambda: [value.get() for value in startup_values])
+    from hello_autogen.budgets import BudgetExceeded
+    try:
+        session = session_pool.acquire(current_session_id(), lambda: build_session(instance))
+    except SessionPoolFull:
+        instance.send("The server is at capacity, please try again in a moment.", user="System", respond=False)
+        return
+
+    started = time.time()
+    # routed, raced and streamed calls are made with the stages' own clients rather than the agents'
+    stages_cost = lambda: sum(
+        stage.cost() for stage in (session.state.router, session.state.racer, session.state.streamer)
+        if stage is not None
+    )
+    cost_before = stages_cost()
+    try:
+        # with a stored conversation, each chat sequence starts from its summary and last few messages, so the
+        # prompt doesn't grow across sequences; otherwise the session's group chat carries on where it left off
+        if RESUME_CONVERSATIONS and session.state.conversation_log is not None:
+            context = await asyncio.get_running_loop().run_in_executor(None, session.state.conversation_log.load)
+            seed_group_chat(session.state.manager, context)
+        for termination in session.state.terminations:
+            termination.reset()
+        if session.state.budget is not None:
+            session.state.budget.start()
+        result = None
+        try:
+            result = await session.state.user_proxy.a_initiate_chat(
+                session.state.manager,
+                message=with_termination_notice(contents),
+                clear_history=False,
+            )
+        except BudgetExceeded as e:
+            message_batcher.flush()
+            instance.send(f"Stopped here: {e}.", user="System", respond=False)
+    finally:
+        session_pool.release(session)
+
+    if result is not None:
+        total_cost = stages_cost() - cost_before
+        for costInfo in result.cost:
+            total_cost += costInfo['total_cost']
+    else:
+        # autogen never summed up the agents' usage; the budget's estimate covers every call it saw
+        total_cost = session.state.budget.usage()['dollars']
     total_cost_dollars = '${:,.2f}'.format(total_cost)
-    chat_interface.send(total_cost_dollars, user="Accountant", avatar="🤑", respond=False)
+    message_batcher.flush()
+    instance.send(total_cost_dollars, user="Accountant", avatar="🤑", respond=False)
+    logging.info("response cache: %s", response_cache.stats())
+    logging.info("history compaction: %s", history_compactor.stats)
+    logging.info("prompt prefixes: %s", prefix_tracker.stats)
+    if session.state.budget is not None:
+        logging.info("budget: %s spent, %s", session.state.budget.usage(), session.state.budget.stats)
+    logging.info("termination: %s", [termination.stats for termination in session.state.terminations])
+    if SHOW_METRICS:
+        metrics_view.object = call_metrics.markdown(session=session.id, since=started)
+    if os.getenv('METRICS_PROMETHEUS'):
+        call_metrics.write_prometheus(os.getenv('METRICS_PROMETHEUS'))
 
-# == Register message sending with each agent
+# Admit each message before its chat sequence runs; while it waits, the sender sees their place in the queue
+async def perform_chat_sequence(contents: str, user: str, instance: panel.chat.ChatInterface):
+    queue_message = None
 
-user_proxy.register_reply(
-    [autogen.Agent, None],
-    reply_func=print_messages,
-    config={"callback": None},
-)
+    def show_position(position):
+        nonlocal queue_message
+        wait = admission.estimated_wait(position)
+        text = f"All agents are busy, you are number {position} in the queue" + (
+            f" (about {wait:.0f}s)." if wait is not None else "."
+        )
+        if queue_message is None:
+            queue_message = instance.send(text, user="System", respond=False)
+        else:
+            queue_message.object = text
+
+    try:
+        async with admission.admit(stored_session_id or current_session_id(), on_position=show_position):
+            if queue_message is not None:
+                queue_message.object = "Your turn, starting now."
+            await run_chat_sequence(contents, instance)
+    except RateLimited as e:
+        instance.send(f"Too many messages, please try again in {e.retry_after:.0f}s.", user="System", respond=False)
+    except AdmissionRejected:
+        instance.send("The server is busy, please try again in a moment.", user="System", respond=False)
+    except BackendBusy as e:
+        logging.warning("chat sequence given up: %s", e)
+        instance.send("The models are busy, please try again in a moment.", user="System", respond=False)
+    logging.info("admission: %s", admission.stats)
 
-writer.register_reply(
-    [autogen.Agent, None],
-    reply_func=print_messages,
-    config={"callback": None},
-)
-engineer_python.register_reply(
-    [autogen.Agent, None],
-    reply_func=print_messages,
-    config={"callback": None},
-)
-engineer_javascript.register_reply(
-    [autogen.Agent, None],
-    reply_func=print_messages,
-    config={"callback": None},
-)
 panel.extension(design="material")
 
 # == Start chat UI
 
 chat_interface = panel.chat.ChatInterface(callback=perform_chat_sequence)
+# agent messages reach the chat log at most once per frame, long ones collapsed, the last 200 kept
+message_batcher = MessageBatcher(chat_interface, agent_avatars, interval=0.1, max_messages=200)
+stored_session_id = persistent_session_id()
+# a user who reloads or reconnects sees the summary and the last few messages again
+if conversation_store is not None and stored_session_id is not None:
+    for message in conversation_store.load(stored_session_id, 'example-03-chatbot'):
+        message_batcher.post(
+            message.get('content') or '', message.get('name') or 'System',
+            avatar=agent_avatars.get(message.get('name'), "📜"),
+        )
+    message_batcher.flush()
 chat_interface.send("Ready to assist!", user="System", respond=False)
-chat_interface.servable()
+metrics_view = metrics_pane(call_metrics, session=current_session_id())
+if SHOW_METRICS:
+    panel.Column(chat_interface, panel.Card(metrics_view, title="LLM calls", collapsed=True)).servable()
+else:
+    chat_interface.servable()
+
+# drop this session's agents as soon as the browser tab goes away rather than waiting for idle eviction
+# (there's no session when the script is loaded outside `panel serve`, e.g. by bench/)
+if panel.state.curdoc is not None and panel.state.curdoc.session_context is not None:
+    panel.state.on_session_destroyed(lambda session_context: session_pool.discard(session_context.id))
+
+startup_timer.mark('ui')
+startup_timer.finish()
@@ -0,0 +1,4 @@
+# Shared helpers for the hello-autogen examples.
+#
+# The example scripts stay self-contained walkthroughs; anything they would otherwise copy between each other
+# (session handling, model configs, chat plumbing) lives in the modules of this package.
@@ -0,0 +1,259 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+
+# == Admission control ===================================================================================
+#
+# The chat UIs used to start a full group chat for every message as soon as it was submitted, however many were
+# already running, and an overloaded Ollama or OpenAI then showed up as calls hanging until their 600s timeout.
+# Two limits keep the load bounded and fail fast instead:
+#
+# - `AdmissionController` admits chat sequences: at most `max_running` at once, the next `max_queue` wait in
+#   line (in order, each told its position as it changes) for up to `queue_timeout` seconds, and every user gets
+#   `rate` chats per `per` seconds with bursts of up to `burst`. Anything beyond that is turned away right away
+#   with a reason and, where it helps, how long to wait. It runs on the Panel event loop.
+# - `BackendLimiter` is a reply pipeline stage that caps the calls in flight per model at the registry's
+#   `max_concurrency` (hello_autogen/models.py). A call waits at most `timeout` seconds for a slot and then
+#   fails with BackendBusy - which a ModelRouter in front of it answers by moving on to the next tier.
+#
+# Both count within one process. When several processes serve the same app (hello_autogen/deploy.py), give each
+# its share: the examples divide their limits by PANEL_WORKERS, and BackendLimiter's `workers` does the same
+# for the registry's limits.
+
+ESTIMATE_SMOOTHING = 0.2
+
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(AdmissionRejected):
+    pass
+
+
+class AdmissionQueueFull(AdmissionRejected):
+    pass
+
+
+class AdmissionTimeout(AdmissionRejected):
+    pass
+
+
+class _Waiter:
+    def __init__(self, future, on_position):
+        self.future = future
+        self.on_position = on_position
+        self.position = None
+
+
+class AdmissionController:
+    def __init__(self, max_running=4, max_queue=16, queue_timeout=120, rate=6, per=60, burst=3,
+                 max_users=10000):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.per = per
+        self.burst = burst
+        self.max_users = max_users
+        self._running = 0
+        self._waiters = deque()
+        # user -> (tokens, updated_at); a token bucket per user
+        self._buckets = {}
+        # smoothed seconds per chat sequence, for the wait estimate shown to queued users
+        self.average_run_time = None
+        self.stats = {
+            'admitted': 0, 'queued': 0, 'rate_limited': 0, 'queue_full': 0, 'timeouts': 0, 'wait_time': 0.0,
+            'longest_queue': 0,
+        }
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    # Seconds a user at `position` in the queue can expect to wait, once a few chats have been timed
+    def estimated_wait(self, position):
+        if self.average_run_time is None:
+            return None
+        return self.average_run_time * position / self.max_running
+
+    def _take_token(self, user):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        if user not in self._buckets and len(self._buckets) >= self.max_users:
+            # users whose buckets have refilled are indistinguishable from new ones
+            full = [key for key, (tokens, updated) in self._buckets.items()
+                    if tokens + (now - updated) * self.rate / self.per >= self.burst]
+            for key in full:
+                del self._buckets[key]
+        tokens, updated = self._buckets.get(user, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate / self.per)
+        if tokens < 1:
+            self._buckets[user] = (tokens, now)
+            self.stats['rate_limited'] += 1
+            retry_after = (1 - tokens) * self.per / self.rate
+            raise RateLimited(f"too many messages, try again in {retry_after:.0f}s", retry_after)
+        self._buckets[user] = (tokens - 1, now)
+
+    def _notify_positions(self):
+        for position, waiter in enumerate(self._waiters, 1):
+            if waiter.position != position:
+                waiter.position = position
+                if waiter.on_position is not None:
+                    waiter.on_position(position)
+
+    # Hand the slot to the first waiter still waiting, or give it back
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.future.done():
+                waiter.future.set_result(True)
+                self._notify_positions()
+                return
+        self._running -= 1
+
+    # `async with controller.admit(user, on_position):` runs the block once the user's chat is admitted.
+    # `on_position(position)` is called whenever the chat's place in the queue changes.
+    @contextlib.asynccontextmanager
+    async def admit(self, user, on_position=None):
+        must_wait = self._running >= self.max_running or bool(self._waiters)
+        if must_wait and len(self._waiters) >= self.max_queue:
+            self.stats['queue_full'] += 1
+            raise AdmissionQueueFull(
+                f"{self._running} chats running and {len(self._waiters)} waiting",
+                self.estimated_wait(len(self._waiters) + 1),
+            )
+        # a chat turned away for a full queue doesn't count against the user's rate
+        self._take_token(user)
+        queued_at = time.monotonic()
+        if not must_wait:
+            self._running += 1
+        else:
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), on_position)
+            self._waiters.append(waiter)
+            self.stats['queued'] += 1
+            self.stats['longest_queue'] = max(self.stats['longest_queue'], len(self._waiters))
+            self._notify_positions()
+            admitted = False
+            try:
+                await asyncio.wait([waiter.future], timeout=self.queue_timeout)
+                admitted = waiter.future.done()
+            finally:
+                if not admitted:
+                    if waiter.future.done():
+                        # the slot arrived just as the wait was given up (timeout or the user left): pass it on
+                        self._release()
+                    else:
+                        waiter.future.cancel()
+                        self._waiters.remove(waiter)
+                        self._notify_positions()
+            if not admitted:
+                self.stats['timeouts'] += 1
+                raise AdmissionTimeout(f"no free slot after {self.queue_timeout}s")
+
+        self.stats['admitted'] += 1
+        started = time.monotonic()
+        self.stats['wait_time'] += started - queued_at
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            if self.average_run_time is None:
+                self.average_run_time = elapsed
+            else:
+                self.average_run_time += ESTIMATE_SMOOTHING * (elapsed - self.average_run_time)
+            self._release()
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+# One controller per name for the whole process, so the limits apply across every Panel session
+def get_admission_controller(name='default', **kwargs):
+    with _controllers_lock:
+        if name not in _controllers:
+            _controllers[name] = AdmissionController(**kwargs)
+        return _controllers[name]
+
+
+# == Backend concurrency
+
+BACKEND_WAIT = 30
+
+
+class BackendBusy(RuntimeError):
+    pass
+
+
+class BackendLimiter:
+    def __init__(self, models, timeout=BACKEND_WAIT, default_limit=None, workers=1):
+        self.models = models
+        self.timeout = timeout
+        # processes sharing the backends; each gets an equal share of every limit (at least one call)
+        self.workers = max(1, workers)
+        # for models without a `max_concurrency` entry; None leaves them unlimited
+        self.default_limit = default_limit
+        self._semaphores = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'busy': 0, 'wait_time': 0.0}
+
+    def limit(self, model):
+        entry = self.models.models.get(model) if model is not None else None
+        limit = (entry or {}).get('max_concurrency', self.default_limit)
+        return max(1, limit // self.workers) if limit else limit
+
+    def in_flight(self):
+        with self._lock:
+            return dict(self._in_flight)
+
+    def _semaphore(self, model, limit):
+        with self._lock:
+            if model not in self._semaphores:
+                self._semaphores[model] = threading.BoundedSemaphore(limit)
+                self._in_flight[model] = 0
+            return self._semaphores[model]
+
+    def __call__(self, call, proceed):
+        limit = self.limit(call.model)
+        if not limit:
+            return proceed(call)
+
+        semaphore = self._semaphore(call.model, limit)
+        started = time.monotonic()
+        if not semaphore.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats['busy'] += 1
+            raise BackendBusy(f"{call.model} is busy: {limit} calls in flight for {self.timeout}s")
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['wait_time'] += time.monotonic() - started
+            self._in_flight[call.model] += 1
+        try:
+            return proceed(call)
+        finally:
+            with self._lock:
+                self._in_flight[call.model] -= 1
+            semaphore.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+# Calls to a backend are only counted together if they go through the same limiter, so sessions share one per name
+def get_backend_limiter(name='default', **kwargs):
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = BackendLimiter(**kwargs)
+        return _limiters[name]
@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from hello_autogen.examples import FLOW_EXAMPLES, PANEL_FLOWS, build_flow, flow_agents, load_example, run_flow_chat
+
+# == Batch runs ==========================================================================================
+#
+# Runs many tasks through an example's agent graph without a UI, e.g. for nightly evaluations:
+#
+#     python -m hello_autogen.batch tasks.jsonl results.jsonl --flow group-chat --concurrency 8
+#
+# Each input line is a JSON object with a `task` and optionally an `id` (defaults to the line number) and a
+# `flow` (defaults to --flow). Text lines that aren't JSON are taken as the task itself.
+#
+# - Each worker thread builds its agents once and reuses them for all of its tasks; the example module,
+#   model configs and connection pools are loaded once for the whole run.
+# - Every finished task is appended to the output file straight away (and fsynced), with its reply, turns,
+#   time, tokens and cost. Running the same command again skips the ids that already succeeded, so a run
+#   that crashed or was stopped picks up where it left off; failed tasks are retried.
+# - Ctrl-C stops taking new tasks and waits for the ones in flight.
+
+MAX_IN_FLIGHT_FACTOR = 2
+
+
+def read_tasks(path, default_flow):
+    tasks = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = line
+            if not isinstance(entry, dict):
+                entry = {'task': str(entry)}
+            if 'task' not in entry:
+                raise ValueError(f"{path}:{number}: no 'task' in {line!r}")
+            entry.setdefault('id', number)
+            entry.setdefault('flow', default_flow)
+            if entry['flow'] not in FLOW_EXAMPLES or entry['flow'] in PANEL_FLOWS:
+                raise ValueError(f"{path}:{number}: unknown flow {entry['flow']!r}")
+            tasks.append(entry)
+    return tasks
+
+
+# Ids that already have a successful result in `path`; a torn last line from a crash is ignored
+def completed_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok':
+                done.add(str(record.get('id')))
+    return done
+
+
+# Costs and tokens so far, added up over the clients of `agents` (autogen's usage summaries only ever grow)
+def usage(agents):
+    total = {'cost': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    clients = [agent.client for agent in flow_agents(agents) if agent.client is not None]
+    # calls sent to another model by a ModelRouter or SpeculativeRacer are made with the stage's own clients
+    for stage in (getattr(agents, 'router', None), getattr(agents, 'racer', None)):
+        if stage is not None:
+            clients += stage.clients()
+    for client in clients:
+        summary = getattr(client, 'actual_usage_summary', None)
+        for model, entry in (summary or {}).items():
+            if model == 'total_cost':
+                total['cost'] += entry
+            else:
+                total['prompt_tokens'] += entry.get('prompt_tokens', 0)
+                total['completion_tokens'] += entry.get('completion_tokens', 0)
+    return total
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class ResultWriter:
+    def __init__(self, path):
+        # line buffered append: each record reaches the file in one write
+        self._file = open(path, 'a', buffering=1)
+        self._lock = threading.Lock()
+        # end a line torn by a crash, so the next record doesn't get glued onto it
+        if self._file.tell() and not _ends_with_newline(path):
+            self._file.write('\n')
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    def __init__(self, writer, silent=True):
+        self.writer = writer
+        self.silent = silent
+        self._local = threading.local()
+        self.stats = {'ok': 0, 'error': 0, 'cost': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self._lock = threading.Lock()
+
+    # One set of agents per worker thread and flow, reused for every task the thread runs
+    def _agents(self, flow):
+        if not hasattr(self._local, 'agents'):
+            self._local.agents = {}
+        if flow not in self._local.agents:
+            self._local.agents[flow] = build_flow(flow)
+        return self._local.agents[flow]
+
+    def run(self, entry):
+        record = {'id': entry['id'], 'flow': entry['flow'], 'task': entry['task']}
+        started = time.monotonic()
+        try:
+            agents = self._agents(entry['flow'])
+            before = usage(agents)
+            result = run_flow_chat(entry['flow'], agents, entry['task'], silent=self.silent)
+            after = usage(agents)
+            record.update(
+                status='ok',
+                reply=result.summary,
+                turns=len(result.chat_history),
+                **{key: after[key] - before[key] for key in after},
+            )
+        except Exception as e:
+            logging.exception("task %s failed", entry['id'])
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+            # the agents may be mid-conversation; build new ones for the next task
+            getattr(self._local, 'agents', {}).pop(entry['flow'], None)
+        record['elapsed'] = round(time.monotonic() - started, 3)
+        record['finished_at'] = time.time()
+        self.writer.write(record)
+
+        with self._lock:
+            self.stats[record['status']] += 1
+            for key in ('cost', 'prompt_tokens', 'completion_tokens'):
+                self.stats[key] += record.get(key, 0)
+        return record
+
+
+def run_batch(tasks, runner, concurrency, stop):
+    # a bounded number of submitted tasks, so thousands of prompts don't sit in the executor's queue
+    max_in_flight = concurrency * MAX_IN_FLIGHT_FACTOR
+    pending = set()
+    started = time.monotonic()
+    finished = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as executor:
+        remaining = iter(tasks)
+        while True:
+            while not stop.is_set() and len(pending) < max_in_flight:
+                entry = next(remaining, None)
+                if entry is None:
+                    break
+                pending.add(executor.submit(runner.run, entry))
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                finished += 1
+                print(
+                    f"[{finished}/{len(tasks)}] {record['id']} {record['status']} in {record['elapsed']:.1f}s "
+                    f"(${record.get('cost', 0.0):.4f})",
+                    file=sys.stderr,
+                )
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run tasks from a JSONL file through an example agent flow')
+    parser.add_argument('tasks', help='JSONL file of tasks')
+    parser.add_argument('output', help='JSONL file results are appended to; also used to resume')
+    parser.add_argument('--flow', default='two-agent', choices=[f for f in FLOW_EXAMPLES if f not in PANEL_FLOWS])
+    parser.add_argument('--concurrency', type=int, default=4, help='conversations in flight')
+    parser.add_argument('--limit', type=int, help='run at most this many tasks')
+    parser.add_argument('--verbose', action='store_true', help='print every agent message')
+    args = parser.parse_args()
+
+    tasks = read_tasks(args.tasks, args.flow)
+    done = completed_ids(args.output)
+    todo = [entry for entry in tasks if str(entry['id']) not in done]
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    print(f"{len(tasks)} tasks, {len(tasks) - len(todo)} already done, running {len(todo)}", file=sys.stderr)
+    # load the examples up front (once for all workers); they log every message at INFO
+    for flow in {entry['flow'] for entry in todo}:
+        load_example(FLOW_EXAMPLES[flow])
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    stop = threading.Event()
+
+    def interrupt(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print('stopping after the tasks in flight (Ctrl-C again to abort)', file=sys.stderr)
+        stop.set()
+
+    signal.signal(signal.SIGINT, interrupt)
+    writer = ResultWriter(args.output)
+    runner = BatchRunner(writer, silent=not args.verbose)
+    try:
+        elapsed = run_batch(todo, runner, args.concurrency, stop)
+    finally:
+        writer.close()
+
+    stats = runner.stats
+    print(
+        f"{stats['ok']} ok, {stats['error']} failed in {elapsed:.0f}s, "
+        f"{stats['prompt_tokens'] + stats['completion_tokens']} tokens, ${stats['cost']:.4f}",
+        file=sys.stderr,
+    )
+    sys.exit(1 if stats['error'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import logging
+import math
+import threading
+import time
+
+from autogen.oai.openai_utils import OAI_PRICE1K
+
+from hello_autogen.history import count_tokens, message_tokens
+from hello_autogen.routing import ModelClients, routable
+
+# == Budgets =============================================================================================
+#
+# The chat UIs only add up what a chat sequence cost once `initiate_chat` returns, so a runaway 10 round GPT-4
+# group chat is noticed after the money is spent. `ChatBudget` is a reply pipeline stage that keeps a live tally
+# of each chat sequence - dollars, tokens and seconds - in total (`session`) and per agent (`agents`), e.g.
+#
+#     ChatBudget(models, session={'dollars': 0.50, 'tokens': 60000, 'seconds': 300},
+#                agents={'Writer': {'dollars': 0.20}})
+#
+# and checks it before every call:
+#
+# - once any tally reaches `downgrade_at` of its limit, the agent's calls go to the local `fallback` model
+#   instead (free, and with a request timeout of no more than the seconds left), and neither a ModelRouter nor a
+#   SpeculativeRacer behind it moves them elsewhere;
+# - once a limit is reached, the call fails with BudgetExceeded, which ends the chat sequence.
+#
+# Session seconds are wall time since `start()`, which the examples call at the start of each chat sequence; an
+# agent's seconds are the time its own calls took. Dollars are estimated from the tokens sent and received (images
+# by the size gpt-4-vision bills them at) and the registry's `price_1k` or autogen's price table (local models cost
+# nothing), for the model that ended up serving the call - or, for a streamed reply, from the usage the
+# PanelStreamer recorded. Cache hits are free. Calls made outside the reply pipeline (the manager's speaker
+# selection) and the losing candidates of a race aren't counted: see `router.cost()` / `racer.cost()` for those.
+
+LIMITS = ('dollars', 'tokens', 'seconds')
+DOWNGRADE_AT = 0.8
+FALLBACK_MODEL = 'mistral'
+# request timeouts of downgraded calls are rounded up to this many seconds, so they share a few clients
+TIMEOUT_STEP = 10
+
+
+class BudgetExceeded(RuntimeError):
+    def __init__(self, message, scope, limit):
+        super().__init__(message)
+        # 'session' or the agent's name, and which of LIMITS was reached
+        self.scope = scope
+        self.limit = limit
+
+
+# `price` is dollars per 1000 (prompt, completion) tokens, e.g. the registry's `price_1k`; autogen's table otherwise
+def call_price(model_name, prompt_tokens, completion_tokens, price=None):
+    price = price or OAI_PRICE1K.get(model_name)
+    if price is None:
+        return 0.0
+    if isinstance(price, tuple):
+        return (price[0] * prompt_tokens + price[1] * completion_tokens) / 1000
+    return price * (prompt_tokens + completion_tokens) / 1000
+
+
+# The images in a multimodal message (hello_autogen/images.py)
+def _image_tokens(message):
+    content = message.get('content')
+    if not isinstance(content, list):
+        return 0
+    from hello_autogen.images import image_tokens
+
+    return sum(
+        image_tokens(part.get('image_url') or {})
+        for part in content if isinstance(part, dict) and part.get('type') == 'image_url'
+    )
+
+
+def _usage():
+    return {'dollars': 0.0, 'tokens': 0, 'seconds': 0.0}
+
+
+class ChatBudget:
+    def __init__(self, models, session=None, agents=None, downgrade_at=DOWNGRADE_AT, fallback=FALLBACK_MODEL,
+                 check_health=True):
+        self.models = models
+        self.session = session or {}
+        self.agents = agents or {}
+        self.downgrade_at = downgrade_at
+        self.fallback = fallback
+        self.model_clients = ModelClients(models, check_health)
+        self._lock = threading.Lock()
+        self.started = None
+        self.spent = _usage()
+        self.spent_by_agent = {}
+        self.stats = {'chats': 0, 'downgraded': 0, 'cut_off': 0}
+
+    # Start tallying a new chat sequence
+    def start(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.spent = _usage()
+            self.spent_by_agent = {}
+            self.stats['chats'] += 1
+
+    def usage(self, agent=None):
+        with self._lock:
+            if agent is not None:
+                return dict(self.spent_by_agent.get(agent, _usage()))
+            usage = dict(self.spent)
+            usage['seconds'] = time.monotonic() - self.started if self.started is not None else 0.0
+            return usage
+
+    # (scope, limit, fraction used) of every limit that applies to `agent`'s next call
+    def _fractions(self, agent):
+        scopes = [('session', self.session, self.usage()), (agent, self.agents.get(agent, {}), self.usage(agent))]
+        return [
+            (scope, limit, used[limit] / limits[limit])
+            for scope, limits, used in scopes
+            for limit in LIMITS if limits.get(limit)
+        ]
+
+    def seconds_left(self, agent):
+        left = [
+            limits['seconds'] - used['seconds']
+            for limits, used in ((self.session, self.usage()), (self.agents.get(agent, {}), self.usage(agent)))
+            if limits.get('seconds')
+        ]
+        return min(left) if left else None
+
+    def _downgrade(self, call):
+        if call.model == self.fallback or not routable(call) or not self.model_clients.available(self.fallback):
+            return
+        overrides = {}
+        seconds_left = self.seconds_left(call.agent.name)
+        if seconds_left is not None:
+            overrides['timeout'] = max(TIMEOUT_STEP, math.ceil(seconds_left / TIMEOUT_STEP) * TIMEOUT_STEP)
+        call.llm_config, call.client = self.model_clients.get(self.fallback, call.agent, **overrides)
+        call.model = self.fallback
+        # a ModelRouter or SpeculativeRacer further down leaves the call on the fallback
+        call.meta['downgraded'] = self.fallback
+        with self._lock:
+            self.stats['downgraded'] += 1
+
+    def __call__(self, call, proceed):
+        if self.started is None:
+            self.start()
+        name = call.agent.name
+        fractions = self._fractions(name)
+        for scope, limit, used in fractions:
+            if used >= 1:
+                with self._lock:
+                    self.stats['cut_off'] += 1
+                logging.warning("%s budget reached (%s), stopping before %s's call", scope, limit, name)
+                raise BudgetExceeded(f"the {limit} budget of {scope} is used up", scope, limit)
+        if any(used >= self.downgrade_at for _, _, used in fractions):
+            self._downgrade(call)
+
+        started = time.monotonic()
+        reply = None
+        try:
+            reply = proceed(call)
+            return reply
+        finally:
+            self._charge(call, reply, time.monotonic() - started)
+
+    def _price(self, model_name):
+        return self.models.price(model_name) if self.models is not None else None
+
+    def _charge(self, call, reply, seconds):
+        tokens, dollars = 0, 0.0
+        streamed = call.meta.get('usage')
+        if streamed:
+            # a streamed reply (hello_autogen/streaming.py), with the model that served it
+            tokens = streamed['prompt_tokens'] + streamed['completion_tokens']
+            dollars = call_price(
+                streamed['model'], streamed['prompt_tokens'], streamed['completion_tokens'],
+                self._price(streamed['model']),
+            )
+        elif call.meta.get('cache') != 'hit':
+            model_name = (call.llm_config.get('config_list') or [{}])[0].get('model', 'gpt-3.5-turbo')
+            messages = [{'content': call.agent.system_message}] + call.messages
+            prompt_tokens = sum(message_tokens(m) + _image_tokens(m) for m in messages)
+            completion_tokens = count_tokens(reply) if isinstance(reply, str) else 0
+            tokens = prompt_tokens + completion_tokens
+            dollars = call_price(model_name, prompt_tokens, completion_tokens, self._price(model_name))
+        with self._lock:
+            agent = self.spent_by_agent.setdefault(call.agent.name, _usage())
+            for usage in (self.spent, agent):
+                usage['dollars'] += dollars
+                usage['tokens'] += tokens
+            agent['seconds'] += seconds
@@ -0,0 +1,224 @@
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+# == Shared HTTP clients ===================================================================================
+#
+# autogen builds a new `openai.OpenAI` client - with its own httpx connection pool - for every entry of every
+# agent's `config_list`, and the examples build agents again for each Panel session, so calls to the same
+# LiteLLM proxy rarely reuse a connection. `ClientPool` keeps one keep-alive `httpx.Client` per endpoint
+# (scheme, host and port) for the whole process:
+#
+# - `configure(llm_config)` adds it to every `config_list` entry as `http_client`, which autogen hands to the
+#   OpenAI clients it builds (ModelRegistry.llm_config does this for you);
+# - `openai_client(base_url, api_key, timeout)` returns a shared OpenAI client on it, for code that calls the
+#   endpoints itself (e.g. PanelStreamer).
+#
+# The per-call `timeout` from `llm_config` still applies; the pool only sets connection limits.
+
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY = 60
+
+
+def endpoint(base_url):
+    parts = urlsplit(base_url or 'https://api.openai.com/v1')
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class ClientPool:
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=KEEPALIVE_EXPIRY):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self._http_clients = {}
+        self._openai_clients = {}
+        self._lock = threading.Lock()
+
+    def http_client(self, base_url):
+        import httpx
+
+        key = endpoint(base_url)
+        with self._lock:
+            if key not in self._http_clients:
+                self._http_clients[key] = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_keepalive_connections,
+                        keepalive_expiry=self.keepalive_expiry,
+                    ),
+                    # generous default; OpenAI clients pass their own timeout with every request
+                    timeout=httpx.Timeout(600, connect=10),
+                )
+                logging.debug("opened connection pool for %s", key)
+            return self._http_clients[key]
+
+    def openai_client(self, base_url=None, api_key=None, timeout=600):
+        import openai
+
+        key = (base_url, api_key, timeout)
+        http_client = self.http_client(base_url)
+        with self._lock:
+            if key not in self._openai_clients:
+                self._openai_clients[key] = openai.OpenAI(
+                    base_url=base_url, api_key=api_key, timeout=timeout, http_client=http_client,
+                )
+            return self._openai_clients[key]
+
+    # A copy of `llm_config` whose config_list entries share this pool's connections
+    def configure(self, llm_config):
+        config_list = [
+            dict(config, http_client=self.http_client(config.get('base_url')))
+            if 'http_client' not in config else config
+            for config in llm_config.get('config_list') or []
+        ]
+        return {**llm_config, 'config_list': config_list}
+
+    def close(self):
+        with self._lock:
+            clients = list(self._http_clients.values())
+            self._http_clients.clear()
+            self._openai_clients.clear()
+        for client in clients:
+            client.close()
+
+
+_client_pools = {}
+_client_pools_lock = threading.Lock()
+
+
+# One pool per name for the whole process, so every Panel session shares the connections
+def get_client_pool(name='default', **kwargs):
+    with _client_pools_lock:
+        if name not in _client_pools:
+            _client_pools[name] = ClientPool(**kwargs)
+            atexit.register(_client_pools[name].close)
+        return _client_pools[name]
+
+
+# == Micro-batching
+#
+# Servers that batch concurrent requests on the GPU (vLLM, TGI, Ollama with OLLAMA_NUM_PARALLEL > 1) get
+# through several completions in about the time of one - as long as the requests arrive together. Calls from
+# different sessions usually trickle in a few milliseconds apart and end up in separate batches.
+#
+# `MicroBatcher` is a reply pipeline stage that holds each call to a batching model for up to `window`
+# seconds, until `max_batch` calls to the same model have gathered, and then releases them all at once. It only
+# aligns their arrival: the chat completions API takes one conversation per request, so each call is still its
+# own HTTP request and the server's scheduler does the batching. Identical requests in one batch (same model,
+# parameters, system message and history - e.g. two sessions asking the same opening question at temperature 0)
+# are coalesced: sent once, with the reply shared.
+#
+# Only models with a `max_batch` entry in the registry (hello_autogen/models.py) are batched; calls to other
+# models pass straight through.
+
+BATCH_WINDOW = 0.02
+COALESCE_PARAMS = ('temperature', 'max_tokens', 'top_p', 'stop')
+
+
+class _Request:
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply = None
+        self.error = None
+
+
+class _Batch:
+    def __init__(self):
+        self.requests = {}
+        self.size = 0
+        self.full = threading.Event()
+        self.released = threading.Event()
+
+
+class MicroBatcher:
+    def __init__(self, models, window=BATCH_WINDOW, coalesce=True):
+        self.models = models
+        self.window = window
+        self.coalesce = coalesce
+        self._open = {}
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'calls': 0, 'coalesced': 0, 'largest_batch': 0, 'wait_time': 0.0}
+
+    def max_batch(self, model):
+        entry = self.models.models.get(model) if model is not None else None
+        return (entry or {}).get('max_batch')
+
+    # Only deterministic requests are shared; with temperature > 0 every session should get its own sample
+    def _request_key(self, call):
+        llm_config = call.llm_config
+        if not self.coalesce or llm_config.get('temperature', 1) != 0:
+            return object()
+        params = {key: llm_config[key] for key in COALESCE_PARAMS if key in llm_config}
+        payload = json.dumps([call.model, params, call.agent.system_message, call.messages], sort_keys=True,
+                             default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __call__(self, call, proceed):
+        max_batch = self.max_batch(call.model)
+        if not max_batch or max_batch < 2:
+            return proceed(call)
+
+        key = self._request_key(call)
+        with self._lock:
+            batch = self._open.get(call.model)
+            leader = batch is None
+            if leader:
+                batch = self._open[call.model] = _Batch()
+            request = batch.requests.get(key)
+            duplicate = request is not None
+            if not duplicate:
+                request = batch.requests[key] = _Request()
+                batch.size += 1
+                if batch.size >= max_batch:
+                    del self._open[call.model]
+                    batch.full.set()
+
+        started = time.monotonic()
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(call.model) is batch:
+                    del self._open[call.model]
+                self.stats['batches'] += 1
+                self.stats['largest_batch'] = max(self.stats['largest_batch'], batch.size)
+            batch.released.set()
+        else:
+            batch.released.wait()
+
+        if duplicate:
+            request.done.wait()
+            with self._lock:
+                self.stats['coalesced'] += 1
+            if request.error is not None:
+                raise request.error
+            return request.reply
+
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['wait_time'] += time.monotonic() - started
+        try:
+            request.reply = proceed(call)
+        except Exception as e:
+            request.error = e
+            raise
+        finally:
+            request.done.set()
+        return request.reply
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+# Calls can only be batched together if they go through the same batcher, so Panel sessions share one per name
+def get_micro_batcher(name='default', **kwargs):
+    with _batchers_lock:
+        if name not in _batchers:
+            _batchers[name] = MicroBatcher(**kwargs)
+        return _batchers[name]
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import zlib
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+
+# == Multi-worker deployment =============================================================================
+#
+# `panel serve` runs an app in one process, so one core serves every session. This runs N `panel serve` workers
+# of an app on local ports behind a small load balancer on the public port:
+#
+#     python -m hello_autogen.deploy example-03-chatbot.py --port 5007 --workers 4
+#
+# - Sessions are sticky: a Panel session lives in the worker that rendered the page, and its websocket must reach
+#   that same worker. The balancer sends a browser's first request to the worker with the fewest open
+#   connections (or, for a `?session=` URL, to the one that id hashes to) and sets a cookie naming it, which
+#   pins every later request and the websocket. When that worker is down, the browser moves to another one and
+#   the conversation carries on from the shared store.
+# - State the workers share lives in files next to the app, all safe for several processes to use: the
+#   conversation store (CONVERSATION_STORE, hello_autogen/store.py), the response cache (RESPONSE_CACHE,
+#   hello_autogen/response_cache.py) and autogen's cache_seed disk cache in .cache/.
+# - Each worker gets PANEL_WORKERS and PANEL_WORKER in its environment; the apps divide their admission and
+#   backend concurrency limits by PANEL_WORKERS. The debug log (LOG_FILE) and a METRICS_PROMETHEUS textfile get
+#   one file per worker, e.g. debug.worker0.log.
+# - Workers that exit are restarted. Ctrl-C (or SIGTERM) stops the balancer and the workers.
+#
+# The balancer forwards bytes and only reads the head of the first request (and of the first response, to set
+# the cookie) on each connection, so keep-alive, chunked responses and websockets pass through untouched.
+
+COOKIE = 'hello_autogen_worker'
+DOWN_FOR = 5
+RESTART_DELAY = 2
+STOP_TIMEOUT = 10
+CHUNK_SIZE = 64 * 1024
+HEAD_LIMIT = 64 * 1024
+MAX_PORT = 65535
+
+UNAVAILABLE = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+class Worker:
+    def __init__(self, index, command, port, env, cwd=None):
+        self.index = index
+        self.command = command
+        self.port = port
+        self.env = env
+        # autogen's cache_seed disk cache is in .cache/ under the working directory
+        self.cwd = cwd
+        self.process = None
+        self.connections = 0
+        # not sent new browsers until then, after a failed connection
+        self.down_until = 0.0
+        self.restarts = 0
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, env=self.env, cwd=self.cwd)
+        logging.info("worker %s started on port %s (pid %s)", self.index, self.port, self.process.pid)
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def available(self):
+        return self.running and time.monotonic() >= self.down_until
+
+
+class StickyBalancer:
+    def __init__(self, workers):
+        self.workers = workers
+        self.stats = {'connections': 0, 'assigned': 0, 'failovers': 0, 'unavailable': 0}
+
+    # The worker for a request head, and whether the browser still has to be told (by cookie) which one it is
+    def pick(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        target = lines[0].split(' ')[1] if len(lines[0].split(' ')) > 1 else '/'
+        cookie = SimpleCookie()
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'cookie':
+                try:
+                    cookie.load(value.strip())
+                except Exception:
+                    pass
+
+        if COOKIE in cookie and cookie[COOKIE].value.isdigit():
+            index = int(cookie[COOKIE].value)
+            if index < len(self.workers) and self.workers[index].available:
+                return self.workers[index], False
+            self.stats['failovers'] += 1
+
+        available = [worker for worker in self.workers if worker.available]
+        if not available:
+            return None, False
+        self.stats['assigned'] += 1
+        session = parse_qs(urlsplit(target).query).get('session')
+        if session:
+            # a reconnecting user lands where their session id points, as long as the same workers are up
+            return available[zlib.crc32(session[0].encode()) % len(available)], True
+        return min(available, key=lambda worker: worker.connections), True
+
+    async def handle(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        worker, assign = self.pick(head)
+        upstream = None
+        while worker is not None:
+            try:
+                upstream = await asyncio.open_connection('127.0.0.1', worker.port)
+                break
+            except OSError:
+                logging.warning("worker %s is not answering on port %s", worker.index, worker.port)
+                worker.down_until = time.monotonic() + DOWN_FOR
+                # whichever worker takes over, the browser has to be told
+                worker, assign = self.pick(head)[0], True
+        if upstream is None:
+            self.stats['unavailable'] += 1
+            writer.write(UNAVAILABLE)
+            await _close(writer)
+            return
+
+        upstream_reader, upstream_writer = upstream
+        worker.connections += 1
+        try:
+            upstream_writer.write(head)
+            await upstream_writer.drain()
+            if assign:
+                response = await upstream_reader.readuntil(b'\r\n\r\n')
+                writer.write(_with_cookie(response, worker.index))
+            await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            worker.connections -= 1
+            await _close(upstream_writer)
+            await _close(writer)
+
+
+def _with_cookie(response_head, index):
+    cookie = f"Set-Cookie: {COOKIE}={index}; Path=/; HttpOnly; SameSite=Lax\r\n".encode('latin-1')
+    return response_head[:-2] + cookie + b'\r\n'
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (ConnectionError, OSError):
+        pass
+
+
+def worker_env(index, workers, directory):
+    env = dict(os.environ, PANEL_WORKERS=str(workers), PANEL_WORKER=str(index))
+    # every worker uses the same files, wherever it is started from
+    env.setdefault('CONVERSATION_STORE', os.path.join(directory, 'conversations.db'))
+    env.setdefault('RESPONSE_CACHE', os.path.join(directory, 'response_cache.db'))
+    if env.get('METRICS_PROMETHEUS'):
+        # a textfile collector reads every *.prom file in its directory
+        root, extension = os.path.splitext(env['METRICS_PROMETHEUS'])
+        env['METRICS_PROMETHEUS'] = f"{root}.worker{index}{extension or '.prom'}"
+    # the apps' debug.log, one per worker
+    root, extension = os.path.splitext(env.get('LOG_FILE') or os.path.join(directory, 'debug.log'))
+    env['LOG_FILE'] = f"{root}.worker{index}{extension or '.log'}"
+    return env
+
+
+def build_workers(script, port, workers, base_port, origins):
+    directory = os.path.dirname(os.path.abspath(script))
+    allowed = origins or [f"localhost:{port}", f"127.0.0.1:{port}"]
+    built = []
+    for index in range(workers):
+        command = [
+            sys.executable, '-m', 'panel', 'serve', os.path.abspath(script), '--address', '127.0.0.1',
+            '--port', str(base_port + index), '--warm',
+        ]
+        for origin in allowed:
+            # the browser's websocket comes from the balancer's address, not the worker's
+            command += ['--allow-websocket-origin', origin]
+        built.append(Worker(index, command, base_port + index, worker_env(index, workers, directory), directory))
+    return built
+
+
+async def supervise(workers, stopping):
+    while not stopping.is_set():
+        for worker in workers:
+            if not worker.running:
+                logging.warning("worker %s exited (%s), restarting", worker.index, worker.process.returncode)
+                await asyncio.sleep(RESTART_DELAY)
+                worker.restarts += 1
+                worker.start()
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+
+def stop(workers):
+    for worker in workers:
+        if worker.running:
+            worker.process.terminate()
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for worker in workers:
+        if worker.process is None:
+            continue
+        try:
+            worker.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+
+
+async def serve(workers, address, port):
+    balancer = StickyBalancer(workers)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    for worker in workers:
+        worker.start()
+    server = await asyncio.start_server(balancer.handle, address, port, limit=HEAD_LIMIT)
+    logging.info("balancing http://%s:%s over %s workers", address, port, len(workers))
+    try:
+        async with server:
+            await supervise(workers, stopping)
+    finally:
+        logging.info("stopping: %s", balancer.stats)
+        stop(workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a Panel app from several worker processes.")
+    parser.add_argument('script', help="the Panel app, e.g. example-03-chatbot.py")
+    parser.add_argument('--port', type=int, default=5007, help="public port of the load balancer")
+    parser.add_argument('--address', default='127.0.0.1', help="address the load balancer listens on")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument(
+        '--base-port', type=int, help="port of the first worker, the others follow it (default: --port + 1)",
+    )
+    parser.add_argument(
+        '--allow-websocket-origin', action='append', default=[], dest='origins',
+        help="host[:port] browsers reach the balancer at (default: localhost and 127.0.0.1 at --port)",
+    )
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    base_port = args.base_port or args.port + 1
+    last_port = base_port + workers - 1
+    if last_port > MAX_PORT:
+        parser.error(f"{workers} workers from port {base_port} would need ports up to {last_port}, past {MAX_PORT}")
+    if base_port <= args.port <= last_port:
+        parser.error(f"the workers' ports {base_port}-{last_port} include the balancer's port {args.port}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    workers = build_workers(args.script, args.port, workers, base_port, args.origins)
+    asyncio.run(serve(workers, args.address, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import importlib.util
+import os
+import sys
+
+# == Example loading ====================================================================================
+#
+# The examples are scripts with hyphenated file names, so they can't be imported normally. Tools that drive
+# their agent graphs (bench/, batch runs) load them through here; running a script's chat is left to its
+# `if __name__ == "__main__"` block.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXAMPLES = {
+    'two-agent': 'example-01-autogen-intro.py',
+    'group-chat': 'example-02-autogen-group-chat.py',
+    'chatbot': 'example-03-chatbot.py',
+    'multimodal': 'example-04-multimodal.py',
+}
+
+
+def load_example(name):
+    module_name = 'example_' + name.replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    path = os.path.join(ROOT, EXAMPLES[name])
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+# == Flows
+#
+# The ways a loaded example's agents can be driven: the two chats of example-01 / example-02, the fan-out
+# variant of example-02 and the Panel group chats of example-03 / example-04 (with any object that has the
+# chat interface's `send` and `stream`).
+
+FLOW_EXAMPLES = {
+    'two-agent': 'two-agent',
+    'group-chat': 'group-chat',
+    'fan-out': 'group-chat',
+    'chatbot': 'chatbot',
+    'multimodal': 'multimodal',
+}
+PANEL_FLOWS = ('chatbot', 'multimodal')
+
+
+def build_flow(flow, chat_interface=None):
+    module = load_example(FLOW_EXAMPLES[flow])
+    if flow in PANEL_FLOWS:
+        # the imports and configs the script's prewarm is still loading
+        for value in module.startup_values:
+            value.get()
+        return module.build_session(chat_interface)
+    return module.build_agents()
+
+
+# Run one task through agents built by `build_flow`, starting from a clean conversation, and return autogen's
+# ChatResult
+def run_flow_chat(flow, agents, task, silent=False):
+    import asyncio
+
+    module = load_example(FLOW_EXAMPLES[flow])
+    message = module.with_termination_notice(task)
+    for termination in getattr(agents, 'terminations', []):
+        termination.reset()
+    # a ChatBudget (hello_autogen/budgets.py) holds each task to its budget rather than the whole run
+    if getattr(agents, 'budget', None) is not None:
+        agents.budget.start()
+    if hasattr(agents, 'groupchat'):
+        agents.groupchat.reset()
+
+    if flow == 'two-agent':
+        recipient = agents.assistant
+    elif flow == 'fan-out':
+        recipient = agents.fan_out
+    else:
+        recipient = agents.manager
+    if flow in PANEL_FLOWS:
+        return asyncio.run(
+            agents.user_proxy.a_initiate_chat(recipient, message=message, clear_history=True, silent=silent)
+        )
+    return agents.user_proxy.initiate_chat(recipient, message=message, clear_history=True, silent=silent)
+
+
+# Every agent taking part in a flow's chats, e.g. to add up what their clients spent
+def flow_agents(agents):
+    import autogen
+
+    found = []
+    for value in list(vars(agents).values()) + list(getattr(getattr(agents, 'groupchat', None), 'agents', [])):
+        if isinstance(value, autogen.ConversableAgent) and value not in found:
+            found.append(value)
+    return found
@@ -0,0 +1,356 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import autogen
+from autogen.code_utils import infer_lang
+
+# == Code execution pool ==================================================================================
+#
+# By default a UserProxyAgent runs each code block as a new subprocess in the shared `output` directory, with
+# no limits and no cap on how many run at once. `ExecutorPool` keeps a few interpreters per language started
+# ahead of time, each waiting on stdin for one code block, so a block only pays for running, not for starting
+# Python or Node. Every worker:
+#
+# - runs one block and exits (a replacement is started in the background), so blocks never share state;
+# - gets its own temporary work dir; files it creates are copied to `results_dir` (e.g. `output`) afterwards;
+# - sees only a minimal environment (WORKER_ENV, with HOME and TMPDIR set to its work dir, plus any `env` given
+#   to the pool), not the app's, so model-written code can't read OPEN_AI_API_KEY and other secrets;
+# - is limited in CPU seconds, memory and file size, and killed with its process group after `timeout`.
+#
+# At most `max_concurrency` blocks run at once across all sessions; the others wait in a queue for up to
+# `queue_timeout` seconds. `PooledUserProxyAgent` is a UserProxyAgent that runs its code blocks in a pool.
+
+TIMEOUT = 60
+MAX_OUTPUT_CHARS = 20000
+# the only variables passed on from the app's environment
+WORKER_ENV = ('PATH', 'LANG', 'LC_ALL', 'TZ')
+
+LANGUAGES = {
+    'python': 'python', 'py': 'python', 'Python': 'python',
+    'sh': 'sh', 'bash': 'sh', 'shell': 'sh',
+    'javascript': 'javascript', 'js': 'javascript', 'node': 'javascript',
+}
+
+# Sets the CPU seconds, file size and (unless 0) address space limits given as its first three arguments, then
+# drops them from sys.argv. Run by the worker itself rather than in a preexec_fn, which isn't safe to use from a
+# process with threads.
+LIMITS = r'''
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None
+cpu_seconds, file_size, memory = (int(limit) for limit in sys.argv[1:4])
+del sys.argv[1:4]
+if resource is not None:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+'''
+
+# Reads one job from stdin, writes the code to a file in the work dir and runs it there
+PYTHON_BOOTSTRAP = LIMITS + r'''
+import json, os, runpy, traceback
+for module in sys.argv[1:]:
+    __import__(module)
+job = json.loads(sys.stdin.readline())
+os.chdir(job['work_dir'])
+path = os.path.join(job['work_dir'], job['filename'])
+with open(path, 'w') as f:
+    f.write(job['code'])
+if job['lang'] == 'sh':
+    os.execvp('sh', ['sh', path])
+sys.argv = [path]
+sys.path.insert(0, job['work_dir'])
+try:
+    runpy.run_path(path, run_name='__main__')
+except SystemExit:
+    raise
+except BaseException:
+    traceback.print_exc()
+    sys.exit(1)
+'''
+
+# node can't set its own limits: a python process sets them and then execs node
+NODE_LAUNCHER = LIMITS + r'''
+import os
+os.execv(sys.argv[1], sys.argv[1:])
+'''
+
+NODE_BOOTSTRAP = r'''
+let input = '';
+process.stdin.on('data', (chunk) => {
+  input += chunk;
+  const end = input.indexOf('\n');
+  if (end < 0) return;
+  process.stdin.destroy();
+  const job = JSON.parse(input.slice(0, end));
+  process.chdir(job.work_dir);
+  const file = require('path').join(job.work_dir, job.filename);
+  require('fs').writeFileSync(file, job.code);
+  require(file);
+});
+'''
+
+DEFAULT_FILENAMES = {'python': 'main.py', 'sh': 'main.sh', 'javascript': 'main.js'}
+
+
+class ExecutorQueueFull(RuntimeError):
+    pass
+
+
+class Worker:
+    def __init__(self, lang, process, work_dir):
+        self.lang = lang
+        self.process = process
+        self.work_dir = work_dir
+        self.started_at = time.monotonic()
+
+
+class ExecutorPool:
+    def __init__(self, warm=2, max_concurrency=4, queue_timeout=120, timeout=TIMEOUT, cpu_seconds=30,
+                 memory_mb=512, file_size_mb=64, languages=('python', 'sh', 'javascript'), preload=(),
+                 base_dir=None, env=None):
+        self.warm = warm
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.file_size_mb = file_size_mb
+        # modules the python workers import while they wait, e.g. ('numpy', 'pandas')
+        self.preload = tuple(preload)
+        # extra variables the blocks may see, on top of WORKER_ENV
+        self.env = dict(env or {})
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix='hello-autogen-exec-')
+        self.languages = [lang for lang in languages if self._command(lang) is not None]
+        self._idle = {lang: deque() for lang in self.languages}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._spawner = ThreadPoolExecutor(max_workers=2, thread_name_prefix='executor-spawn')
+        self._closed = False
+        self.stats = {'runs': 0, 'warm_starts': 0, 'cold_starts': 0, 'timeouts': 0, 'rejected': 0, 'queue_time': 0.0}
+        for lang in self.languages:
+            for _ in range(warm):
+                self._spawner.submit(self._refill, lang)
+
+    def supports(self, lang):
+        return LANGUAGES.get(lang) in self.languages
+
+    def _command(self, lang):
+        limits = [str(self.cpu_seconds), str(self.file_size_mb * 2 ** 20)]
+        if lang in ('python', 'sh'):
+            return [sys.executable, '-u', '-c', PYTHON_BOOTSTRAP, *limits, str(self.memory_mb * 2 ** 20),
+                    *self.preload]
+        if lang == 'javascript':
+            node = shutil.which('node')
+            # V8 reserves far more address space than it uses, so node's heap is capped by flag instead of RLIMIT_AS
+            return [
+                sys.executable, '-c', NODE_LAUNCHER, *limits, '0',
+                node, f"--max-old-space-size={self.memory_mb}", '-e', NODE_BOOTSTRAP,
+            ] if node else None
+        return None
+
+    def _spawn(self, lang):
+        work_dir = tempfile.mkdtemp(prefix=f"{lang}-", dir=self.base_dir)
+        process = subprocess.Popen(
+            self._command(lang),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=work_dir,
+            env=self._env(work_dir),
+            # its own process group, so a timeout kills whatever the block started too
+            start_new_session=True,
+            text=True,
+        )
+        return Worker(lang, process, work_dir)
+
+    def _env(self, work_dir):
+        env = {key: os.environ[key] for key in WORKER_ENV if key in os.environ}
+        env.update(self.env, HOME=work_dir, TMPDIR=work_dir)
+        return env
+
+    def _refill(self, lang):
+        with self._lock:
+            if self._closed or len(self._idle[lang]) >= self.warm:
+                return
+        try:
+            worker = self._spawn(lang)
+        except OSError as e:
+            logging.warning("could not start a %s executor: %s", lang, e)
+            return
+        with self._lock:
+            self._idle[lang].append(worker)
+
+    def _take(self, lang):
+        with self._lock:
+            while self._idle[lang]:
+                worker = self._idle[lang].popleft()
+                # skip workers that died while idle (e.g. killed by the CPU limit on a busy machine)
+                if worker.process.poll() is None:
+                    self.stats['warm_starts'] += 1
+                    break
+                shutil.rmtree(worker.work_dir, ignore_errors=True)
+            else:
+                worker = None
+        if worker is None:
+            worker = self._spawn(lang)
+            with self._lock:
+                self.stats['cold_starts'] += 1
+        self._spawner.submit(self._refill, lang)
+        return worker
+
+    # Run one block; returns (exitcode, logs) like autogen's execute_code: stdout on success, stderr on failure
+    def run(self, lang, code, filename=None, timeout=None, results_dir=None):
+        lang = LANGUAGES.get(lang, lang)
+        if lang not in self.languages:
+            return 1, f"unknown language {lang}"
+
+        queued_at = time.monotonic()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise ExecutorQueueFull(f"no code executor free after {self.queue_timeout}s")
+        try:
+            with self._lock:
+                self.stats['runs'] += 1
+                self.stats['queue_time'] += time.monotonic() - queued_at
+            worker = self._take(lang)
+            return self._execute(worker, code, filename or DEFAULT_FILENAMES[lang], timeout or self.timeout,
+                                 results_dir)
+        finally:
+            self._slots.release()
+
+    def _execute(self, worker, code, filename, timeout, results_dir):
+        job = {'lang': worker.lang, 'code': code, 'filename': os.path.basename(filename), 'work_dir': worker.work_dir}
+        try:
+            stdout, stderr = worker.process.communicate(json.dumps(job) + '\n', timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill(worker.process)
+            worker.process.communicate()
+            with self._lock:
+                self.stats['timeouts'] += 1
+            return 1, 'Timeout'
+        finally:
+            if results_dir:
+                _copy_results(worker.work_dir, results_dir)
+            shutil.rmtree(worker.work_dir, ignore_errors=True)
+
+        exitcode = worker.process.returncode
+        if exitcode < 0:
+            logs = stderr + f"\nKilled by signal {-exitcode} (cpu/memory/file size limit?)"
+            exitcode = 1
+        else:
+            logs = stdout if exitcode == 0 else stderr
+        if len(logs) > MAX_OUTPUT_CHARS:
+            logs = logs[:MAX_OUTPUT_CHARS] + f"\n... [{len(logs) - MAX_OUTPUT_CHARS} more characters]"
+        return exitcode, logs
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers = [worker for idle in self._idle.values() for worker in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for worker in workers:
+            _kill(worker.process)
+            shutil.rmtree(worker.work_dir, ignore_errors=True)
+        self._spawner.shutdown(wait=False)
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        process.kill()
+
+
+def _copy_results(work_dir, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    for name in os.listdir(work_dir):
+        source = os.path.join(work_dir, name)
+        target = os.path.join(results_dir, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, dirs_exist_ok=True)
+        else:
+            shutil.copy2(source, target)
+
+
+# == Agent
+
+class PooledUserProxyAgent(autogen.UserProxyAgent):
+    def __init__(self, *args, executor_pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor_pool = executor_pool or get_executor_pool()
+        # autogen only has a sync code execution reply, which would run code on the event loop in async chats
+        position = _reply_position(self, 'generate_code_execution_reply')
+        if position is not None:
+            self.register_reply(
+                [autogen.Agent, None], PooledUserProxyAgent.a_generate_code_execution_reply,
+                position=position, ignore_async_in_sync_chat=True,
+            )
+
+    async def a_generate_code_execution_reply(self, messages=None, sender=None, config=None):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.generate_code_execution_reply, messages, sender, config,
+        )
+
+    # Same contract and output as ConversableAgent.execute_code_blocks, plus javascript when node is installed
+    def execute_code_blocks(self, code_blocks):
+        config = self._code_execution_config or {}
+        logs_all = ''
+        exitcode = 0
+        for i, (lang, code) in enumerate(code_blocks):
+            lang = lang or infer_lang(code)
+            logging.info("executing code block %d (%s)", i, lang)
+            filename = None
+            if code.startswith('# filename: '):
+                filename = code[len('# filename: '):code.find('\n')].strip()
+            if self.executor_pool.supports(lang):
+                try:
+                    exitcode, logs = self.executor_pool.run(
+                        lang, code, filename, timeout=config.get('timeout'), results_dir=config.get('work_dir'),
+                    )
+                except ExecutorQueueFull as e:
+                    exitcode, logs = 1, str(e)
+            else:
+                exitcode, logs = 1, f"unknown language {lang}"
+            logs_all += '\n' + logs
+            if exitcode != 0:
+                break
+        return exitcode, logs_all
+
+
+def _reply_position(agent, name):
+    for position, entry in enumerate(agent._reply_func_list):
+        if entry['reply_func'].__name__ == name:
+            return position
+    return None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# One pool per name for the whole process, so every Panel session shares the workers and the concurrency limit
+def get_executor_pool(name='default', **kwargs):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ExecutorPool(**kwargs)
+            atexit.register(_pools[name].close)
+        return _pools[name]
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import autogen
+
+# == Fan-out / fan-in =====================================================================================
+#
+# GroupChat runs one speaker per round, so asking a python and a javascript engineer the same question takes
+# the sum of both replies. `FanOutManager` is an alternative to GroupChatManager for independent specialists:
+# it sends the conversation to all of its agents at once (threads in sync chats, the event loop in async chats),
+# waits for each up to its own timeout and merges whatever came back into one reply, so a round takes as long as
+# the slowest agent.
+#
+#     fan_out = FanOutManager([engineer_python, engineer_javascript], timeout=120)
+#     user_proxy.initiate_chat(fan_out, message=task)
+#
+# Agents that time out or fail are left out of the merged reply (and logged); a late reply is discarded. A
+# running generate_reply can't be cancelled, so in sync chats each round asks its agents on threads of its own
+# rather than from a shared pool: an agent stuck past its timeout finishes in the background without holding a
+# thread the next round needs, and there is no pool to shut down when the manager is done.
+
+DEFAULT_TIMEOUT = 120
+
+
+class FanOutResult:
+    def __init__(self, agent, reply=None, elapsed=0.0, error=None):
+        self.agent = agent
+        self.reply = reply
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.reply is not None
+
+    def __repr__(self):
+        return f"FanOutResult(agent={self.agent.name!r}, elapsed={self.elapsed:.2f}, error={self.error!r})"
+
+
+# One section per agent that answered
+def merge_replies(task, results):
+    sections = []
+    for result in results:
+        if result.ok:
+            reply = result.reply if isinstance(result.reply, str) else result.reply.get('content', '')
+            sections.append(f"### {result.agent.name}\n\n{reply}")
+    if not sections:
+        return "None of the agents could answer: " + ', '.join(f"{r.agent.name} ({r.error})" for r in results)
+    return '\n\n'.join(sections)
+
+
+# Merge by asking `agent` (e.g. a writer) to combine the answers into one
+def llm_merge(agent):
+    def merge(task, results):
+        answers = merge_replies(task, results)
+        if not any(result.ok for result in results):
+            return answers
+        prompt = (
+            f"Task:\n{task}\n\nAnswers from several specialists:\n\n{answers}\n\n"
+            "Combine these answers into a single reply to the task. Keep all code blocks that are needed."
+        )
+        reply = agent.generate_reply(messages=[{'role': 'user', 'content': prompt}])
+        return reply if isinstance(reply, str) else (reply or {}).get('content') or answers
+    return merge
+
+
+class FanOutManager(autogen.ConversableAgent):
+    def __init__(self, agents, name='fan_out_manager', timeout=DEFAULT_TIMEOUT, timeouts=None, merge=merge_replies,
+                 **kwargs):
+        super().__init__(name=name, llm_config=False, human_input_mode='NEVER', **kwargs)
+        self.agents = list(agents)
+        self.timeout = timeout
+        # per agent name, e.g. more time for the agent on the slow local model
+        self.timeouts = timeouts or {}
+        self.merge = merge
+        self.last_results = []
+        self.stats = {'rounds': 0, 'timeouts': 0, 'errors': 0, 'wall_time': 0.0, 'agent_time': 0.0}
+        self._stats_lock = threading.Lock()
+        # like GroupChatManager: the async variant is registered last so async chats use it
+        self.register_reply(autogen.Agent, FanOutManager.run_fan_out)
+        self.register_reply(autogen.Agent, FanOutManager.a_run_fan_out, ignore_async_in_sync_chat=True)
+
+    def _timeout_for(self, agent):
+        return self.timeouts.get(agent.name, self.timeout)
+
+    def _ask(self, agent, messages):
+        started = time.monotonic()
+        try:
+            reply = agent.generate_reply(messages=messages, sender=self)
+        except Exception as e:
+            return FanOutResult(agent, elapsed=time.monotonic() - started, error=f"{type(e).__name__}: {e}")
+        return FanOutResult(agent, reply, time.monotonic() - started)
+
+    # Ask `agent` on a daemon thread; the future gets its result
+    def _start(self, agent, messages):
+        future = Future()
+        thread = threading.Thread(
+            target=lambda: future.set_result(self._ask(agent, messages)), name=f"{self.name}-{agent.name}",
+            daemon=True,
+        )
+        thread.start()
+        return future
+
+    async def _a_ask(self, agent, messages):
+        started = time.monotonic()
+        try:
+            reply = await asyncio.wait_for(
+                agent.a_generate_reply(messages=messages, sender=self), self._timeout_for(agent),
+            )
+        except asyncio.TimeoutError:
+            return FanOutResult(agent, elapsed=time.monotonic() - started, error='timed out')
+        except Exception as e:
+            return FanOutResult(agent, elapsed=time.monotonic() - started, error=f"{type(e).__name__}: {e}")
+        return FanOutResult(agent, reply, time.monotonic() - started)
+
+    def fan_out(self, messages):
+        started = time.monotonic()
+        futures = [(agent, self._start(agent, messages)) for agent in self.agents]
+        results = []
+        for agent, future in futures:
+            # every agent's thread started at `started`, so its deadline is counted from there
+            remaining = max(0.0, started + self._timeout_for(agent) - time.monotonic())
+            try:
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                results.append(FanOutResult(agent, elapsed=time.monotonic() - started, error='timed out'))
+        return self._finish(results, started)
+
+    async def a_fan_out(self, messages):
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._a_ask(agent, messages) for agent in self.agents))
+        return self._finish(list(results), started)
+
+    def _finish(self, results, started):
+        wall_time = time.monotonic() - started
+        with self._stats_lock:
+            self.stats['rounds'] += 1
+            self.stats['wall_time'] += wall_time
+            for result in results:
+                self.stats['agent_time'] += result.elapsed
+                if result.error == 'timed out':
+                    self.stats['timeouts'] += 1
+                elif result.error is not None:
+                    self.stats['errors'] += 1
+        for result in results:
+            if result.error is not None:
+                logging.warning(
+                    "fan-out: %s gave no reply after %.1fs: %s", result.agent.name, result.elapsed, result.error,
+                )
+        logging.debug("fan-out round took %.2fs: %s", wall_time, results)
+        self.last_results = results
+        return results
+
+    # == Reply functions, registered like GroupChatManager.run_chat / a_run_chat
+    #
+    # They run before the default termination check, so they check for it themselves: a final reply of None
+    # ends the chat.
+
+    def run_fan_out(self, messages=None, sender=None, config=None):
+        if messages is None:
+            messages = self._oai_messages[sender]
+        if self._is_termination_msg(messages[-1]):
+            return True, None
+        results = self.fan_out(messages)
+        return True, self.merge(messages[-1].get('content'), results)
+
+    async def a_run_fan_out(self, messages=None, sender=None, config=None):
+        if messages is None:
+            messages = self._oai_messages[sender]
+        if self._is_termination_msg(messages[-1]):
+            return True, None
+        results = await self.a_fan_out(messages)
+        # the merge may call an LLM, so keep it off the event loop
+        merged = await asyncio.get_running_loop().run_in_executor(
+            None, self.merge, messages[-1].get('content'), results,
+        )
+        return True, merged
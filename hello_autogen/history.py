@@ -0,0 +1,184 @@
+import functools
+import logging
+import re
+
+# == History compaction ==================================================================================
+#
+# Every GroupChat round resends the whole conversation to the next speaker (and to the manager when it asks
+# the LLM who speaks next), so prompt tokens grow with the square of the number of rounds. `HistoryCompactor`
+# runs before each LLM call and brings the history back under the model's `prompt_budget` from the registry:
+#
+# 1. boilerplate (e.g. the termination notice) is kept only in the latest message that carries it;
+# 2. the first message (the task) and the last `keep_last` messages stay verbatim, everything in between is
+#    replaced by one summary message;
+# 3. if that is still too long, the longest remaining messages are cut down to their head and tail.
+#
+# With `step` > 1 the summary only moves on in steps of that many messages, so the compacted prompt keeps the
+# same prefix for several turns and a backend's prefix cache (see hello_autogen/prefix.py) can keep reusing it.
+
+DEFAULT_PROMPT_BUDGET = 4000
+SUMMARY_LINE_CHARS = 200
+TRUNCATION_MARKER = '\n[... truncated ...]\n'
+# texts whose token counts are remembered: system messages, the termination notice and recent messages are
+# counted again on every call by compaction, routing and metrics
+TOKEN_CACHE_SIZE = 4096
+
+_encodings = {}
+
+
+# tiktoken when it's available (it ships with autogen), otherwise the usual ~4 characters per token estimate
+def count_tokens(text, model='gpt-3.5-turbo'):
+    if not text:
+        return 0
+    return _count_tokens(text, model)
+
+
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _count_tokens(text, model):
+    if model not in _encodings:
+        _encodings[model] = _encoding(model)
+    if _encodings[model] is None:
+        return len(text) // 4 + 1
+    return len(_encodings[model].encode(text, disallowed_special=()))
+
+
+# None when there is no tiktoken encoding to use, e.g. one that has to be downloaded on a machine offline
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        logging.warning("no tiktoken encoding for %s, estimating its token counts", model, exc_info=True)
+        return None
+
+
+def message_tokens(message, model='gpt-3.5-turbo'):
+    content = message.get('content')
+    if isinstance(content, list):
+        text = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    else:
+        text = content or ''
+    # role/name framing costs a few tokens per message
+    return count_tokens(text, model) + 4
+
+
+# One line per dropped message: who said it and how it started. Any `messages -> str` function (e.g. a call to
+# a cheap local model) can be used instead.
+def extractive_summary(messages):
+    lines = []
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, str) or not content.strip():
+            continue
+        text = re.sub(r"\s+", ' ', content).strip()
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS].rsplit(' ', 1)[0] + ' ...'
+        lines.append(f"- {message.get('name') or message.get('role')}: {text}")
+    return '\n'.join(lines)
+
+
+class HistoryCompactor:
+    def __init__(self, models=None, keep_last=4, boilerplate=(), summarize=extractive_summary,
+                 default_budget=DEFAULT_PROMPT_BUDGET, step=1):
+        self.models = models
+        self.keep_last = keep_last
+        self.step = max(1, step)
+        self.boilerplate = [b for b in boilerplate if b]
+        self.summarize = summarize
+        self.default_budget = default_budget
+        self.stats = {'calls': 0, 'compacted': 0, 'tokens_before': 0, 'tokens_after': 0}
+
+    def budget_for(self, model, llm_config=None):
+        budget = None
+        if self.models is not None and model is not None:
+            budget = self.models.prompt_budget(model, (llm_config or {}).get('max_tokens') or 0)
+        return budget or self.default_budget
+
+    def compact(self, messages, budget, system_message='', model='gpt-3.5-turbo'):
+        messages = self._strip_boilerplate(messages)
+        budget -= count_tokens(system_message if isinstance(system_message, str) else '', model)
+
+        if _total(messages, model) <= budget or len(messages) <= self.keep_last + 1:
+            return self._truncate(messages, budget, model)
+
+        # summarize whole steps only, so the summary stays the same until the next step is full
+        cut = len(messages) - 1 - self.keep_last
+        cut -= cut % self.step
+        if cut <= 0:
+            return self._truncate(messages, budget, model)
+        head, middle, tail = messages[:1], messages[1:1 + cut], messages[1 + cut:]
+        summary = self.summarize(middle)
+        compacted = head
+        if summary:
+            compacted = head + [{
+                'role': 'user',
+                'name': 'Summary',
+                'content': f"Summary of {len(middle)} earlier messages:\n{summary}",
+            }]
+        return self._truncate(compacted + tail, budget, model)
+
+    def _strip_boilerplate(self, messages):
+        if not self.boilerplate:
+            return messages
+        stripped = list(messages)
+        for text in self.boilerplate:
+            carriers = [
+                i for i, message in enumerate(messages)
+                if isinstance(message.get('content'), str) and text in message['content']
+            ]
+            for i in carriers[:-1]:
+                stripped[i] = dict(stripped[i], content=stripped[i]['content'].replace(text, ''))
+        return stripped
+
+    # Cut the longest messages down to head + tail until the history fits, never touching the latest message
+    def _truncate(self, messages, budget, model):
+        messages = list(messages)
+        while _total(messages, model) > budget and len(messages) > 1:
+            sizes = [
+                (message_tokens(message, model), i) for i, message in enumerate(messages[:-1])
+                if isinstance(message.get('content'), str)
+            ]
+            if not sizes:
+                break
+            size, index = max(sizes)
+            excess = _total(messages, model) - budget
+            content = messages[index]['content']
+            # tokens -> characters is only an estimate, so always shrink by at least half
+            keep_chars = min((size - excess) * 4 - len(TRUNCATION_MARKER), len(content) // 2)
+            if keep_chars < 200:
+                del messages[index]
+                continue
+            messages[index] = dict(
+                messages[index],
+                content=content[:keep_chars // 2] + TRUNCATION_MARKER + content[-(keep_chars // 2):],
+            )
+        return messages
+
+    # == Reply pipeline stage
+
+    def __call__(self, call, proceed):
+        llm_config = call.llm_config
+        model_name = (llm_config.get('config_list') or [{}])[0].get('model', 'gpt-3.5-turbo')
+        budget = self.budget_for(call.model, llm_config)
+        before = _total(call.messages, model_name)
+        call.messages = self.compact(call.messages, budget, call.agent.system_message, model_name)
+        after = _total(call.messages, model_name)
+
+        self.stats['calls'] += 1
+        self.stats['tokens_before'] += before
+        self.stats['tokens_after'] += after
+        if after < before:
+            self.stats['compacted'] += 1
+            logging.debug("compacted %s history from %d to %d tokens", call.agent.name, before, after)
+        call.meta['prompt_tokens_saved'] = before - after
+        return proceed(call)
+
+
+def _total(messages, model):
+    return sum(message_tokens(m, model) for m in messages)
@@ -0,0 +1,284 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import threading
+import urllib.request
+from collections import OrderedDict
+
+from autogen.agentchat.contrib.multimodal_conversable_agent import MultimodalConversableAgent
+
+# == Image cache =========================================================================================
+#
+# autogen's multimodal agents turn every `<img location>` tag into a base64 data URI when a message reaches
+# them: the image is downloaded again by every agent that receives the message, and sent at full size (a
+# `w=2970` Unsplash photo is several MB of base64) on every later turn it stays in the history.
+#
+# `ImageCache` fetches each image once, downscales it to the largest size the model makes use of and stores
+# it content-addressed (by hash of the downscaled JPEG, so two URLs for the same picture share one file) on
+# disk, with the encoded data URIs of recently used images kept in memory. Sources can be http(s) URLs, local
+# paths or `file://` URLs.
+#
+# - `CachedMultimodalAgent` is a MultimodalConversableAgent that formats `<img ...>` tags from the cache.
+# - `ImageCache.rewrite(text)` replaces the tags in a prompt with the cached local files, for agents such as
+#   LLaVAAgent that load images themselves.
+
+IMG_TAG = re.compile(r"<img ([^>]+)>")
+
+# gpt-4-vision scales images to fit 2048x2048 and then to 768px on the shortest side; LLaVA 1.5 sees 336x336
+GPT4V_IMAGE_SIZE = (2048, 768)
+LLAVA_IMAGE_SIZE = (336, 336)
+
+# gpt-4-vision bills an image as 85 tokens plus, at "high" detail, 170 per 512px tile of the image as it scales it
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE = 512
+
+FETCH_TIMEOUT = 30
+MAX_SOURCE_BYTES = 50 * 1024 * 1024
+
+
+class ImageCache:
+    def __init__(self, directory='.cache/images', max_size=GPT4V_IMAGE_SIZE, quality=85,
+                 max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024, fetch_timeout=FETCH_TIMEOUT):
+        self.directory = directory
+        # (longest side, shortest side) limits
+        self.max_size = max_size
+        self.quality = quality
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.fetch_timeout = fetch_timeout
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, f"index-{max_size[0]}x{max_size[1]}.json")
+        # source -> digest of its downscaled image
+        self._index = self._load_index()
+        # digest -> data URI, LRU-ordered
+        self._data_uris = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # one fetch per source even when several agents ask for it at once
+        self._fetching = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'fetches': 0, 'bytes_fetched': 0, 'bytes_stored': 0}
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        with open(self._index_path + '.tmp', 'w') as f:
+            json.dump(self._index, f)
+        os.replace(self._index_path + '.tmp', self._index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, digest + '.jpg')
+
+    # Local files are keyed by modification time and size too, so an edited file is picked up again
+    def _source_key(self, location):
+        if location.startswith(('http://', 'https://')):
+            return location
+        if location.startswith('data:'):
+            return 'data:' + hashlib.sha256(location.encode()).hexdigest()
+        path = os.path.expanduser(location[len('file://'):] if location.startswith('file://') else location)
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    # Local path of the downscaled copy of `location`, fetching and downscaling it on first use
+    def path(self, location):
+        location = location.strip()
+        key = self._source_key(location)
+        with self._lock:
+            digest = self._index.get(key)
+            if digest is not None and os.path.exists(self._blob_path(digest)):
+                self.stats['disk_hits'] += 1
+                os.utime(self._blob_path(digest))
+                return self._blob_path(digest)
+            event = self._fetching.get(key)
+            owner = event is None
+            if owner:
+                event = self._fetching[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            return self.path(location)
+        try:
+            digest = self._store(self._downscale(self._fetch(location)))
+            with self._lock:
+                self._index[key] = digest
+                self._save_index()
+        finally:
+            with self._lock:
+                del self._fetching[key]
+            event.set()
+        self._evict_disk()
+        return self._blob_path(digest)
+
+    def data_uri(self, location):
+        path = self.path(location)
+        digest = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            if digest in self._data_uris:
+                self._data_uris.move_to_end(digest)
+                self.stats['memory_hits'] += 1
+                return self._data_uris[digest]
+        with open(path, 'rb') as f:
+            data_uri = 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()
+        with self._lock:
+            if digest not in self._data_uris:
+                self._data_uris[digest] = data_uri
+                self._memory_bytes += len(data_uri)
+            while self._memory_bytes > self.max_memory_bytes and len(self._data_uris) > 1:
+                _, evicted = self._data_uris.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+        return data_uri
+
+    def _fetch(self, location):
+        if location.startswith(('http://', 'https://')):
+            request = urllib.request.Request(location, headers={'User-Agent': 'hello-autogen'})
+            with urllib.request.urlopen(request, timeout=self.fetch_timeout) as response:
+                data = response.read(MAX_SOURCE_BYTES + 1)
+            if len(data) > MAX_SOURCE_BYTES:
+                raise ValueError(f"image larger than {MAX_SOURCE_BYTES} bytes: {location}")
+        elif location.startswith('data:image/'):
+            data = base64.b64decode(location.split(',', 1)[1])
+        else:
+            path = location[len('file://'):] if location.startswith('file://') else location
+            with open(os.path.expanduser(path), 'rb') as f:
+                data = f.read()
+        self.stats['fetches'] += 1
+        self.stats['bytes_fetched'] += len(data)
+        return data
+
+    # Fit the image in `max_size` (never upscaling) and re-encode it as JPEG
+    def _downscale(self, data):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        scale = min(1.0, self.max_size[0] / max(image.size), self.max_size[1] / min(image.size))
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        # lets JPEG sources decode at a reduced size instead of decoding every pixel and then shrinking
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=self.quality, optimize=True)
+        return output.getvalue()
+
+    def _store(self, data):
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self.stats['bytes_stored'] += len(data)
+        return digest
+
+    # Delete the least recently used files once the cache directory outgrows `max_disk_bytes`
+    def _evict_disk(self):
+        blobs = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            logging.debug("evicted cached image %s", path)
+
+    # == Prompt formatting
+
+    # Same output as autogen's gpt4v_formatter, with images from the cache
+    def gpt4v_formatter(self, prompt, detail='auto'):
+        output = []
+        last_index = 0
+        for match in IMG_TAG.finditer(prompt):
+            try:
+                data_uri = self.data_uri(match.group(1))
+            except Exception as e:
+                logging.warning("unable to load image from %s: %s", match.group(1), e)
+                continue
+            output.append({'type': 'text', 'text': prompt[last_index:match.start()]})
+            output.append({'type': 'image_url', 'image_url': {'url': data_uri, 'detail': detail}})
+            last_index = match.end()
+        output.append({'type': 'text', 'text': prompt[last_index:]})
+        return output
+
+    # Load every image a prompt refers to, e.g. in an executor before the chat starts, since agents format
+    # messages on the event loop thread
+    def prefetch(self, text):
+        for match in IMG_TAG.finditer(text):
+            try:
+                self.data_uri(match.group(1))
+            except Exception as e:
+                logging.warning("unable to load image from %s: %s", match.group(1), e)
+
+    # Point `<img ...>` tags at the cached local copies; tags that can't be loaded are left alone
+    def rewrite(self, text):
+        def local(match):
+            try:
+                return f"<img {self.path(match.group(1))}>"
+            except Exception as e:
+                logging.warning("unable to load image from %s: %s", match.group(1), e)
+                return match.group(0)
+        return IMG_TAG.sub(local, text)
+
+
+# Prompt tokens of one `image_url` content part. The size is read from the header of a data URI (which the cache
+# has already downscaled); an image behind a URL counts as the largest gpt-4-vision sees.
+def image_tokens(image_url):
+    if image_url.get('detail') == 'low':
+        return IMAGE_BASE_TOKENS
+    width, height = GPT4V_IMAGE_SIZE
+    url = image_url.get('url', '')
+    if url.startswith('data:image/'):
+        try:
+            from PIL import Image
+
+            width, height = Image.open(io.BytesIO(base64.b64decode(url.split(',', 1)[1]))).size
+        except Exception:
+            pass
+    scale = min(1.0, GPT4V_IMAGE_SIZE[0] / max(width, height))
+    scale = min(scale, GPT4V_IMAGE_SIZE[1] / (min(width, height) * scale))
+    tiles = math.ceil(width * scale / IMAGE_TILE) * math.ceil(height * scale / IMAGE_TILE)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+class CachedMultimodalAgent(MultimodalConversableAgent):
+    def __init__(self, name, *args, image_cache=None, image_detail='auto', **kwargs):
+        # set before super().__init__, which formats the system message
+        self.image_cache = image_cache or get_image_cache()
+        self.image_detail = image_detail
+        super().__init__(name, *args, **kwargs)
+
+    def _message_to_dict(self, message):
+        if isinstance(message, str):
+            return {'content': self.image_cache.gpt4v_formatter(message, self.image_detail)}
+        if isinstance(message, dict) and isinstance(message.get('content'), str):
+            return dict(message, content=self.image_cache.gpt4v_formatter(message['content'], self.image_detail))
+        return super()._message_to_dict(message)
+
+
+_image_caches = {}
+_image_caches_lock = threading.Lock()
+
+
+# One cache per size for the whole process, so every Panel session shares the downloads
+def get_image_cache(max_size=GPT4V_IMAGE_SIZE, **kwargs):
+    with _image_caches_lock:
+        if max_size not in _image_caches:
+            _image_caches[max_size] = ImageCache(max_size=max_size, **kwargs)
+        return _image_caches[max_size]
@@ -0,0 +1,182 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from pprint import pformat
+
+# == Logging ============================================================================================
+#
+# The examples log to `debug.log` and the console. `setup_logging` replaces the `logging.basicConfig` call they
+# used to make: log calls only put the record on a queue, and one background thread formats records and
+# writes them in batches (one write + flush for everything queued since the last batch) to a size-rotated
+# file, so agent threads and the Panel event loop never wait on the disk.
+#
+# Formatting happens on the background thread too, so large payloads passed as arguments - wrap them in
+# `pretty(...)` or `lazy(...)` - are only rendered if the record is actually written, and never on the caller's
+# thread. The flip side is that a mutable argument is rendered as it is when the record is written, not when
+# it was logged; pass a copy if that matters.
+#
+# LOG_FILE, when set, replaces the path the script passes. hello_autogen/deploy.py sets it to one file per worker
+# process, since several processes rotating the same file would lose each other's records.
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class lazy:
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+def pretty(value, max_chars=None):
+    def render():
+        text = pformat(value)
+        if max_chars is not None and len(text) > max_chars:
+            text = text[:max_chars] + f"... [{len(text) - max_chars} more characters]"
+        return text
+    return lazy(render)
+
+
+# Hands records to the queue as they are (the stdlib QueueHandler formats them on the caller's thread first).
+# When the queue is full the record is dropped and counted rather than blocking the caller.
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def emit_batch(self, records):
+        if self.stream is None:
+            self.stream = self._open()
+        lines, size = [], self.stream.tell()
+        for record in records:
+            try:
+                line = self.format(record) + self.terminator
+            except Exception:
+                self.handleError(record)
+                continue
+            # like shouldRollover, but counting the lines still waiting to be written
+            length = len(line.encode(self.encoding or 'utf-8'))
+            if self.maxBytes > 0 and size and size + length >= self.maxBytes:
+                self._write(lines)
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                lines, size = [], 0
+            lines.append(line)
+            size += length
+        self._write(lines)
+
+    def _write(self, lines):
+        if not lines:
+            return
+        self.stream.write(''.join(lines))
+        self.stream.flush()
+
+
+class BatchingListener:
+    def __init__(self, queue, handlers, batch_size=BATCH_SIZE, queue_handler=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.queue_handler = queue_handler
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='logging', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def _run(self):
+        while True:
+            # block for the first record, then take whatever else is already queued - batches grow under load
+            # and a quiet logger still writes each record straight away
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._handle([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def _handle(self, records):
+        if self.queue_handler is not None and self.queue_handler.dropped:
+            dropped, self.queue_handler.dropped = self.queue_handler.dropped, 0
+            records.append(logging.makeLogRecord({
+                'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"logging queue full, dropped {dropped} records",
+            }))
+        for handler in self.handlers:
+            records_for_handler = [record for record in records if record.levelno >= handler.level]
+            if isinstance(handler, BatchedRotatingFileHandler):
+                handler.emit_batch(records_for_handler)
+            else:
+                for record in records_for_handler:
+                    handler.handle(record)
+
+
+# Idempotent, since Panel runs the example scripts again for every browser session
+def setup_logging(path='debug.log', level=logging.INFO, fmt=LOG_FORMAT, console=True, max_bytes=MAX_BYTES,
+                  backup_count=BACKUP_COUNT, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        path = os.getenv('LOG_FILE', path)
+        formatter = logging.Formatter(fmt)
+        handlers = []
+        if path:
+            handlers.append(BatchedRotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True,
+            ))
+        if console:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        records = queue.Queue(maxsize=queue_size)
+        queue_handler = DeferredQueueHandler(records)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+
+        _listener = BatchingListener(records, handlers, batch_size, queue_handler)
+        _listener.start()
+        # write out whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from hello_autogen.history import count_tokens, message_tokens
+
+# == Call metrics ========================================================================================
+#
+# One record per LLM reply (and per speaker selection the manager hands to its LLM): agent, model, wall time,
+# queue time (how long the call waited for a worker thread before it started), prompt/completion tokens and
+# whether the response cache answered. `CallMetrics` is a reply pipeline stage - put it first so wall time
+# covers the cache, compaction and streaming stages behind it.
+#
+# Records go to an optional JSON lines file as they happen and are kept in memory (the latest `max_records`)
+# for the chat UI; per agent/model totals are kept for the whole process and can be exported in the Prometheus
+# text format. Token counts are estimated the same way history compaction counts them (tiktoken when
+# available), from the messages actually sent after compaction; cache hits send nothing. With a PrefixTracker
+# stage (hello_autogen/prefix.py) the prompt tokens that repeat the agent's previous prompt are counted too. Replies
+# streamed by a PanelStreamer are counted from the usage it recorded, which the endpoint reports where it can.
+
+PROMETHEUS_PREFIX = 'hello_autogen_llm'
+
+
+class CallMetrics:
+    def __init__(self, max_records=10000, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.records = deque(maxlen=max_records)
+        # (agent, model) -> running totals
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        record = {
+            'timestamp': time.time(),
+            'session': None,
+            'agent': None,
+            'model': None,
+            'kind': 'reply',
+            'round': None,
+            'wall_time': 0.0,
+            'queue_time': 0.0,
+            'time_to_first_token': None,
+            'prompt_tokens': 0,
+            'prefix_tokens': 0,
+            'completion_tokens': 0,
+            'cache': None,
+            'error': None,
+            **fields,
+        }
+        with self._lock:
+            self.records.append(record)
+            totals = self.totals.setdefault((record['agent'], record['model']), {
+                'calls': 0, 'cache_hits': 0, 'errors': 0, 'wall_time': 0.0, 'queue_time': 0.0,
+                'prompt_tokens': 0, 'prefix_tokens': 0, 'completion_tokens': 0,
+            })
+            totals['calls'] += 1
+            totals['cache_hits'] += record['cache'] == 'hit'
+            totals['errors'] += record['error'] is not None
+            for key in ('wall_time', 'queue_time', 'prompt_tokens', 'prefix_tokens', 'completion_tokens'):
+                totals[key] += record[key]
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        return record
+
+    # == Reply pipeline stage
+
+    def __call__(self, call, proceed):
+        return self._measure_call(call, proceed, None)
+
+    # A stage that labels its records with `session`, so the UI can show one session's calls
+    def for_session(self, session):
+        return SessionMetrics(self, session)
+
+    def _measure_call(self, call, proceed, session):
+        started = time.monotonic()
+        turn = len(call.messages)
+        reply, error = None, None
+        try:
+            reply = proceed(call)
+            return reply
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            hit = call.meta.get('cache') == 'hit'
+            # a PanelStreamer leaves the usage of the replies it streamed
+            streamed = call.meta.get('usage')
+            self.record(
+                session=session,
+                agent=call.agent.name,
+                model=call.model,
+                round=turn,
+                wall_time=time.monotonic() - started,
+                queue_time=max(0.0, started - call.created_at),
+                time_to_first_token=call.meta.get('time_to_first_token'),
+                prompt_tokens=streamed['prompt_tokens'] if streamed else 0 if hit else _prompt_tokens(call),
+                prefix_tokens=call.meta.get('prefix_tokens', 0),
+                completion_tokens=(
+                    streamed['completion_tokens'] if streamed else count_tokens(reply) if isinstance(reply, str) else 0
+                ),
+                cache=call.meta.get('cache'),
+                error=error,
+            )
+
+    # Time a model call that doesn't go through a reply pipeline, e.g. the manager's speaker selection
+    @contextmanager
+    def measure(self, agent, model, messages=(), kind='reply', session=None):
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(
+                session=session,
+                agent=agent,
+                model=model,
+                kind=kind,
+                round=len(messages),
+                wall_time=time.monotonic() - started,
+                prompt_tokens=sum(message_tokens(m) for m in messages),
+                error=error,
+            )
+
+    # == Reporting
+
+    # Per agent/model rows for the records matching `session` / `since`, slowest (by total wall time) first
+    def summary(self, session=None, since=None):
+        with self._lock:
+            records = [
+                r for r in self.records
+                if (session is None or r['session'] == session) and (since is None or r['timestamp'] >= since)
+            ]
+        rows = {}
+        for r in records:
+            row = rows.setdefault((r['agent'], r['model']), {
+                'agent': r['agent'], 'model': r['model'], 'calls': 0, 'cache_hits': 0, 'wall_time': 0.0,
+                'queue_time': 0.0, 'max_wall_time': 0.0, 'prompt_tokens': 0, 'prefix_tokens': 0,
+                'completion_tokens': 0,
+            })
+            row['calls'] += 1
+            row['cache_hits'] += r['cache'] == 'hit'
+            row['wall_time'] += r['wall_time']
+            row['queue_time'] += r['queue_time']
+            row['max_wall_time'] = max(row['max_wall_time'], r['wall_time'])
+            row['prompt_tokens'] += r['prompt_tokens']
+            row['prefix_tokens'] += r.get('prefix_tokens', 0)
+            row['completion_tokens'] += r['completion_tokens']
+        total_wall = sum(row['wall_time'] for row in rows.values())
+        for row in rows.values():
+            row['share'] = row['wall_time'] / total_wall if total_wall else 0.0
+        return sorted(rows.values(), key=lambda row: row['wall_time'], reverse=True)
+
+    def markdown(self, session=None, since=None):
+        rows = self.summary(session, since)
+        if not rows:
+            return 'No LLM calls yet.'
+        lines = [
+            '| agent | model | calls | cache hits | wall s | share | max s | queue s | prompt tok | prefix tok '
+            '| completion tok |',
+            '|---|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|',
+        ]
+        for row in rows:
+            lines.append(
+                f"| {row['agent']} | {row['model']} | {row['calls']} | {row['cache_hits']} "
+                f"| {row['wall_time']:.2f} | {row['share']:.0%} | {row['max_wall_time']:.2f} "
+                f"| {row['queue_time']:.2f} | {row['prompt_tokens']} | {row['prefix_tokens']} "
+                f"| {row['completion_tokens']} |"
+            )
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        with self._lock:
+            totals = {key: dict(value) for key, value in self.totals.items()}
+        metrics = [
+            ('calls_total', 'counter', 'LLM replies', 'calls'),
+            ('cache_hits_total', 'counter', 'LLM replies answered by the response cache', 'cache_hits'),
+            ('errors_total', 'counter', 'LLM replies that raised', 'errors'),
+            ('wall_seconds_total', 'counter', 'Seconds spent producing LLM replies', 'wall_time'),
+            ('queue_seconds_total', 'counter', 'Seconds LLM calls waited for a worker thread', 'queue_time'),
+            ('prompt_tokens_total', 'counter', 'Estimated prompt tokens sent', 'prompt_tokens'),
+            ('prefix_tokens_total', 'counter', 'Estimated prompt tokens repeating the previous prompt', 'prefix_tokens'),
+            ('completion_tokens_total', 'counter', 'Estimated completion tokens received', 'completion_tokens'),
+        ]
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for (agent, model), value in sorted(totals.items(), key=lambda item: tuple(map(str, item[0]))):
+                labels = f'agent="{_label(agent)}",model="{_label(model)}"'
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value[key]}")
+        return '\n'.join(lines) + '\n'
+
+    # For node_exporter's textfile collector; written to a temp file first so it is never read half-written
+    def write_prometheus(self, path):
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+
+class SessionMetrics:
+    def __init__(self, metrics, session):
+        self.metrics = metrics
+        self.session = session
+
+    def __call__(self, call, proceed):
+        return self.metrics._measure_call(call, proceed, self.session)
+
+    def measure(self, agent, model, messages=(), kind='reply'):
+        return self.metrics.measure(agent, model, messages, kind=kind, session=self.session)
+
+
+def _prompt_tokens(call):
+    system_message = call.agent.system_message if isinstance(call.agent.system_message, str) else ''
+    return count_tokens(system_message) + sum(message_tokens(m) for m in call.messages)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Optional chat UI panel; Panel is only imported by the examples that serve a UI
+def metrics_pane(metrics, session=None):
+    import panel
+
+    return panel.pane.Markdown(metrics.markdown(session), sizing_mode='stretch_width')
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+# One collector per name for the whole process, so it is shared by every Panel session
+def get_metrics(name='default', **kwargs):
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = CallMetrics(**kwargs)
+        return _metrics[name]
@@ -0,0 +1,309 @@
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# == Model Config ====================================================================================
+#
+# The single source of truth for the models used by the examples. Entries keep the `llm_config` /
+# `cache_seed` shape the examples always used, plus a few fields the registry needs:
+#
+# - `health_urls`: cheap GETs that must answer for the endpoint to count as healthy. Local models probe both the
+#   LiteLLM proxy and Ollama behind it, so a dead Ollama is noticed even while the proxy is still up.
+# - `context_window`: prompt + completion tokens the model accepts.
+# - `prompt_budget`: tokens of history we are willing to send per call (see hello_autogen/history.py); kept well
+#   under the context window because every round resends the whole conversation.
+# - `max_batch`: for servers that batch concurrent requests, how many calls MicroBatcher (hello_autogen/clients.py)
+#   holds back and releases at the same moment - each still its own request, which the server's scheduler
+#   batches. Match it to the backend's parallel slots, e.g. OLLAMA_NUM_PARALLEL.
+# - `max_concurrency`: calls in flight the endpoint is given at once (see BackendLimiter in
+#   hello_autogen/admission.py); further calls wait briefly for a slot and then fail fast.
+# - `price_1k`: dollars per 1000 prompt and completion tokens, for budgets and cost totals. Models without one
+#   are priced from autogen's table (which lacks e.g. gpt-4-vision-preview), or as free.
+#
+# OpenAI entries have no `api_key` here: it is read from the environment when the entry is first used, so
+# importing this module never fails and `load_dotenv()` can run afterwards.
+#
+# Setting `MODEL_BASE_URL` points every model at one OpenAI-compatible server instead (e.g. the replay stub in
+# bench/stub_server.py), which lets any example run with no network and no Ollama.
+
+OLLAMA_HEALTH_URL = 'http://localhost:11434/api/version'
+OPENAI_HEALTH_URL = 'https://api.openai.com/v1/models'
+
+MODELS = {
+    'oai-gpt35': {
+        'llm_config': {
+            'model': 'gpt-3.5-turbo-16k',
+        },
+        'cache_seed': 1000,
+        'context_window': 16385,
+        'prompt_budget': 6000,
+        'health_urls': [OPENAI_HEALTH_URL],
+        'max_concurrency': 16,
+        'price_1k': (0.003, 0.004),
+    },
+    'oai-gpt4': {
+        'llm_config': {
+            'model': 'gpt-4-turbo-preview',
+        },
+        'cache_seed': 1001,
+        'context_window': 128000,
+        'prompt_budget': 8000,
+        'health_urls': [OPENAI_HEALTH_URL],
+        'max_concurrency': 8,
+        'price_1k': (0.01, 0.03),
+    },
+    'oai-gpt4-vision': {
+        'llm_config': {
+            'model': 'gpt-4-vision-preview',
+        },
+        'cache_seed': 1006,
+        'context_window': 128000,
+        'prompt_budget': 6000,
+        'health_urls': [OPENAI_HEALTH_URL],
+        'max_concurrency': 4,
+        'price_1k': (0.01, 0.03),
+    },
+    'mistral': {
+        'llm_config': {
+            'base_url': 'http://0.0.0.0:59991',
+            'model': 'mistral',
+            'api_key': 'NULL',
+        },
+        'cache_seed': 1003,
+        'context_window': 8192,
+        'prompt_budget': 4000,
+        'health_urls': ['http://0.0.0.0:59991/models', OLLAMA_HEALTH_URL],
+        'max_batch': 4,
+        'max_concurrency': 4,
+    },
+    'codellama': {
+        'llm_config': {
+            'base_url': 'http://0.0.0.0:59993',
+            'model': 'codellama',
+            'api_key': 'NULL',
+        },
+        'cache_seed': 1005,
+        'context_window': 16384,
+        'prompt_budget': 6000,
+        'health_urls': ['http://0.0.0.0:59993/models', OLLAMA_HEALTH_URL],
+        'max_batch': 4,
+        'max_concurrency': 4,
+    },
+    'llava': {
+        'llm_config': {
+            'base_url': 'http://0.0.0.0:59992',
+            'model': 'starcoder',
+            'api_key': 'NULL',
+        },
+        'cache_seed': 1004,
+        'context_window': 4096,
+        'prompt_budget': 2000,
+        'health_urls': ['http://0.0.0.0:59992/models', OLLAMA_HEALTH_URL],
+        'max_batch': 4,
+        'max_concurrency': 4,
+    },
+}
+
+# == Endpoint health ====================================================================================
+#
+# Probe results are shared by every registry in the process and reused for `HEALTH_TTL` seconds, so building
+# configs on each Panel session doesn't re-probe every endpoint.
+
+HEALTH_TTL = 30
+PROBE_TIMEOUT = 2
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+class EndpointHealth:
+    def __init__(self, healthy, latency, checked_at, error=None):
+        self.healthy = healthy
+        self.latency = latency
+        self.checked_at = checked_at
+        self.error = error
+
+    def __repr__(self):
+        return f"EndpointHealth(healthy={self.healthy}, latency={self.latency:.3f}, error={self.error!r})"
+
+
+def _probe_url(url, headers, timeout):
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout):
+            pass
+    except urllib.error.HTTPError as e:
+        # the server answered; only treat server-side failures as unhealthy
+        if e.code >= 500:
+            raise
+
+
+def probe(url, headers=None, timeout=PROBE_TIMEOUT):
+    started = time.monotonic()
+    try:
+        _probe_url(url, headers or {}, timeout)
+    except Exception as e:
+        return EndpointHealth(False, time.monotonic() - started, time.time(), error=str(e))
+    return EndpointHealth(True, time.monotonic() - started, time.time())
+
+
+def reset_health():
+    with _health_lock:
+        _health.clear()
+
+
+# == Registry ====================================================================================
+
+
+class ModelRegistry:
+    def __init__(self, models=MODELS, enable_cache=True, health_ttl=HEALTH_TTL, probe_timeout=PROBE_TIMEOUT,
+                 client_pool='default'):
+        self.models = models
+        # name of the shared keep-alive connection pool the configs use (hello_autogen/clients.py), or None
+        self.client_pool = client_pool
+        self.enable_cache = enable_cache
+        self.health_ttl = health_ttl
+        self.probe_timeout = probe_timeout
+        self._model_configs = {}
+
+    def __contains__(self, name):
+        return name in self.models
+
+    # The validated `{'llm_config': ..., 'cache_seed': ...}` entry for a model, built on first use
+    def model_config(self, name):
+        if name not in self._model_configs:
+            if name not in self.models:
+                raise KeyError(f"unknown model {name!r}, expected one of {sorted(self.models)}")
+            entry = self.models[name]
+            llm_config = dict(entry['llm_config'])
+            base_url_override = os.getenv('MODEL_BASE_URL')
+            if base_url_override:
+                llm_config.update(base_url=base_url_override, api_key=llm_config.get('api_key') or 'NULL')
+                entry = {**entry, 'health_urls': [base_url_override.rstrip('/') + '/models']}
+            if 'base_url' not in llm_config:
+                llm_config.setdefault('api_key', os.getenv('OPEN_AI_API_KEY'))
+            if not llm_config.get('api_key'):
+                raise ValueError(f"model {name!r} needs OPEN_AI_API_KEY to be set (see .env.example)")
+            self._model_configs[name] = {
+                **entry,
+                'llm_config': llm_config,
+                'cache_seed': entry['cache_seed'] if self.enable_cache else None,
+            }
+        return self._model_configs[name]
+
+    # Every model that validates, in the shape of the old per-example `model_configs` dict
+    @property
+    def model_configs(self):
+        configs = {}
+        for name in self.models:
+            try:
+                configs[name] = self.model_config(name)
+            except ValueError:
+                continue
+        return configs
+
+    # The registry name of the model an `llm_config` calls first (its model string if it isn't registered)
+    def name_for(self, llm_config):
+        config_list = (llm_config or {}).get('config_list') or []
+        if not config_list:
+            return None
+        first = config_list[0]
+        # built entries first: they carry the endpoint actually in use (e.g. after a MODEL_BASE_URL override)
+        for entries in (self._model_configs, self.models):
+            for name, entry in entries.items():
+                if (entry['llm_config'].get('model') == first.get('model')
+                        and entry['llm_config'].get('base_url') == first.get('base_url')):
+                    return name
+        return first.get('model')
+
+    # Dollars per 1000 (prompt, completion) tokens of a model, by registry name or by the model string it calls
+    def price(self, model):
+        entry = self.models.get(model)
+        if entry is None:
+            entry = next((e for e in self.models.values() if e['llm_config'].get('model') == model), {})
+        return entry.get('price_1k')
+
+    # Tokens of history to send per call: the model's `prompt_budget`, capped by its context window minus the
+    # completion it may produce
+    def prompt_budget(self, name, max_tokens=0):
+        entry = self.models.get(name)
+        if entry is None:
+            return None
+        budget = entry.get('prompt_budget', entry.get('context_window'))
+        if budget is not None and entry.get('context_window'):
+            budget = min(budget, entry['context_window'] - max_tokens)
+        return budget
+
+    def health(self, name, refresh=False):
+        now = time.time()
+        with _health_lock:
+            cached = _health.get(name)
+        if cached is not None and not refresh and now - cached.checked_at < self.health_ttl:
+            return cached
+
+        entry = self.model_config(name)
+        headers = {}
+        api_key = entry['llm_config'].get('api_key')
+        if api_key and api_key != 'NULL':
+            headers['Authorization'] = f"Bearer {api_key}"
+
+        # an endpoint is only as healthy as its slowest/failing dependency
+        result = EndpointHealth(True, 0.0, now)
+        for url in entry.get('health_urls', []):
+            url_health = probe(url, headers, self.probe_timeout)
+            result.latency = max(result.latency, url_health.latency)
+            if not url_health.healthy:
+                result.healthy = False
+                result.error = f"{url}: {url_health.error}"
+                break
+
+        with _health_lock:
+            _health[name] = result
+        if not result.healthy:
+            logging.warning("model %s is unhealthy (%s)", name, result.error)
+        return result
+
+    # Order `names` by health and measured latency. The first healthy model keeps its place as the preferred
+    # choice; remaining healthy fallbacks are ordered fastest first and unhealthy ones are dropped, unless
+    # nothing is healthy, in which case the original order is kept and the client reports the failure.
+    def rank(self, names):
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            health = dict(zip(names, executor.map(self.health, names)))
+        healthy = [name for name in names if health[name].healthy]
+        if not healthy:
+            return list(names)
+        return healthy[:1] + sorted(healthy[1:], key=lambda name: health[name].latency)
+
+    # Build an autogen `llm_config` for `name`. Fallback models are added to `config_list`, so autogen's
+    # client moves on to the next entry when a call fails; fallbacks that can't be configured (e.g. no API key)
+    # are skipped rather than failing the whole config. Every entry shares the process-wide connections to its
+    # endpoint.
+    def llm_config(self, name, fallbacks=(), timeout=600, check_health=True, **params):
+        primary = self.model_config(name)
+        names = [name]
+        for fallback in fallbacks:
+            try:
+                self.model_config(fallback)
+            except ValueError as e:
+                logging.info("skipping fallback model %s: %s", fallback, e)
+                continue
+            names.append(fallback)
+
+        if check_health and len(names) > 1:
+            names = self.rank(names)
+
+        llm_config = {
+            'timeout': timeout,
+            'cache_seed': primary['cache_seed'],
+            'config_list': [self.model_config(n)['llm_config'] for n in names],
+            **params,
+        }
+        if self.client_pool is not None:
+            from hello_autogen.clients import get_client_pool
+
+            llm_config = get_client_pool(self.client_pool).configure(llm_config)
+        return llm_config
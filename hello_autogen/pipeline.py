@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import autogen
+
+# == Reply pipeline ======================================================================================
+#
+# Wraps an agent's LLM call in a chain of stages, registered the same way the examples register
+# `print_messages`: as reply functions. A stage is any callable `stage(call, proceed)` that may inspect or
+# rewrite the `LLMCall`, return a reply without calling the model, or call `proceed(call)` to run the rest of
+# the chain. The end of the chain is autogen's own `generate_oai_reply`, so cache_seed caching, config_list
+# failover and cost accounting keep working underneath.
+
+
+class LLMCall:
+    def __init__(self, agent, messages, sender, model=None):
+        self.agent = agent
+        self.messages = messages
+        self.sender = sender
+        # registry name of the model serving the call (see ModelRegistry.name_for)
+        self.model = model
+        # OpenAIWrapper to call instead of the agent's own client, and the llm_config it was built from
+        self.client = None
+        self.llm_config = agent.llm_config or {}
+        # scratch space shared by the stages of one call
+        self.meta = {}
+        # when the reply was asked for; async calls may wait for an executor thread before running
+        self.created_at = time.monotonic()
+
+
+def complete(call):
+    final, reply = call.agent.generate_oai_reply(call.messages, call.sender, config=call.client)
+    return reply if final else None
+
+
+class ReplyPipeline:
+    def __init__(self, stages=(), models=None):
+        self.stages = list(stages)
+        self.models = models
+
+    def add(self, stage):
+        self.stages.append(stage)
+        return self
+
+    def run(self, call):
+        def proceed_from(index):
+            def proceed(call):
+                if index == len(self.stages):
+                    return complete(call)
+                return self.stages[index](call, proceed_from(index + 1))
+            return proceed
+
+        return proceed_from(0)(call)
+
+    def model_for(self, agent):
+        if self.models is not None:
+            return self.models.name_for(agent.llm_config)
+        config_list = (agent.llm_config or {}).get('config_list') or [{}]
+        return config_list[0].get('model')
+
+    # Register the pipeline right in front of the agent's default LLM reply, so termination checks, code
+    # execution and function calls still get their turn first. As with autogen's own generate_oai_reply /
+    # a_generate_oai_reply pair, the async variant sits first so async chats use it (without blocking the event
+    # loop) and sync chats skip it. `print_messages` and other observers registered later still run before it.
+    def install(self, agent):
+        if not agent.llm_config:
+            return agent
+        model = self.model_for(agent)
+
+        def generate_pipeline_reply(recipient, messages, sender, config):
+            reply = self.run(LLMCall(recipient, messages, sender, model))
+            return reply is not None, reply
+
+        async def a_generate_pipeline_reply(recipient, messages, sender, config):
+            call = LLMCall(recipient, messages, sender, model)
+            reply = await asyncio.get_running_loop().run_in_executor(None, self.run, call)
+            # final even without a reply: async chats run the sync variant too, which would rerun the pipeline
+            return True, reply
+
+        position = _oai_reply_position(agent)
+        agent.register_reply([autogen.Agent, None], generate_pipeline_reply, position=position)
+        agent.register_reply(
+            [autogen.Agent, None], a_generate_pipeline_reply, position=position, ignore_async_in_sync_chat=True,
+        )
+        return agent
+
+
+# Matched by name so subclasses that swap in their own LLM reply (e.g. MultimodalConversableAgent) are found too
+def _oai_reply_position(agent):
+    for position, entry in enumerate(agent._reply_func_list):
+        if entry['reply_func'].__name__ in ('generate_oai_reply', 'a_generate_oai_reply'):
+            return position
+    return 0
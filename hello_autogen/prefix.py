@@ -0,0 +1,66 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+from hello_autogen.history import count_tokens, message_tokens
+
+# == Prompt prefix reuse =================================================================================
+#
+# Every call an agent makes starts with the same system message and, in a group chat, with the same task
+# (termination notice included) and earlier turns; only the end of the prompt is new. Backends that cache
+# prompt prefixes can skip recomputing that part: Ollama keeps the KV cache of a loaded model's last prompt
+# and reuses the part the next prompt shares with it (set OLLAMA_KEEP_ALIVE so models, and their cache, stay
+# loaded between turns), and OpenAI caches long shared prefixes on its side.
+#
+# That only works while prompts grow by appending, so:
+#
+# - token counts of static texts (system messages, the notice, earlier turns) are computed once and cached
+#   (hello_autogen/history.py) instead of on every call by compaction, routing and metrics;
+# - HistoryCompactor's `step` keeps a compacted history's summary unchanged for several turns;
+# - `PrefixTracker`, a reply pipeline stage placed after compaction, compares each prompt with the previous one
+#   the same agent sent to the same model and records how many of its tokens repeat that prefix
+#   (`call.meta['prefix_tokens']`), which CallMetrics shows as reusable prefix tokens per agent, model and
+#   session.
+
+MAX_CONVERSATIONS = 1024
+
+
+def _fingerprint(message):
+    content = message.get('content')
+    return hash((message.get('role'), message.get('name'), content if isinstance(content, str) else repr(content)))
+
+
+class PrefixTracker:
+    def __init__(self, max_conversations=MAX_CONVERSATIONS):
+        self.max_conversations = max_conversations
+        # (agent, sender, model) -> fingerprints of the last prompt sent, least recently used first. Agents are
+        # held by weak reference: an id() can be reused by an agent created after an earlier one is gone.
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'prompt_tokens': 0, 'prefix_tokens': 0}
+
+    def __call__(self, call, proceed):
+        model_name = (call.llm_config.get('config_list') or [{}])[0].get('model', 'gpt-3.5-turbo')
+        system_message = call.agent.system_message if isinstance(call.agent.system_message, str) else ''
+        prompt = [{'role': 'system', 'content': system_message}] + list(call.messages)
+        fingerprints = [_fingerprint(message) for message in prompt]
+
+        key = (weakref.ref(call.agent), weakref.ref(call.sender) if call.sender is not None else None, call.model)
+        with self._lock:
+            previous = self._last.pop(key, [])
+            self._last[key] = fingerprints
+            while len(self._last) > self.max_conversations:
+                self._last.popitem(last=False)
+
+        shared = 0
+        for a, b in zip(previous, fingerprints):
+            if a != b:
+                break
+            shared += 1
+        tokens = [count_tokens(system_message, model_name)] + [message_tokens(m, model_name) for m in call.messages]
+        call.meta['prefix_tokens'] = sum(tokens[:shared])
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['prompt_tokens'] += sum(tokens)
+            self.stats['prefix_tokens'] += call.meta['prefix_tokens']
+        return proceed(call)
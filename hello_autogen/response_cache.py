@@ -0,0 +1,309 @@
+import atexit
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# == Semantic response cache =============================================================================
+#
+# An in-memory tier in front of autogen's exact-match `cache_seed` disk cache (which still applies on a miss).
+# Replies are keyed by the registry model name, a hash of the conversation so far (system message and earlier
+# turns must match exactly) and the latest message. The latest message matches after normalization
+# ("Tell me a joke." == "tell me a joke"). Matching rephrasings by embedding similarity against cached prompts in
+# the same conversation context is opt-in - pass `embed`, e.g. `hashed_embedding` - since a prompt that differs
+# by a word or two ("... in reverse") can ask for something else; keep `threshold` high when you do.
+#
+# A reply is only stored once it passes `call.meta['validate']` when a stage in front sets one (ModelRouter and
+# SpeculativeRacer do), so a reply the router rejects and escalates isn't served again from the cache.
+#
+# `boilerplate` lists text removed from prompts before matching, such as the termination notice appended to
+# every task, which would otherwise make any two tasks look alike.
+#
+# With several server processes (hello_autogen/deploy.py) each has its own in-memory cache. Give them a
+# `shared` SharedReplies file (`get_cache` uses the RESPONSE_CACHE path when set) and every reply cached by one is
+# written there too; on a local miss, the others load that conversation's cached replies from it and match
+# again.
+
+EMBEDDING_DIMENSIONS = 256
+SIMILARITY_THRESHOLD = 0.97
+
+# Filler words that make rephrasings look different ("please write the" / "write a") without changing the
+# request. Question and negation words ("how", "do", "not") stay: they do change it.
+STOPWORDS = {'a', 'an', 'and', 'for', 'i', 'is', 'it', 'me', 'my', 'of', 'please', 'the', 'to', 'with', 'you'}
+
+
+def normalize(text):
+    text = re.sub(r"\s+", ' ', text.lower()).strip()
+    return text.strip(' .!?')
+
+
+# Hashed bag of content words and word pairs - cheap, dependency-free and good enough to match rephrasings of
+# short prompts. Any `text -> vector` function (e.g. a sentence-embedding model) can be passed instead.
+def hashed_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    words = [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+    vector = [0.0] * dimensions
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+
+def _similarity(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+class CacheEntry:
+    def __init__(self, prompt, embedding, reply, expires_at):
+        self.prompt = prompt
+        self.embedding = embedding
+        self.reply = reply
+        self.expires_at = expires_at
+
+
+class SemanticCache:
+    def __init__(self, max_entries=1024, ttl=60 * 60, threshold=SIMILARITY_THRESHOLD, embed=None,
+                 boilerplate=(), shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embed = embed
+        self.boilerplate = [b for b in boilerplate if b]
+        self.shared = shared
+        # (model, context) -> OrderedDict(normalized prompt -> CacheEntry); the outer dict is LRU-ordered too
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'shared_loads': 0,
+        }
+
+    def _normalize(self, prompt):
+        for text in self.boilerplate:
+            prompt = prompt.replace(text, '')
+        return normalize(prompt)
+
+    def get(self, model, context, prompt):
+        prompt = self._normalize(prompt)
+        reply = self._lookup(model, context, prompt)
+        if reply is None and self.shared is not None:
+            # another process may have cached it
+            rows = self.shared.load(model, context)
+            if rows:
+                self._merge(model, context, rows)
+                reply = self._lookup(model, context, prompt)
+        if reply is None:
+            with self._lock:
+                self._stats['misses'] += 1
+        return reply
+
+    def _lookup(self, model, context, prompt):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._entries.get((model, context))
+            if bucket is not None:
+                self._expire(bucket, now)
+                entry = bucket.get(prompt)
+                if entry is not None:
+                    self._touch(model, context, prompt)
+                    self._stats['exact_hits'] += 1
+                    return entry.reply
+
+                if self.embed is not None and bucket:
+                    embedding = self.embed(prompt)
+                    best_prompt, best_score = None, self.threshold
+                    for cached_prompt, cached in bucket.items():
+                        score = _similarity(embedding, cached.embedding)
+                        if score >= best_score:
+                            best_prompt, best_score = cached_prompt, score
+                    if best_prompt is not None:
+                        self._touch(model, context, best_prompt)
+                        self._stats['semantic_hits'] += 1
+                        return bucket[best_prompt].reply
+            return None
+
+    # Add the shared file's entries for a conversation that aren't cached here yet
+    def _merge(self, model, context, rows):
+        with self._lock:
+            known = set(self._entries.get((model, context), ()))
+        fresh = [(prompt, reply, expires_at) for prompt, reply, expires_at in rows if prompt not in known]
+        if not fresh:
+            return
+        embeddings = [self.embed(prompt) if self.embed is not None else None for prompt, _, _ in fresh]
+        # the file keeps wall clock expiry times, this cache monotonic ones
+        offset = time.monotonic() - time.time()
+        with self._lock:
+            bucket = self._entries.setdefault((model, context), OrderedDict())
+            for (prompt, reply, expires_at), embedding in zip(fresh, embeddings):
+                if prompt not in bucket:
+                    self._size += 1
+                    bucket[prompt] = CacheEntry(prompt, embedding, reply, expires_at + offset)
+            self._entries.move_to_end((model, context))
+            self._stats['shared_loads'] += 1
+            while self._size > self.max_entries:
+                self._evict_lru()
+
+    def put(self, model, context, prompt, reply):
+        prompt = self._normalize(prompt)
+        embedding = self.embed(prompt) if self.embed is not None else None
+        with self._lock:
+            bucket = self._entries.setdefault((model, context), OrderedDict())
+            if prompt not in bucket:
+                self._size += 1
+            bucket[prompt] = CacheEntry(prompt, embedding, reply, time.monotonic() + self.ttl)
+            self._touch(model, context, prompt)
+            while self._size > self.max_entries:
+                self._evict_lru()
+        if self.shared is not None:
+            self.shared.save(model, context, prompt, reply, time.time() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=self._size, max_entries=self.max_entries)
+        lookups = stats['exact_hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['exact_hits'] + stats['semantic_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _touch(self, model, context, prompt):
+        self._entries.move_to_end((model, context))
+        self._entries[(model, context)].move_to_end(prompt)
+
+    def _expire(self, bucket, now):
+        expired = [prompt for prompt, entry in bucket.items() if entry.expires_at <= now]
+        for prompt in expired:
+            del bucket[prompt]
+        self._size -= len(expired)
+        self._stats['expirations'] += len(expired)
+
+    def _evict_lru(self):
+        key, bucket = next(iter(self._entries.items()))
+        bucket.popitem(last=False)
+        if not bucket:
+            del self._entries[key]
+        self._size -= 1
+        self._stats['evictions'] += 1
+
+    # == Reply pipeline stage
+
+    def __call__(self, call, proceed):
+        key = conversation_key(call.agent, call.messages)
+        if call.model is None or key is None:
+            return proceed(call)
+
+        context, prompt = key
+        reply = self.get(call.model, context, prompt)
+        if reply is not None:
+            call.meta['cache'] = 'hit'
+            return reply
+
+        call.meta['cache'] = 'miss'
+        reply = proceed(call)
+        validate = call.meta.get('validate')
+        if isinstance(reply, str) and reply and (validate is None or validate(reply) is None):
+            self.put(call.model, context, prompt, reply)
+        return reply
+
+
+# Split a conversation into (hash of everything before the latest message, latest message). Multimodal
+# conversations and function/tool calls aren't cached.
+def conversation_key(agent, messages):
+    if not messages:
+        return None
+    context = hashlib.sha256(str(agent.system_message).encode())
+    for message in messages:
+        if not isinstance(message.get('content'), str) or message.get('function_call') or message.get('tool_calls'):
+            return None
+    for message in messages[:-1]:
+        context.update(f"\0{message.get('role')}\0{message.get('name', '')}\0{message['content']}".encode())
+    return context.hexdigest(), messages[-1]['content']
+
+
+# == Sharing between processes
+#
+# Cached replies in a SQLite file in WAL mode, so the processes of one deployment can read while another writes.
+# Entries are keyed like the in-memory ones (model, conversation context, normalized prompt); expired rows are
+# purged every PURGE_EVERY writes.
+
+PURGE_EVERY = 256
+
+SHARED_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS replies (
+    model TEXT NOT NULL,
+    context TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    reply TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (model, context, prompt)
+);
+'''
+
+
+class SharedReplies:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SHARED_SCHEMA)
+        self._writes = 0
+
+    # (prompt, reply, expires_at) of the unexpired replies cached for a conversation. A failing file is logged and
+    # treated as a miss: the cache never ends a chat.
+    def load(self, model, context):
+        try:
+            with self._lock:
+                return self._db.execute(
+                    'SELECT prompt, reply, expires_at FROM replies WHERE model = ? AND context = ? AND expires_at > ?',
+                    (model, context, time.time()),
+                ).fetchall()
+        except sqlite3.Error:
+            logging.exception("could not read shared replies from %s", self.path)
+            return []
+
+    def save(self, model, context, prompt, reply, expires_at):
+        try:
+            with self._lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO replies (model, context, prompt, reply, expires_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (model, context, prompt, reply, expires_at),
+                )
+                self._writes += 1
+                if self._writes % PURGE_EVERY == 0:
+                    self._db.execute('DELETE FROM replies WHERE expires_at <= ?', (time.time(),))
+        except sqlite3.Error:
+            logging.exception("could not write a shared reply to %s", self.path)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# One cache per name for the whole process, so it is shared by every Panel session - and, with RESPONSE_CACHE
+# set to a file, by every process using that file
+def get_cache(name='default', shared_path=None, **kwargs):
+    shared_path = shared_path or os.getenv('RESPONSE_CACHE')
+    with _caches_lock:
+        if name not in _caches:
+            shared = None
+            if shared_path:
+                shared = SharedReplies(shared_path)
+                atexit.register(shared.close)
+            _caches[name] = SemanticCache(shared=shared, **kwargs)
+        return _caches[name]
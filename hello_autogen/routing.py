@@ -0,0 +1,266 @@
+import logging
+import re
+import threading
+
+import autogen
+
+from hello_autogen.history import count_tokens, message_tokens
+from hello_autogen.pipeline import LLMCall
+from hello_autogen.speaker_selection import message_text
+
+# == Model tiers =========================================================================================
+#
+# The examples fix each agent's model up front (the user proxy of example-04 runs on GPT-4 just to decide when
+# the chat is over). `ModelRouter` is a reply pipeline stage that picks the model per call instead: it scores
+# the request and sends it to the cheapest tier that should handle it,
+#
+#     local (mistral / codellama)  ->  gpt-3.5  ->  gpt-4
+#
+# using codellama and the other tiers' `code` model for coding requests. A tier is skipped when its model isn't
+# configured (no OPEN_AI_API_KEY) or its endpoint is unhealthy. When a reply fails validation (empty, a refusal,
+# an unterminated code block) or the call fails, the same request is sent to the next tier up. (A streamed reply
+# that gets rejected has already been shown by then; the escalated one follows it.) Each tier gets a call of its
+# own, so what the stages after the router did to a rejected attempt (compacted messages, meta) doesn't carry
+# over, and `call.meta['validate']` lets them hold off on a reply until it passes, e.g. so the response cache
+# only stores replies the router keeps.
+#
+# The score adds up:
+#
+# - prompt length: long conversations need the larger context and attention of the bigger models;
+# - task type: analysis / design / debugging requests count as hard, coding requests as a bit harder than chat;
+# - agent role: `roles` adds a per-agent offset, e.g. {'UserProxy': -0.5} keeps the termination check local.
+#
+# Calls that can't be routed (multimodal content, function/tool calls) keep the agent's own config. Routed calls
+# are made through the router's own clients, so their cost is in `router.cost()` rather than in the agents'
+# usage summaries; use one router per agent graph (session) to keep costs apart.
+
+TIERS = [
+    {'name': 'local', 'chat': 'mistral', 'code': 'codellama', 'max_score': 0.35},
+    {'name': 'gpt-3.5', 'chat': 'oai-gpt35', 'code': 'oai-gpt35', 'max_score': 0.7},
+    {'name': 'gpt-4', 'chat': 'oai-gpt4', 'code': 'oai-gpt4', 'max_score': None},
+]
+
+HARD = re.compile(
+    r"\b(why|explain|analy[sz]e|compare|design|architect\w*|prove|optimi[sz]e|debug|refactor|trade-?offs?|"
+    r"step[- ]by[- ]step|plan|evaluate|review)\b",
+    re.I,
+)
+CODE = re.compile(
+    r"```|\b(code|function|class|script|program|python|javascript|typescript|node|sql|regex|dataframe|pandas|"
+    r"implement|bug|error|exception|traceback|compile|api)\b",
+    re.I,
+)
+# the system message says what an agent is for, e.g. "You are a senior python engineer."
+CODE_ROLE = re.compile(r"\b(engineer|developer|programmer|coder)\b", re.I)
+REFUSAL = re.compile(
+    r"^\s*(i'?m sorry|i apologi[sz]e|as an ai|i (cannot|can'?t|am unable to|'m unable to|do not know how))", re.I,
+)
+
+LONG_PROMPT_TOKENS = 4000
+HARD_WEIGHT = 0.4
+CODE_WEIGHT = 0.15
+LENGTH_WEIGHT = 0.5
+
+# llm_config keys that belong to the model rather than to the request
+MODEL_KEYS = ('config_list', 'cache_seed')
+
+
+# == Reply validation
+#
+# A validator returns why a reply is unacceptable, or None.
+
+def _reply_text(reply):
+    return reply if isinstance(reply, str) else (reply or {}).get('content') or ''
+
+
+def not_empty(reply, call):
+    if isinstance(reply, dict) and (reply.get('function_call') or reply.get('tool_calls')):
+        return None
+    return 'empty reply' if not _reply_text(reply).strip() else None
+
+
+def not_refused(reply, call):
+    return 'refusal' if REFUSAL.match(_reply_text(reply)) else None
+
+
+def closed_code_blocks(reply, call):
+    return 'unterminated code block' if _reply_text(reply).count('```') % 2 else None
+
+
+VALIDATORS = [not_empty, not_refused, closed_code_blocks]
+
+
+# Calls the router and the speculative racer leave to the agent's own config
+def routable(call):
+    llm_config = call.agent.llm_config or {}
+    if not llm_config.get('config_list') or llm_config.get('functions') or llm_config.get('tools'):
+        return False
+    return all(isinstance(message.get('content'), (str, type(None))) for message in call.messages)
+
+
+# Clients for calls sent to a model other than the agent's own, shared by every agent with the same request
+# parameters (temperature, max_tokens, ...) and kept so their cost can be added up
+class ModelClients:
+    def __init__(self, models, check_health=True):
+        self.models = models
+        self.check_health = check_health
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def available(self, model):
+        try:
+            self.models.model_config(model)
+        except (KeyError, ValueError):
+            return False
+        return not self.check_health or self.models.health(model).healthy
+
+    # The llm_config for `model` with the agent's request parameters (and `overrides`), and a client built from it
+    def get(self, model, agent, **overrides):
+        params = {key: value for key, value in (agent.llm_config or {}).items() if key not in MODEL_KEYS}
+        params.update(overrides)
+        key = (model, repr(sorted(params.items(), key=lambda item: item[0])))
+        with self._lock:
+            if key not in self._clients:
+                llm_config = self.models.llm_config(model, check_health=False, **params)
+                self._clients[key] = (llm_config, autogen.OpenAIWrapper(**llm_config))
+            return self._clients[key]
+
+    def clients(self):
+        with self._lock:
+            return [client for _, client in self._clients.values()]
+
+    # What the calls made with these clients have cost so far (cache hits excluded)
+    def cost(self):
+        return sum((client.actual_usage_summary or {}).get('total_cost', 0.0) for client in self.clients())
+
+
+class Route:
+    def __init__(self, score, kind, reasons):
+        self.score = score
+        self.kind = kind
+        self.reasons = reasons
+
+    def __repr__(self):
+        return f"Route(score={self.score:.2f}, kind={self.kind!r}, reasons={self.reasons})"
+
+
+class ModelRouter:
+    def __init__(self, models, tiers=TIERS, roles=None, validators=VALIDATORS, check_health=True):
+        self.models = models
+        self.tiers = tiers
+        self.roles = roles or {}
+        self.validators = list(validators)
+        self.model_clients = ModelClients(models, check_health)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'tiers': {}, 'escalations': 0, 'rejected': {}, 'skipped': 0}
+
+    def score(self, call):
+        text = message_text(call.messages[-1]) if call.messages else ''
+        system_message = call.agent.system_message if isinstance(call.agent.system_message, str) else ''
+        tokens = count_tokens(system_message) + sum(message_tokens(message) for message in call.messages)
+
+        score, reasons = 0.0, []
+        length = min(1.0, tokens / LONG_PROMPT_TOKENS) * LENGTH_WEIGHT
+        if length >= 0.05:
+            score += length
+            reasons.append(f"{tokens} tokens")
+        if HARD.search(text):
+            score += HARD_WEIGHT
+            reasons.append('hard task')
+        kind = 'chat'
+        if CODE.search(text) or CODE_ROLE.search(system_message):
+            kind = 'code'
+            score += CODE_WEIGHT
+            reasons.append('code')
+        offset = self.roles.get(call.agent.name, 0.0)
+        if offset:
+            score += offset
+            reasons.append(f"role {offset:+.2f}")
+        return Route(max(0.0, score), kind, reasons)
+
+    def _tier_for(self, score):
+        for index, tier in enumerate(self.tiers):
+            if tier['max_score'] is None or score <= tier['max_score']:
+                return index
+        return len(self.tiers) - 1
+
+    def _invalid(self, reply, call):
+        for validator in self.validators:
+            reason = validator(reply, call)
+            if reason is not None:
+                return reason
+        return None
+
+    # A call of its own for one tier
+    def _attempt(self, call, model, llm_config, client):
+        attempt = LLMCall(call.agent, list(call.messages), call.sender, model)
+        attempt.llm_config, attempt.client = llm_config, client
+        attempt.meta = dict(call.meta)
+        attempt.meta['validate'] = lambda reply: self._invalid(reply, attempt)
+        return attempt
+
+    # Carry the tier that answered back to the stages in front of the router
+    def _settle(self, call, attempt):
+        call.model = attempt.model
+        call.llm_config, call.client = attempt.llm_config, attempt.client
+        call.meta.update({key: value for key, value in attempt.meta.items() if key != 'validate'})
+
+    def __call__(self, call, proceed):
+        # a speculative candidate (hello_autogen/speculative.py) already has its model, as does a call a ChatBudget
+        # downgraded (hello_autogen/budgets.py)
+        if call.meta.get('speculative') or call.meta.get('downgraded') or not routable(call):
+            return proceed(call)
+
+        route = self.score(call)
+        reply, reason, attempt = None, None, None
+        for index in range(self._tier_for(route.score), len(self.tiers)):
+            tier = self.tiers[index]
+            model = tier[route.kind]
+            if not self.model_clients.available(model):
+                with self._lock:
+                    self.stats['skipped'] += 1
+                continue
+            attempt = self._attempt(call, model, *self.model_clients.get(model, call.agent))
+            attempt.meta['route'] = {
+                'tier': tier['name'], 'model': model, 'score': route.score, 'escalated': reason,
+            }
+            with self._lock:
+                self.stats['calls'] += 1
+                self.stats['tiers'][tier['name']] = self.stats['tiers'].get(tier['name'], 0) + 1
+                if reason is not None:
+                    self.stats['escalations'] += 1
+            logging.debug("routing %s to %s: %s", call.agent.name, model, route)
+
+            try:
+                reply = proceed(attempt)
+            except Exception as e:
+                if index == len(self.tiers) - 1:
+                    self._settle(call, attempt)
+                    raise
+                reply, reason = None, f"{type(e).__name__}: {e}"
+            else:
+                reason = self._invalid(reply, attempt)
+                if reason is None:
+                    self._settle(call, attempt)
+                    return reply
+            rejected = reason.split(':')[0]
+            with self._lock:
+                self.stats['rejected'][rejected] = self.stats['rejected'].get(rejected, 0) + 1
+            logging.info("%s reply from %s rejected (%s), escalating", call.agent.name, model, reason)
+
+        # no tier above the last one tried: keep its reply even though it didn't validate
+        if reply is not None:
+            self._settle(call, attempt)
+            return reply
+        # no tier was available at all: use the agent's own config
+        call.llm_config, call.client = call.agent.llm_config or {}, None
+        call.model = self.models.name_for(call.agent.llm_config)
+        return proceed(call)
+
+    # The clients routed calls were made with, e.g. to add their usage summaries to the agents'
+    def clients(self):
+        return self.model_clients.clients()
+
+    # What the routed calls have cost so far (cache hits excluded)
+    def cost(self):
+        return self.model_clients.cost()
@@ -0,0 +1,132 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# == Session pool ======================================================================================
+#
+# `panel serve` re-executes an example script for every browser session, but anything imported from this
+# package is shared by the whole server process. The pool lives here so it survives across sessions: each
+# session gets its own agent graph (agents, GroupChat, manager) built on first use by a factory, sessions idle
+# longer than `idle_timeout` are dropped, and at most `max_sessions` graphs are kept alive at once.
+
+
+class SessionPoolFull(RuntimeError):
+    pass
+
+
+class Session:
+    def __init__(self, session_id, state):
+        self.id = session_id
+        self.state = state
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.active = 0
+
+
+class SessionPool:
+    def __init__(self, max_sessions=32, idle_timeout=15 * 60):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # Return the session for `session_id`, building it with `factory()` if needed. The factory is passed in on
+    # every call rather than stored, because it usually closes over per-session objects such as the chat UI.
+    def acquire(self, session_id, factory):
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions and not self._evict_lru():
+                    raise SessionPoolFull(f"all {self.max_sessions} sessions are busy")
+                session = Session(session_id, None)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.active += 1
+            session.last_used = now
+
+        if session.state is None:
+            try:
+                session.state = factory()
+            except Exception:
+                self.discard(session_id)
+                raise
+        return session
+
+    def release(self, session):
+        with self._lock:
+            session.active = max(0, session.active - 1)
+            session.last_used = time.monotonic()
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'active': sum(1 for s in self._sessions.values() if s.active),
+                'max_sessions': self.max_sessions,
+                'evictions': self.evictions,
+            }
+
+    def _evict_idle(self, now):
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if not session.active and now - session.last_used > self.idle_timeout
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
+        self.evictions += len(expired)
+
+    # Sessions are kept in least-recently-used order, so the first idle one is the best candidate
+    def _evict_lru(self):
+        for session_id, session in self._sessions.items():
+            if not session.active:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return True
+        return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# One pool per app, shared by every execution of the app's script in this process
+def get_pool(name, **kwargs):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = SessionPool(**kwargs)
+        return _pools[name]
+
+
+def current_session_id():
+    import panel
+
+    if panel.state.curdoc is not None and panel.state.curdoc.session_context is not None:
+        return panel.state.curdoc.session_context.id
+    return 'default'
+
+
+# A session id that survives reconnects and reloads, unlike Panel's: the `?session=` query parameter, which is
+# added to the URL when it's missing. Anyone with the URL can pick the session up, so treat it like a link to
+# the conversation. Outside `panel serve` (e.g. in bench/ or batch runs) there is none.
+def persistent_session_id(parameter='session'):
+    import panel
+
+    if panel.state.curdoc is None or panel.state.curdoc.session_context is None:
+        return None
+    values = panel.state.session_args.get(parameter)
+    if values:
+        return values[0].decode()
+    session_id = uuid.uuid4().hex
+    panel.state.location.update_query(**{parameter: session_id})
+    return session_id
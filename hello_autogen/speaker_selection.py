@@ -0,0 +1,197 @@
+import logging
+import math
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import autogen
+
+from hello_autogen.history import HistoryCompactor
+
+# == Local speaker selection ============================================================================
+#
+# GroupChatManager normally spends one LLM round-trip per round just to pick the next speaker. The selector
+# below picks locally from the agents' `description`s and only returns a speaker when it is confident; when it
+# isn't, HeuristicGroupChat falls back to autogen's LLM-based selection - on a compacted copy of the history
+# when a `history_compactor` is set, so the selection prompt doesn't grow with every round either.
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'has', 'have', 'how', 'i', 'in',
+    'is', 'it', 'me', 'my', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to', 'was', 'what', 'when', 'who',
+    'with', 'you', 'your', 'only', 'without', 'strong', 'skills', 'helpful', 'assistant', 'senior', 'expert',
+    # request verbs say little about who should answer ("write" would otherwise point at the Writer)
+    'write', 'tell', 'give', 'show', 'make', 'create', 'please',
+}
+
+CODE_BLOCK = re.compile(r"```")
+
+
+def tokenize(text):
+    # split CamelCase names (PythonEngineer -> python engineer) before lower-casing
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or '')
+    words = re.findall(r"[a-z][a-z0-9+#.-]*", text.lower())
+    return [word.strip('.-') for word in words if word.strip('.-') not in STOPWORDS]
+
+
+def message_text(message):
+    content = message.get('content')
+    if isinstance(content, list):
+        # multimodal messages carry a list of {'type': 'text' | 'image_url', ...} parts
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+class KeywordSpeakerSelector:
+    # `keywords` adds terms per agent name on top of what its name, description and system message give,
+    # e.g. {'PythonEngineer': ['dataframe', 'pandas']}. `embed` can be any text -> vector function (such as a
+    # small sentence-embedding model); when given, cosine similarity replaces keyword overlap.
+    def __init__(self, keywords=None, min_score=1.0, min_margin=0.5, embed=None):
+        self.keywords = keywords or {}
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.embed = embed
+        self.stats = {'local': 0, 'fallback': 0}
+        self._profiles = {}
+
+    def _profile(self, agent):
+        if agent.name not in self._profiles:
+            text = ' '.join([
+                agent.name,
+                agent.description or '',
+                # a multimodal agent's system message is a list of content parts
+                message_text({'content': getattr(agent, 'system_message', '')}),
+                ' '.join(self.keywords.get(agent.name, [])),
+            ])
+            self._profiles[agent.name] = self.embed(text) if self.embed else set(tokenize(text))
+        return self._profiles[agent.name]
+
+    def _scores(self, agents, text):
+        if self.embed:
+            vector = self.embed(text)
+            return [(agent, _cosine(vector, self._profile(agent))) for agent in agents]
+
+        # weight terms by how specific they are to one agent, so shared words like "engineer" count for little
+        terms = set(tokenize(text))
+        matches = [(agent, {term for term in terms if _matches(term, self._profile(agent))}) for agent in agents]
+        document_frequency = {}
+        for _, matched in matches:
+            for term in matched:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        return [
+            (agent, sum(math.log(1 + len(agents) / document_frequency[term]) for term in matched))
+            for agent, matched in matches
+        ]
+
+    # Returns `(agent, confidence)`; `agent` is None when the selector isn't confident enough to skip the LLM
+    def select(self, last_speaker, agents, messages):
+        candidates = [agent for agent in agents if agent is not last_speaker] or list(agents)
+        if not messages:
+            return None, 0.0
+        text = message_text(messages[-1])
+
+        # a code block from an assistant goes to whoever can execute it
+        if CODE_BLOCK.search(text):
+            executors = [a for a in candidates if getattr(a, '_code_execution_config', False)]
+            if len(executors) == 1:
+                return executors[0], 1.0
+
+        # an agent addressed by name is the next speaker
+        mentioned = [a for a in candidates if re.search(rf"\b{re.escape(a.name)}\b", text)]
+        if len(mentioned) == 1:
+            return mentioned[0], 1.0
+
+        scores = sorted(self._scores(candidates, text), key=lambda item: item[1], reverse=True)
+        best, best_score = scores[0]
+        runner_up_score = scores[1][1] if len(scores) > 1 else 0.0
+        if best_score <= 0:
+            return None, 0.0
+        confidence = (best_score - runner_up_score) / best_score
+        if (self.embed or best_score >= self.min_score) and confidence >= self.min_margin:
+            return best, confidence
+        return None, confidence
+
+
+# exact match, or a shared stem for longer words ("story" / "storytelling", "recipe" / "recipes")
+def _matches(term, profile):
+    if term in profile:
+        return True
+    return len(term) >= 4 and any(
+        len(word) >= 4 and (word.startswith(term) or term.startswith(word)) for word in profile
+    )
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class HeuristicGroupChat(autogen.GroupChat):
+    speaker_selector: KeywordSpeakerSelector = field(default_factory=KeywordSpeakerSelector)
+    history_compactor: Optional[HistoryCompactor] = None
+    # CallMetrics (or a session's view of it) to time the selections the LLM makes
+    metrics: Optional[Any] = None
+    # ConversationLog (hello_autogen/store.py) every appended message is recorded to
+    conversation_log: Optional[Any] = None
+
+    def append(self, message, speaker):
+        super().append(message, speaker)
+        if self.conversation_log is not None:
+            self.conversation_log.append(message)
+
+    def _select_locally(self, last_speaker):
+        # only stand in for the LLM; explicit methods such as "round_robin" keep their own behaviour
+        if self.speaker_selection_method != 'auto':
+            return None
+        agent, confidence = self.speaker_selector.select(last_speaker, self.agents, self.messages)
+        if agent is None:
+            self.speaker_selector.stats['fallback'] += 1
+            logging.debug("local speaker selection not confident (%.2f), asking the LLM", confidence)
+        else:
+            self.speaker_selector.stats['local'] += 1
+            logging.debug("selected %s locally (confidence %.2f)", agent.name, confidence)
+        return agent
+
+    # autogen builds the selection prompt from `self.messages`, so swap in a compacted copy for the LLM call
+    @contextmanager
+    def _compacted_history(self, selector):
+        if self.history_compactor is None:
+            yield
+            return
+        compactor = self.history_compactor
+        model = compactor.models.name_for(selector.llm_config) if compactor.models is not None else None
+        messages = self.messages
+        self.messages = compactor.compact(messages, compactor.budget_for(model, selector.llm_config))
+        try:
+            yield
+        finally:
+            self.messages = messages
+
+    @contextmanager
+    def _measured(self, selector):
+        if self.metrics is None:
+            yield
+            return
+        models = self.history_compactor.models if self.history_compactor is not None else None
+        if models is not None:
+            model = models.name_for(selector.llm_config)
+        else:
+            model = ((selector.llm_config or {}).get('config_list') or [{}])[0].get('model')
+        with self.metrics.measure(selector.name, model, self.messages, kind='speaker_selection'):
+            yield
+
+    def select_speaker(self, last_speaker, selector):
+        agent = self._select_locally(last_speaker)
+        if agent is not None:
+            return agent
+        with self._compacted_history(selector), self._measured(selector):
+            return super().select_speaker(last_speaker, selector)
+
+    async def a_select_speaker(self, last_speaker, selector):
+        agent = self._select_locally(last_speaker)
+        if agent is not None:
+            return agent
+        with self._compacted_history(selector), self._measured(selector):
+            return await super().a_select_speaker(last_speaker, selector)
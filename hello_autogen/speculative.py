@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hello_autogen.pipeline import LLMCall
+from hello_autogen.routing import VALIDATORS, ModelClients, routable
+
+# == Speculative replies =================================================================================
+#
+# One slow backend sets the latency the user sees: a reply from a busy Ollama or a stalled OpenAI request can
+# take minutes (up to the 600s timeout) even when another model would have answered in seconds.
+# `SpeculativeRacer` is a reply pipeline stage that sends a call from the agents in `candidates` to several
+# models at once, e.g. {'Writer': ['mistral', 'oai-gpt35']}, and returns the first reply that passes the
+# validators (the same cheap checks ModelRouter uses). Each candidate runs the rest of the pipeline on its own
+# (cache, compaction, backend limits), with a request timeout of `timeout` rather than the agent's.
+#
+# - `hedge_after` starts only the first candidate and sends the others if it hasn't answered by then, which
+#   keeps the extra load to the slow cases; 0 sends them all at once.
+# - The losers are cancelled: those not started yet never are, and the replies of those already in flight are
+#   dropped. An HTTP request can't be taken back, so they still finish (or time out) in the background, and
+#   their cost still counts.
+#
+# Candidates that aren't configured or whose endpoint is unhealthy are left out; with fewer than two left, and
+# for calls with images or function calls, the call goes ahead as usual. Put the racer before a ModelRouter,
+# which leaves candidates on their model.
+
+RACE_TIMEOUT = 120
+MAX_WORKERS = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# One pool for every racer in the process; losers keep their thread until their request is done
+def _race_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='speculative')
+        return _executor
+
+
+class SpeculativeRacer:
+    def __init__(self, models, candidates, validators=VALIDATORS, hedge_after=0.0, timeout=RACE_TIMEOUT,
+                 check_health=True):
+        self.models = models
+        self.candidates = candidates
+        self.validators = list(validators)
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.model_clients = ModelClients(models, check_health)
+        self._lock = threading.Lock()
+        self.stats = {'races': 0, 'wins': {}, 'rejected': 0, 'failed': 0, 'hedged': 0, 'cancelled': 0}
+
+    def _invalid(self, reply, call):
+        for validator in self.validators:
+            reason = validator(reply, call)
+            if reason is not None:
+                return reason
+        return None
+
+    def _candidate(self, call, model):
+        candidate = LLMCall(call.agent, list(call.messages), call.sender, model)
+        candidate.llm_config, candidate.client = self.model_clients.get(model, call.agent, timeout=self.timeout)
+        # downstream stages can tell a candidate apart, e.g. so it isn't streamed into the chat
+        candidate.meta['speculative'] = True
+        candidate.meta['validate'] = lambda reply: self._invalid(reply, candidate)
+        return candidate
+
+    def _run(self, call, model, proceed, cancelled, results):
+        if cancelled.is_set():
+            with self._lock:
+                self.stats['cancelled'] += 1
+            return
+        # every candidate that starts reports back, or the race would wait for it forever
+        try:
+            candidate = self._candidate(call, model)
+            reply = proceed(candidate)
+        except Exception as e:
+            results.put((model, None, None, f"{type(e).__name__}: {e}"))
+            return
+        results.put((model, candidate, reply, self._invalid(reply, candidate)))
+
+    def __call__(self, call, proceed):
+        models = [model for model in self.candidates.get(call.agent.name, ()) if self.model_clients.available(model)]
+        # a call a ChatBudget downgraded stays on its model
+        if len(models) < 2 or call.meta.get('downgraded') or not routable(call):
+            return proceed(call)
+
+        with self._lock:
+            self.stats['races'] += 1
+        started = time.monotonic()
+        cancelled = threading.Event()
+        results = queue.Queue()
+        executor = _race_executor()
+        launched = 0
+
+        def launch(models):
+            nonlocal launched
+            for model in models:
+                executor.submit(self._run, call, model, proceed, cancelled, results)
+                launched += 1
+
+        # with `hedge_after` the others are only sent once the first candidate is slow or comes back no good
+        launch(models[:1] if self.hedge_after else models)
+        received, fallback = 0, None
+        while received < launched:
+            try:
+                model, candidate, reply, reason = results.get(timeout=self.hedge_after if launched < len(models) else None)
+            except queue.Empty:
+                with self._lock:
+                    self.stats['hedged'] += 1
+                launch(models[1:])
+                continue
+            received += 1
+            if reason is None:
+                cancelled.set()
+                return self._won(call, candidate, reply, started)
+            with self._lock:
+                self.stats['rejected' if reply is not None else 'failed'] += 1
+            logging.info("%s candidate from %s rejected (%s)", call.agent.name, model, reason)
+            if reply is not None and fallback is None:
+                fallback = (candidate, reply)
+            if launched < len(models):
+                launch(models[1:])
+
+        # nothing passed: keep the first reply there was, or fall back to the agent's own config
+        if fallback is not None:
+            return self._won(call, *fallback, started)
+        return proceed(call)
+
+    def _won(self, call, candidate, reply, started):
+        call.model = candidate.model
+        call.llm_config, call.client = candidate.llm_config, candidate.client
+        call.meta.update(
+            {key: value for key, value in candidate.meta.items() if key not in ('speculative', 'validate')},
+        )
+        call.meta['race'] = {'model': candidate.model, 'elapsed': time.monotonic() - started}
+        with self._lock:
+            self.stats['wins'][candidate.model] = self.stats['wins'].get(candidate.model, 0) + 1
+        logging.debug("%s reply from %s won the race", call.agent.name, candidate.model)
+        return reply
+
+    def clients(self):
+        return self.model_clients.clients()
+
+    # What the candidates have cost so far, losers included
+    def cost(self):
+        return self.model_clients.cost()
@@ -0,0 +1,194 @@
+import datetime
+import importlib
+import logging
+import threading
+import time
+
+# == Fast startup ========================================================================================
+#
+# `panel serve` runs an app script for every browser session and on every autoreload, and the first run pays
+# for importing autogen (and everything it imports) and for probing each model endpoint. The Panel apps keep
+# their scripts cheap by deferring that work:
+#
+# - `lazy_value(name, fn, *args, **kwargs)` is a process-wide value built by `fn` on first `.get()` and shared by
+#   every later run of the script. `fn` may be given as a `'module:attribute'` string, so the module holding it
+#   isn't imported until then; `lazy_import(module)` is the same for a plain import. With `max_age`, a value
+#   older than that is rebuilt in the background while the old one keeps being served.
+# - `prewarm(*values)` builds values one after another in a background thread once the Panel server is listening
+#   (right away when there is no server, e.g. in bench/), so the first visitor doesn't wait for them. Use
+#   `panel serve --warm` to run the script - and so schedule the prewarm - at startup.
+# - `StartupTimer` times a script run against a budget and logs where the time went.
+#
+# Callbacks handed to `lazy_value` must not be defined in the app script itself: Panel cleans up a script's
+# module when its session ends, so use functions from this package (or bound methods of objects from it).
+
+_values = {}
+_values_lock = threading.Lock()
+
+
+def _resolve(fn):
+    if isinstance(fn, str):
+        module, _, attribute = fn.partition(':')
+        fn = importlib.import_module(module)
+        for part in attribute.split('.'):
+            fn = getattr(fn, part)
+    return fn
+
+
+class LazyValue:
+    def __init__(self, name, fn, args=(), kwargs=None, max_age=None):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.max_age = max_age
+        self.built_at = None
+        self.build_time = None
+        self._value = None
+        self._building = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def _build(self, event):
+        started = time.monotonic()
+        try:
+            value = _resolve(self.fn)(*self.args, **self.kwargs)
+            with self._lock:
+                self._value = value
+                self.built_at = time.monotonic()
+                self.build_time = self.built_at - started
+            logging.debug("loaded %s in %.2fs", self.name, self.build_time)
+        except Exception:
+            logging.exception("could not load %s", self.name)
+        finally:
+            with self._lock:
+                self._building = None
+            event.set()
+
+    # Starts building in a background thread unless a build is running; returns the build's event
+    def start(self):
+        with self._lock:
+            if self._building is not None:
+                return self._building
+            event = self._building = threading.Event()
+        threading.Thread(target=self._build, args=(event,), name=f"load-{self.name}", daemon=True).start()
+        return event
+
+    def get(self):
+        if self.ready:
+            if self.max_age is not None and time.monotonic() - self.built_at > self.max_age:
+                self.start()
+            return self._value
+        with self._lock:
+            event = self._building
+            if event is None:
+                event = self._building = threading.Event()
+                owner = True
+            else:
+                owner = False
+        # the first caller builds on its own thread rather than waiting on another one
+        if owner:
+            self._build(event)
+        else:
+            event.wait()
+        if not self.ready:
+            raise RuntimeError(f"could not load {self.name}, see the log")
+        return self._value
+
+
+def lazy_value(name, fn, *args, max_age=None, **kwargs):
+    with _values_lock:
+        if name not in _values:
+            _values[name] = LazyValue(name, fn, args, kwargs, max_age)
+        return _values[name]
+
+
+def lazy_import(module):
+    return lazy_value('import:' + module, importlib.import_module, module)
+
+
+# == Pre-warming
+
+_prewarm_queue = []
+_prewarm_lock = threading.Lock()
+_server_started = False
+PREWARM_TASK = 'hello-autogen-prewarm'
+
+
+# One value at a time: imports on parallel threads mostly wait on each other's import locks
+def _prewarm(values):
+    for value in values:
+        try:
+            value.get()
+        except RuntimeError:
+            # logged by the build; a later `.get()` tries again
+            pass
+
+
+def _start_prewarm():
+    global _server_started
+    with _prewarm_lock:
+        _server_started = True
+        values, _prewarm_queue[:] = [value for value in _prewarm_queue if not value.ready], []
+    if values:
+        threading.Thread(target=_prewarm, args=(values,), name='prewarm', daemon=True).start()
+
+
+def _panel_server():
+    try:
+        import panel
+    except ImportError:
+        return False
+    return panel.state.curdoc is not None and panel.state.curdoc.session_context is not None
+
+
+def prewarm(*values):
+    with _prewarm_lock:
+        _prewarm_queue.extend(values)
+        wait_for_server = not _server_started and _panel_server()
+    if wait_for_server:
+        import panel
+
+        # runs once the server's event loop is going; the task is scheduled once per process
+        panel.state.schedule_task(PREWARM_TASK, _start_prewarm, at=datetime.datetime.now())
+    else:
+        _start_prewarm()
+
+
+# == Startup timing
+
+STARTUP_BUDGET = 1.0
+
+startup_stats = {}
+
+
+class StartupTimer:
+    def __init__(self, name, budget=STARTUP_BUDGET):
+        self.name = name
+        self.budget = budget
+        self.sections = []
+        self.started = self._last = time.monotonic()
+
+    def mark(self, section):
+        now = time.monotonic()
+        self.sections.append((section, now - self._last))
+        self._last = now
+
+    def finish(self):
+        elapsed = time.monotonic() - self.started
+        stats = startup_stats.setdefault(self.name, {'runs': 0, 'last': 0.0, 'max': 0.0, 'over_budget': 0})
+        stats['runs'] += 1
+        stats['last'] = elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        breakdown = ', '.join(f"{section} {seconds:.3f}s" for section, seconds in self.sections)
+        if elapsed > self.budget:
+            stats['over_budget'] += 1
+            logging.warning(
+                "%s started in %.2fs, over its %.2fs budget (%s)", self.name, elapsed, self.budget, breakdown,
+            )
+        else:
+            logging.info("%s started in %.3fs (%s)", self.name, elapsed, breakdown)
+        return elapsed
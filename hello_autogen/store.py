@@ -0,0 +1,213 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from hello_autogen.history import extractive_summary
+
+# == Conversation store ==================================================================================
+#
+# Chat results used to live only in memory (and in debug.log). `ConversationStore` keeps every group chat
+# message in a SQLite file, keyed by session and conversation, in an append-only table: a message is written
+# once, when it is spoken, and never rewritten or loaded back as a whole.
+#
+# Resuming a conversation reads only the last `window` messages plus a running summary of everything before
+# them. The summaries are append-only too: when messages have dropped out of the window since the last
+# summary, a new summary row is added from the previous one plus one line per dropped message
+# (`extractive_summary` by default), so a resume only ever summarizes what is new.
+#
+# - `store.log(session_id, conversation_id)` returns a ConversationLog; pass it to
+#   `HeuristicGroupChat(conversation_log=...)` to record messages as the group chat appends them.
+# - `log.load()` returns the summary message (if any) and the recent messages, e.g. to show a reconnecting
+#   user the conversation so far; `seed_group_chat(manager, messages)` puts them back into a group chat, which
+#   then carries on with `initiate_chat(..., clear_history=False)`.
+#
+# The file is in WAL mode, so readers don't block the writer and several server processes can share it.
+
+DEFAULT_PATH = 'conversations.db'
+RESUME_WINDOW = 12
+MAX_SUMMARY_LINES = 40
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT,
+    name TEXT,
+    content TEXT,
+    extra TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, conversation_id, seq)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    session_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    upto_seq INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, conversation_id, upto_seq)
+);
+'''
+
+# message keys with their own column; anything else (function_call, tool_calls, ...) goes to `extra` as JSON
+COLUMNS = ('role', 'name', 'content')
+
+
+def _row_message(role, name, content, extra):
+    message = json.loads(extra) if extra else {}
+    message.update({key: value for key, value in zip(COLUMNS, (role, name, content)) if value is not None})
+    return message
+
+
+class ConversationStore:
+    def __init__(self, path=DEFAULT_PATH, window=RESUME_WINDOW, summarize=extractive_summary,
+                 max_summary_lines=MAX_SUMMARY_LINES):
+        self.path = path
+        self.window = window
+        self.summarize = summarize
+        self.max_summary_lines = max_summary_lines
+        self._lock = threading.Lock()
+        # autocommit; writes open their own transactions
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # in WAL mode a commit is durable at the next checkpoint rather than fsynced on every message
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self.stats = {'appended': 0, 'loads': 0, 'summaries': 0}
+
+    def log(self, session_id, conversation_id):
+        return ConversationLog(self, session_id, conversation_id)
+
+    def append(self, session_id, conversation_id, message):
+        content = message.get('content')
+        if content is not None and not isinstance(content, str):
+            content = json.dumps(content, default=str)
+        extra = {key: value for key, value in message.items() if key not in COLUMNS and value is not None}
+        with self._lock:
+            # the next seq is taken inside the insert, so processes sharing the file can't hand out the same one
+            self._db.execute(
+                'INSERT INTO messages (session_id, conversation_id, seq, role, name, content, extra, created_at) '
+                'SELECT ?, ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ?, ?, ? FROM messages '
+                'WHERE session_id = ? AND conversation_id = ?',
+                (session_id, conversation_id, message.get('role'), message.get('name'), content,
+                 json.dumps(extra, default=str) if extra else None, time.time(), session_id, conversation_id),
+            )
+            self.stats['appended'] += 1
+
+    # The summary message (if anything is older than the window) followed by the last `window` messages
+    def load(self, session_id, conversation_id, window=None):
+        window = self.window if window is None else window
+        key = (session_id, conversation_id)
+        with self._lock:
+            self.stats['loads'] += 1
+            rows = self._db.execute(
+                'SELECT seq, role, name, content, extra FROM messages WHERE session_id = ? AND conversation_id = ? '
+                'ORDER BY seq DESC LIMIT ?',
+                key + (window,),
+            ).fetchall()
+            if not rows:
+                return []
+            rows.reverse()
+            first_seq = rows[0][0]
+            summary = self._summary(key, first_seq - 1) if first_seq > 1 else None
+
+        messages = [_row_message(*row[1:]) for row in rows]
+        if summary:
+            messages.insert(0, {
+                'role': 'user',
+                'name': 'Summary',
+                'content': f"Summary of the {first_seq - 1} earlier messages of this conversation:\n{summary}",
+            })
+        return messages
+
+    # The summary of messages 1..upto_seq, adding a row for the messages the latest one doesn't cover yet
+    def _summary(self, key, upto_seq):
+        row = self._db.execute(
+            'SELECT upto_seq, content FROM summaries WHERE session_id = ? AND conversation_id = ? AND upto_seq <= ? '
+            'ORDER BY upto_seq DESC LIMIT 1',
+            key + (upto_seq,),
+        ).fetchone()
+        covered, previous = row if row else (0, '')
+        if covered == upto_seq:
+            return previous
+
+        dropped = [
+            _row_message(*r) for r in self._db.execute(
+                'SELECT role, name, content, extra FROM messages '
+                'WHERE session_id = ? AND conversation_id = ? AND seq > ? AND seq <= ? ORDER BY seq',
+                key + (covered, upto_seq),
+            )
+        ]
+        lines = [line for line in (previous + '\n' + self.summarize(dropped)).split('\n') if line.strip()]
+        # the oldest lines go first once the summary is full
+        content = '\n'.join(lines[-self.max_summary_lines:])
+        self._db.execute(
+            'INSERT OR IGNORE INTO summaries (session_id, conversation_id, upto_seq, content, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            key + (upto_seq, content, time.time()),
+        )
+        self.stats['summaries'] += 1
+        return content
+
+    def conversations(self, session_id):
+        with self._lock:
+            return [
+                row[0] for row in self._db.execute(
+                    'SELECT DISTINCT conversation_id FROM messages WHERE session_id = ?', (session_id,),
+                )
+            ]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ConversationLog:
+    def __init__(self, store, session_id, conversation_id):
+        self.store = store
+        self.session_id = session_id
+        self.conversation_id = conversation_id
+
+    # A failing store is logged but never ends the chat
+    def append(self, message):
+        try:
+            self.store.append(self.session_id, self.conversation_id, message)
+        except sqlite3.Error:
+            logging.exception("could not store a message of %s/%s", self.session_id, self.conversation_id)
+
+    def load(self, window=None):
+        return self.store.load(self.session_id, self.conversation_id, window)
+
+
+# Reset `manager`'s group chat to `messages`, as if they had just been said: each agent gets them in its history
+# with the manager (its own as 'assistant', the others' as 'user'). Nothing is recorded again.
+def seed_group_chat(manager, messages):
+    # pyautogen 0.2 keeps the group chat in a private attribute
+    groupchat = manager._groupchat
+    groupchat.reset()
+    manager.clear_history()
+    for agent in groupchat.agents:
+        agent.clear_history(manager)
+    for message in messages:
+        groupchat.messages.append(dict(message))
+        for agent in groupchat.agents:
+            role = 'assistant' if message.get('name') == agent.name else 'user'
+            agent._append_oai_message(dict(message), role, manager)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# One store per file for the whole process, so every Panel session shares the connection
+def get_store(path=None, **kwargs):
+    path = path or os.getenv('CONVERSATION_STORE', DEFAULT_PATH)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ConversationStore(path, **kwargs)
+            atexit.register(_stores[path].close)
+        return _stores[path]
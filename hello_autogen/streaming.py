@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from hello_autogen.clients import get_client_pool
+from hello_autogen.history import count_tokens, message_tokens
+
+# == Token streaming into Panel ===========================================================================
+#
+# autogen's client only returns a reply once the whole completion is done (with `stream: True` it prints the
+# tokens to stdout). `PanelStreamer` is a reply pipeline stage that calls the agent's endpoints itself with
+# `stream=True` and appends each chunk to a Panel chat message as it arrives, so the first tokens show up
+# within a second even on slow local models.
+#
+# Streamed completions bypass autogen's client, so they aren't in the cache_seed disk cache or in autogen's usage
+# summaries. The streamer keeps its own tally per model instead - the usage the endpoint reports at the end of the
+# stream (`stream_options={'include_usage': True}`, for servers that accept it), else token counts estimated
+# like everywhere else - and `cost()` prices it like `router.cost()`. Each streamed call's usage is also left in
+# `call.meta['usage']` for the budget and metrics stages in front of it. Calls that can't be streamed (multimodal
+# content, function/tool calls) and endpoints that fail fall through to the next endpoint and then to the normal,
+# non-streaming path; a stream that breaks off midway leaves its partial message on screen marked as cut off, so
+# the retried reply doesn't read as its continuation. With a MessageBatcher (hello_autogen/ui.py) the messages it
+# still holds are shown before a reply starts streaming.
+
+STREAM_PARAMS = ('temperature', 'max_tokens', 'top_p', 'stop')
+STREAM_OPTIONS = {'include_usage': True}
+INTERRUPTED = "\n\n*(the reply broke off here, retrying)*"
+
+
+def streamable(call):
+    llm_config = call.llm_config
+    if not llm_config.get('config_list') or llm_config.get('functions') or llm_config.get('tools'):
+        return False
+    return all(isinstance(message.get('content'), str) for message in call.messages)
+
+
+class PanelStreamer:
+    def __init__(self, chat_interface, avatar, flush_interval=0.05, remember=32, client_pool=None, batcher=None,
+                 models=None):
+        self.chat_interface = chat_interface
+        self.avatar = avatar
+        self.batcher = batcher
+        # the registry, for its `price_1k` entries
+        self.models = models
+        self.flush_interval = flush_interval
+        # shared with every other session (hello_autogen/clients.py)
+        self.client_pool = client_pool or get_client_pool()
+        # replies already on screen, so `print_messages` doesn't send them a second time
+        self._shown = deque(maxlen=remember)
+        # endpoints that rejected `stream_options`
+        self._no_stream_options = set()
+        # model -> calls and tokens streamed from it
+        self.usage = {}
+        self._lock = threading.Lock()
+
+    def was_shown(self, content):
+        with self._lock:
+            if content in self._shown:
+                self._shown.remove(content)
+                return True
+        return False
+
+    def _stream(self, call, config, messages):
+        llm_config = call.llm_config
+        client = self.client_pool.openai_client(config.get('base_url'), config.get('api_key'),
+                                                llm_config.get('timeout', 600))
+        params = {key: llm_config[key] for key in STREAM_PARAMS if key in llm_config}
+        base_url = config.get('base_url')
+        if base_url not in self._no_stream_options:
+            import openai
+
+            try:
+                return client.chat.completions.create(
+                    model=config['model'], messages=messages, stream=True, stream_options=STREAM_OPTIONS, **params,
+                )
+            except openai.BadRequestError:
+                # older OpenAI-compatible servers; their usage is estimated
+                logging.info("%s doesn't report usage when streaming", base_url or 'OpenAI')
+                with self._lock:
+                    self._no_stream_options.add(base_url)
+        return client.chat.completions.create(model=config['model'], messages=messages, stream=True, **params)
+
+    def __call__(self, call, proceed):
+        # speculative candidates aren't shown: only one of them will be kept
+        if call.meta.get('speculative') or not streamable(call):
+            return proceed(call)
+
+        messages = [{'content': call.agent.system_message, 'role': 'system'}] + call.messages
+        started = time.monotonic()
+        for config in call.llm_config['config_list']:
+            try:
+                chunks = iter(self._stream(call, config, messages))
+                first = next(chunks, None)
+            except Exception as e:
+                logging.warning("streaming from %s failed, trying the next endpoint: %s", config.get('model'), e)
+                continue
+            time_to_first_token = time.monotonic() - started
+            if self.batcher is not None:
+                self.batcher.flush()
+            try:
+                reply, usage = self._render(call.agent.name, first, chunks)
+            except Exception as e:
+                logging.warning("streaming from %s broke off, trying the next endpoint: %s", config.get('model'), e)
+                continue
+            call.meta['time_to_first_token'] = time_to_first_token
+            self._record(call, config['model'], messages, reply, usage)
+            with self._lock:
+                self._shown.append(reply)
+            return reply
+
+        return proceed(call)
+
+    # Show the first chunk straight away, then append the rest to the same chat message at most every
+    # `flush_interval` seconds. Returns the reply and the usage the stream ended with, if any; if the stream
+    # breaks off, the message is finished with what arrived and the INTERRUPTED note before the error is re-raised.
+    def _render(self, name, first, chunks):
+        reply = _delta(first) if first is not None else ''
+        usage = getattr(first, 'usage', None)
+        message = self._flush(name, reply, None)
+        pending = ''
+        last_flush = time.monotonic()
+        try:
+            for chunk in chunks:
+                pending += _delta(chunk)
+                usage = getattr(chunk, 'usage', None) or usage
+                if pending and time.monotonic() - last_flush >= self.flush_interval:
+                    self._flush(name, pending, message)
+                    reply += pending
+                    pending, last_flush = '', time.monotonic()
+        except Exception:
+            self._flush(name, reply + pending + INTERRUPTED, message, replace=True)
+            raise
+        if pending:
+            self._flush(name, pending, message)
+            reply += pending
+        return reply, usage
+
+    def _record(self, call, model, messages, reply, usage):
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens = sum(message_tokens(message) for message in messages)
+            completion_tokens = count_tokens(reply)
+        call.meta['usage'] = {
+            'model': model, 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'estimated': usage is None,
+        }
+        with self._lock:
+            totals = self.usage.setdefault(
+                model, {'calls': 0, 'estimated_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0},
+            )
+            totals['calls'] += 1
+            totals['estimated_calls'] += usage is None
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+
+    # What the streamed calls have cost so far, from the registry's prices or autogen's (local models cost nothing)
+    def cost(self):
+        from hello_autogen.budgets import call_price
+
+        with self._lock:
+            return sum(
+                call_price(
+                    model, totals['prompt_tokens'], totals['completion_tokens'],
+                    self.models.price(model) if self.models is not None else None,
+                )
+                for model, totals in self.usage.items()
+            )
+
+    def _flush(self, name, text, message, replace=False):
+        return self.chat_interface.stream(
+            text, user=name, avatar=self.avatar.get(name), message=message, replace=replace,
+        )
+
+
+def _delta(chunk):
+    if not chunk.choices:
+        return ''
+    return chunk.choices[0].delta.content or ''
@@ -0,0 +1,153 @@
+import logging
+import re
+import threading
+
+# == Early termination ====================================================================================
+#
+# The examples used to end a chat only when a model chose to say the termination keyword, and the termination
+# notice asks the agents to trade "Thank you" / "You're welcome" first - several LLM rounds of pleasantries
+# after the answer was already delivered. `TerminationDetector` is an `is_termination_msg` that runs a list of
+# cheap local rules over each message and ends the chat as soon as one of them fires:
+#
+# - keyword: the message ends with the termination keyword (the old behaviour);
+# - gratitude: a message that is only thanks / "you're welcome" / "glad I could help" - with those phrases and
+#   filler words ("so much for your help") taken out, at most a word is left, so "Thanks, but the code fails on
+#   line 3" carries on;
+# - repetition: the message repeats one of the last few messages;
+# - done: the message says the task is complete ("hope this helps", "let me know if you need anything else")
+#   and has no code block left for the user proxy to run.
+#
+# `execution_succeeded` (code ran with exit code 0) is available but not on by default, since multi-step tasks
+# keep going after running code. A rule is any `rule(text, message, history) -> bool`.
+#
+# Each agent that checks termination needs its own detector (the manager and the user proxy see different
+# messages, and autogen may check the same message twice in one turn). Call `reset()` when a new chat starts.
+
+GRATITUDE = re.compile(
+    r"\b(thanks?|thank you|you'?re (very )?welcome|my pleasure|glad (i could|to) help|happy to help|no problem|"
+    r"anytime|cheers|appreciated?)\b",
+    re.I,
+)
+DONE = re.compile(
+    r"\b((the |this |your )?(task|request|question) (is|has been) (now )?(complete|completed|done|solved|finished)|"
+    r"hope (this|that) helps|let me know if (you need|there is|there's|you have) (anything|any)|"
+    r"feel free to ask|is there anything else)\b",
+    re.I,
+)
+# a whole block, so a closing fence isn't taken for an untagged one
+CODE_BLOCK = re.compile(r"```(\w*)\n.*?```", re.S)
+# what PooledUserProxyAgent (hello_autogen/executors.py) runs
+RUNNABLE_LANGUAGES = {'', 'python', 'py', 'sh', 'bash', 'shell', 'javascript', 'js', 'node'}
+GRATITUDE_FILLER = {
+    'a', 'again', 'all', 'and', 'for', 'great', 'help', 'it', 'lot', 'much', 'ok', 'okay', 'perfect', 'really',
+    'so', 'that', 'the', 'this', 'too', 'very', 'you', 'your',
+}
+GRATITUDE_LEFTOVER_WORDS = 1
+
+
+def _words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def keyword_rule(word):
+    def keyword(text, message, history):
+        return text.rstrip().rstrip('.!').endswith(word)
+    return keyword
+
+
+def gratitude(text, message, history):
+    if '```' in text or GRATITUDE.search(text) is None:
+        return False
+    left = [word for word in _words(GRATITUDE.sub(' ', text)) if word not in GRATITUDE_FILLER]
+    return len(left) <= GRATITUDE_LEFTOVER_WORDS
+
+
+def repetition_rule(window=4, threshold=0.9, min_words=5):
+    def repetition(text, message, history):
+        words = set(_words(text))
+        if len(words) < min_words:
+            return False
+        for previous in history[-window:]:
+            previous_words = set(_words(previous))
+            if previous_words and len(words & previous_words) / len(words | previous_words) >= threshold:
+                return True
+        return False
+    return repetition
+
+
+def done(text, message, history):
+    if DONE.search(text) is None:
+        return False
+    return not any(language.lower() in RUNNABLE_LANGUAGES for language in CODE_BLOCK.findall(text))
+
+
+def execution_succeeded(text, message, history):
+    return text.lstrip().startswith('exitcode: 0 (execution succeeded)')
+
+
+class TerminationDetector:
+    def __init__(self, keyword='TERMINATE', rules=None, boilerplate=(), max_round=None):
+        self.keyword = keyword
+        self.rules = list(rules) if rules is not None else [
+            keyword_rule(keyword), gratitude, repetition_rule(), done,
+        ]
+        self.boilerplate = [b for b in boilerplate if b]
+        # only used to report how many rounds of the budget an early stop left unused
+        self.max_round = max_round
+        self.history = []
+        self.stats = {'checks': 0, 'terminations': {}, 'early': 0, 'rounds_saved': 0}
+        self._last = None
+        self._lock = threading.Lock()
+
+    def add(self, rule):
+        self.rules.append(rule)
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.history = []
+            self._last = None
+
+    def _text(self, message):
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        text = content or ''
+        for boilerplate in self.boilerplate:
+            text = text.replace(boilerplate, '')
+        return text
+
+    # The rule that ends the chat on `message`, or None
+    def check(self, message):
+        text = self._text(message)
+        with self._lock:
+            # the same message checked again in the same turn (e.g. by the sync and async termination replies)
+            if self._last is not None and self._last[0] is message and self._last[1] == text:
+                return self._last[2]
+            history = list(self.history)
+            self.history.append(text)
+
+        reason = None
+        # the first message is the task itself, which only the keyword can end
+        rules = self.rules if history else [keyword_rule(self.keyword)]
+        for rule in rules:
+            if rule(text, message, history):
+                reason = getattr(rule, '__name__', type(rule).__name__)
+                break
+
+        with self._lock:
+            self._last = (message, text, reason)
+            self.stats['checks'] += 1
+            if reason is not None:
+                self.stats['terminations'][reason] = self.stats['terminations'].get(reason, 0) + 1
+                if reason != 'keyword':
+                    self.stats['early'] += 1
+                    if self.max_round is not None:
+                        self.stats['rounds_saved'] += max(0, self.max_round - len(self.history))
+        if reason is not None:
+            logging.debug("ending chat after %d messages: %s", len(history) + 1, reason)
+        return reason
+
+    # Use the detector itself as `is_termination_msg`
+    def __call__(self, message):
+        return self.check(message) is not None
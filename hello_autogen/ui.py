@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import panel
+
+# == Chat UI updates =====================================================================================
+#
+# `print_messages` used to call `chat_interface.send` for every message: one websocket push (and one re-layout
+# of the chat log in the browser) per message, every long code block rendered as Markdown in full, and a chat
+# log that only ever grew. `MessageBatcher` sits between the agents and the chat window instead:
+#
+# - `post()` queues a message and the queue is added to the chat log once per `interval` (a frame), in a
+#   single update, however many agents spoke in between. `flush()` adds it right away, e.g. before a message
+#   that is sent directly (the Accountant's) or streamed (PanelStreamer flushes first), so the order holds.
+# - Messages longer than `collapse_chars` show their first `preview_chars` and a collapsed "Show all" card;
+#   the full Markdown is only rendered when the card is first opened.
+# - At most `max_messages` stay in the chat log. Older ones are dropped from the page (not from the
+#   conversation store) behind a note saying how many.
+
+FRAME_INTERVAL = 0.1
+COLLAPSE_CHARS = 2000
+PREVIEW_CHARS = 600
+MAX_MESSAGES = 200
+
+
+# The head of `content`, cut at a line break where possible, with a code block the cut leaves open closed
+def preview(content, chars=PREVIEW_CHARS):
+    head = content[:chars]
+    cut = head.rfind('\n')
+    if cut > chars // 2:
+        head = head[:cut]
+    if head.count('```') % 2:
+        head += '\n```'
+    return head + '\n\n...'
+
+
+class MessageBatcher:
+    def __init__(self, chat_interface, avatar, interval=FRAME_INTERVAL, collapse_chars=COLLAPSE_CHARS,
+                 preview_chars=PREVIEW_CHARS, max_messages=MAX_MESSAGES):
+        self.chat_interface = chat_interface
+        self.avatar = avatar
+        self.interval = interval
+        self.collapse_chars = collapse_chars
+        self.preview_chars = preview_chars
+        self.max_messages = max_messages
+        self._pending = []
+        self._scheduled = False
+        # the note standing in for the messages dropped from the top of the chat log
+        self._notice = None
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self.stats = {'messages': 0, 'flushes': 0, 'collapsed': 0, 'expanded': 0, 'dropped': 0}
+
+    def post(self, content, user, avatar=None):
+        message = panel.chat.ChatMessage(
+            self._body(content), user=user, avatar=avatar or self.avatar.get(user),
+            **self.chat_interface.message_params,
+        )
+        with self._lock:
+            self._pending.append(message)
+            self.stats['messages'] += 1
+            schedule, self._scheduled = not self._scheduled, True
+        if schedule:
+            try:
+                asyncio.get_running_loop().call_later(self.interval, self.flush)
+            except RuntimeError:
+                # not on the event loop (a sync chat): there is no frame to wait for
+                self.flush()
+        return message
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._scheduled = self._pending, [], False
+            if not pending:
+                return
+            shown = list(self.chat_interface.objects)
+            # the note goes when the chat log is cleared
+            noticed = any(message is self._notice for message in shown)
+            objects = [message for message in shown if message is not self._notice] + pending
+            overflow = len(objects) - self.max_messages
+            if overflow > 0:
+                objects = objects[overflow:]
+                self._dropped = (self._dropped if noticed else 0) + overflow
+                self.stats['dropped'] += overflow
+                text = f"{self._dropped} earlier messages are no longer shown."
+                if self._notice is None:
+                    self._notice = panel.chat.ChatMessage(text, user='System', **self.chat_interface.message_params)
+                else:
+                    self._notice.object = text
+                objects.insert(0, self._notice)
+            elif noticed:
+                objects.insert(0, self._notice)
+            # one change of the chat log, so one push to the browser
+            self.chat_interface.objects = objects
+            self.stats['flushes'] += 1
+
+    def _body(self, content):
+        if not isinstance(content, str) or len(content) <= self.collapse_chars:
+            return content
+        self.stats['collapsed'] += 1
+        head = panel.pane.Markdown(preview(content, self.preview_chars), sizing_mode='stretch_width')
+        full = panel.Card(
+            title=f"Show all ({len(content.splitlines())} lines)", collapsed=True, sizing_mode='stretch_width',
+        )
+
+        def expand(event):
+            if not event.new and not full.objects:
+                full.objects = [panel.pane.Markdown(content, sizing_mode='stretch_width')]
+                head.visible = False
+                self.stats['expanded'] += 1
+
+        full.param.watch(expand, 'collapsed')
+        return panel.Column(head, full, sizing_mode='stretch_width')
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from hello_autogen.admission import (
+    AdmissionController, AdmissionQueueFull, AdmissionTimeout, BackendBusy, BackendLimiter, RateLimited,
+)
+
+
+def test_queues_in_order_and_reports_positions():
+    async def scenario():
+        controller = AdmissionController(max_running=1, max_queue=4, rate=0)
+        order, positions = [], {'second': [], 'third': []}
+        release = asyncio.Event()
+
+        async def chat(user):
+            async with controller.admit(user, positions.get(user, []).append):
+                order.append(user)
+                if user == 'first':
+                    await release.wait()
+
+        tasks = [asyncio.create_task(chat(user)) for user in ('first', 'second', 'third')]
+        await asyncio.sleep(0.01)
+        assert (controller.running, controller.queued) == (1, 2)
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, order, positions
+
+    controller, order, positions = asyncio.run(scenario())
+    assert order == ['first', 'second', 'third']
+    assert positions == {'second': [1], 'third': [2, 1]}
+    assert (controller.running, controller.queued) == (0, 0)
+    assert controller.stats['admitted'] == 3 and controller.stats['queued'] == 2
+
+
+def test_turns_away_when_the_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_running=1, max_queue=1, rate=0)
+        release = asyncio.Event()
+
+        async def chat():
+            async with controller.admit('user'):
+                await release.wait()
+
+        tasks = [asyncio.create_task(chat()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionQueueFull):
+            async with controller.admit('user'):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller
+
+    assert asyncio.run(scenario()).stats['queue_full'] == 1
+
+
+def test_queue_timeout():
+    async def scenario():
+        controller = AdmissionController(max_running=1, queue_timeout=0.01, rate=0)
+        release = asyncio.Event()
+
+        async def chat():
+            async with controller.admit('first'):
+                await release.wait()
+
+        task = asyncio.create_task(chat())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionTimeout):
+            async with controller.admit('second'):
+                pass
+        assert controller.queued == 0
+        release.set()
+        await task
+
+    asyncio.run(scenario())
+
+
+def test_rate_limits_each_user():
+    async def scenario():
+        controller = AdmissionController(rate=1, per=60, burst=2)
+        for _ in range(2):
+            async with controller.admit('alice'):
+                pass
+        with pytest.raises(RateLimited) as rejected:
+            async with controller.admit('alice'):
+                pass
+        # other users have their own bucket
+        async with controller.admit('bob'):
+            pass
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert 0 < rejected.retry_after <= 60
+
+
+def test_backend_limiter_caps_calls_in_flight():
+    models = SimpleNamespace(models={'mistral': {'max_concurrency': 1}})
+    limiter = BackendLimiter(models, timeout=0.01)
+    call = SimpleNamespace(model='mistral')
+    inside, release = threading.Event(), threading.Event()
+
+    def slow(call):
+        inside.set()
+        release.wait()
+        return "reply"
+
+    thread = threading.Thread(target=limiter, args=(call, slow))
+    thread.start()
+    inside.wait()
+    assert limiter.in_flight() == {'mistral': 1}
+    with pytest.raises(BackendBusy):
+        limiter(call, lambda call: "reply")
+    release.set()
+    thread.join()
+
+    assert limiter(call, lambda call: "reply") == "reply"
+    assert limiter.stats['busy'] == 1
+    # models without a limit aren't held up
+    assert limiter(SimpleNamespace(model='oai-gpt4'), lambda call: "reply") == "reply"
+
+
+def test_backend_limits_are_shared_between_workers():
+    models = SimpleNamespace(models={'mistral': {'max_concurrency': 8}, 'codellama': {'max_concurrency': 2}})
+    limiter = BackendLimiter(models, workers=4)
+
+    assert (limiter.limit('mistral'), limiter.limit('codellama')) == (2, 1)
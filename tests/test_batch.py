@@ -0,0 +1,105 @@
+import json
+import sys
+import threading
+
+import pytest
+
+from hello_autogen import batch
+from hello_autogen.batch import ResultWriter, completed_ids, read_tasks, run_batch
+
+
+def write_lines(path, lines):
+    path.write_text(''.join(line + '\n' for line in lines))
+    return str(path)
+
+
+def test_reads_json_and_plain_text_tasks(tmp_path):
+    path = write_lines(tmp_path / 'tasks.jsonl', [
+        json.dumps({'id': 'q1', 'task': "Tell me a joke."}),
+        '',
+        "Write a haiku",
+        json.dumps({'task': "Compare two sorts", 'flow': 'fan-out'}),
+    ])
+
+    assert read_tasks(path, 'two-agent') == [
+        {'id': 'q1', 'task': "Tell me a joke.", 'flow': 'two-agent'},
+        {'id': 3, 'task': "Write a haiku", 'flow': 'two-agent'},
+        {'id': 4, 'task': "Compare two sorts", 'flow': 'fan-out'},
+    ]
+
+
+@pytest.mark.parametrize('line', [json.dumps({'id': 1}), json.dumps({'task': "x", 'flow': 'chatbot'})])
+def test_rejects_tasks_it_cannot_run(tmp_path, line):
+    with pytest.raises(ValueError):
+        read_tasks(write_lines(tmp_path / 'tasks.jsonl', [line]), 'two-agent')
+
+
+def test_resumes_after_the_tasks_that_succeeded(tmp_path):
+    results = tmp_path / 'results.jsonl'
+    write_lines(results, [
+        json.dumps({'id': 'q1', 'status': 'ok'}),
+        json.dumps({'id': 2, 'status': 'error'}),
+    ])
+    # a run that crashed mid-write
+    with open(results, 'a') as f:
+        f.write('{"id": "q3", "sta')
+
+    assert completed_ids(str(results)) == {'q1'}
+    assert completed_ids(str(tmp_path / 'missing.jsonl')) == set()
+
+    writer = ResultWriter(str(results))
+    writer.write({'id': 'q3', 'status': 'ok'})
+    writer.close()
+    assert completed_ids(str(results)) == {'q1', 'q3'}
+
+
+class FakeRunner:
+    def __init__(self, writer, silent=True):
+        self.writer = writer
+        self.ran = []
+        self.stats = {'ok': 0, 'error': 0, 'cost': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def run(self, entry):
+        self.ran.append(entry['id'])
+        record = {'id': entry['id'], 'status': 'ok', 'elapsed': 0.0}
+        self.writer.write(record)
+        self.stats['ok'] += 1
+        return record
+
+
+def test_main_skips_the_ids_already_done(tmp_path, monkeypatch):
+    tasks = write_lines(tmp_path / 'tasks.jsonl', ["one", "two", "three"])
+    results = write_lines(tmp_path / 'results.jsonl', [
+        json.dumps({'id': 1, 'status': 'ok'}), json.dumps({'id': 2, 'status': 'error'}),
+    ])
+    runner = FakeRunner(None)
+
+    def make_runner(writer, silent=True):
+        runner.writer = writer
+        return runner
+
+    monkeypatch.setattr(batch, 'BatchRunner', make_runner)
+    monkeypatch.setattr(batch, 'load_example', lambda name: None)
+    monkeypatch.setattr(batch.signal, 'signal', lambda signum, handler: None)
+    monkeypatch.setattr(sys, 'argv', ['batch', tasks, results])
+
+    with pytest.raises(SystemExit) as exit:
+        batch.main()
+
+    assert exit.value.code == 0
+    assert sorted(runner.ran) == [2, 3]
+    assert completed_ids(results) == {'1', '2', '3'}
+
+
+def test_stops_taking_tasks_when_asked(tmp_path):
+    writer = ResultWriter(str(tmp_path / 'results.jsonl'))
+    runner = FakeRunner(writer)
+    stop = threading.Event()
+    stop.set()
+
+    run_batch([{'id': index} for index in range(5)], runner, concurrency=2, stop=stop)
+    assert runner.ran == []
+
+    run_batch([{'id': index} for index in range(5)], runner, concurrency=2, stop=threading.Event())
+    writer.close()
+    assert sorted(runner.ran) == [0, 1, 2, 3, 4]
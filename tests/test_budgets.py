@@ -0,0 +1,103 @@
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from hello_autogen.budgets import BudgetExceeded, ChatBudget, call_price
+from hello_autogen.images import image_tokens
+from hello_autogen.models import ModelRegistry
+
+
+def jpeg_data_uri(width, height):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height)).save(output, format='JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+def make_call(name, model, content, llm_model):
+    llm_config = {'config_list': [{'model': llm_model}]}
+    agent = SimpleNamespace(name=name, system_message="You help.", llm_config=llm_config)
+    return SimpleNamespace(
+        agent=agent, model=model, llm_config=llm_config, meta={}, messages=[{'role': 'user', 'content': content}],
+    )
+
+
+def picture(width=1024, height=1024, detail='auto'):
+    return [
+        {'type': 'text', 'text': "What is in this picture?"},
+        {'type': 'image_url', 'image_url': {'url': jpeg_data_uri(width, height), 'detail': detail}},
+    ]
+
+
+def test_prices_models_missing_from_autogens_table():
+    models = ModelRegistry(client_pool=None)
+
+    assert call_price('gpt-4-vision-preview', 1000, 1000) == 0.0
+    assert call_price('gpt-4-vision-preview', 1000, 1000, models.price('oai-gpt4-vision')) == pytest.approx(0.04)
+    assert models.price('gpt-4-vision-preview') == models.price('oai-gpt4-vision')
+    assert models.price('mistral') is None
+
+
+def test_image_tokens_follow_the_scaled_size():
+    # 768x768 once scaled: 2x2 tiles
+    assert image_tokens({'url': jpeg_data_uri(1024, 1024)}) == 85 + 170 * 4
+    # 2048x768 once scaled: 4x2 tiles
+    assert image_tokens({'url': jpeg_data_uri(4096, 1536)}) == 85 + 170 * 8
+    assert image_tokens({'url': jpeg_data_uri(300, 200)}) == 85 + 170
+    assert image_tokens({'url': jpeg_data_uri(1024, 1024), 'detail': 'low'}) == 85
+    assert image_tokens({'url': 'https://example.com/photo.jpg'}) == 85 + 170 * 8
+
+
+def test_vision_calls_count_towards_the_budget():
+    budget = ChatBudget(
+        ModelRegistry(client_pool=None), agents={'ImageExplainer': {'dollars': 0.01}}, check_health=False,
+    )
+    call = make_call('ImageExplainer', 'oai-gpt4-vision', picture(), 'gpt-4-vision-preview')
+
+    budget(call, lambda call: "A cat.")
+    usage = budget.usage('ImageExplainer')
+    assert usage['tokens'] > 765
+    assert usage['dollars'] > 0.00765
+
+    budget(make_call('ImageExplainer', 'oai-gpt4-vision', picture(), 'gpt-4-vision-preview'), lambda call: "A cat.")
+    with pytest.raises(BudgetExceeded) as exceeded:
+        budget(make_call('ImageExplainer', 'oai-gpt4-vision', picture(), 'gpt-4-vision-preview'), lambda call: "")
+    assert (exceeded.value.scope, exceeded.value.limit) == ('ImageExplainer', 'dollars')
+
+
+def test_downgrades_before_cutting_off():
+    models = ModelRegistry(client_pool=None)
+    budget = ChatBudget(models, check_health=False)
+    served = []
+
+    def proceed(call):
+        served.append(call.model)
+        return "A short poem."
+
+    def writer_call():
+        return make_call('Writer', 'oai-gpt4', "Write a poem", 'gpt-4-turbo-preview')
+
+    budget(writer_call(), proceed)
+    # the first call used 90% of the tokens: the next one goes to the fallback, the one after that is stopped
+    budget.session = {'tokens': budget.usage()['tokens'] / 0.9}
+    budget(writer_call(), proceed)
+    with pytest.raises(BudgetExceeded):
+        budget(writer_call(), proceed)
+    assert served == ['oai-gpt4', 'mistral']
+    assert (budget.stats['downgraded'], budget.stats['cut_off']) == (1, 1)
+
+    budget.start()
+    assert budget.usage()['tokens'] == 0
+
+
+def test_cache_hits_are_free():
+    budget = ChatBudget(ModelRegistry(client_pool=None), check_health=False)
+
+    def hit(call):
+        call.meta['cache'] = 'hit'
+        return "cached"
+
+    budget(make_call('Writer', 'oai-gpt4', "Write a poem", 'gpt-4-turbo-preview'), hit)
+    assert budget.usage()['tokens'] == 0
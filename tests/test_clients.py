@@ -0,0 +1,79 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from hello_autogen.clients import MicroBatcher
+
+MODELS = SimpleNamespace(models={'mistral': {'max_batch': 4}, 'oai-gpt4': {}})
+
+
+def make_call(content, model='mistral', temperature=0):
+    agent = SimpleNamespace(name="Writer", system_message="You write.")
+    return SimpleNamespace(
+        agent=agent, model=model, llm_config={'temperature': temperature},
+        messages=[{'role': 'user', 'content': content}],
+    )
+
+
+def run_together(batcher, calls, proceed):
+    replies = [None] * len(calls)
+
+    def run(index):
+        replies[index] = batcher(calls[index], proceed)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return replies
+
+
+def counting_proceed():
+    sent = []
+    lock = threading.Lock()
+
+    def proceed(call):
+        with lock:
+            sent.append((call.messages[-1]['content'], time.monotonic()))
+        return f"reply to {call.messages[-1]['content']}"
+    return proceed, sent
+
+
+def test_coalesces_identical_requests_in_a_batch():
+    batcher = MicroBatcher(MODELS, window=0.2)
+    proceed, sent = counting_proceed()
+    calls = [make_call("Tell me a joke"), make_call("Tell me a joke"), make_call("Write a haiku")]
+
+    replies = run_together(batcher, calls, proceed)
+
+    assert replies == ["reply to Tell me a joke", "reply to Tell me a joke", "reply to Write a haiku"]
+    assert sorted(content for content, _ in sent) == ["Tell me a joke", "Write a haiku"]
+    assert batcher.stats['coalesced'] == 1
+    assert batcher.stats['batches'] == 1
+    assert batcher.stats['largest_batch'] == 2
+
+
+def test_releases_a_full_batch_without_waiting_out_the_window():
+    batcher = MicroBatcher(MODELS, window=5)
+    proceed, sent = counting_proceed()
+    calls = [make_call(f"question {index}") for index in range(4)]
+
+    started = time.monotonic()
+    run_together(batcher, calls, proceed)
+
+    assert time.monotonic() - started < 1
+    assert len(sent) == 4
+    assert batcher.stats['batches'] == 1
+
+
+def test_sampled_requests_and_unbatched_models_are_not_shared():
+    batcher = MicroBatcher(MODELS, window=0.05)
+    proceed, sent = counting_proceed()
+
+    run_together(batcher, [make_call("Tell me a joke", temperature=0.7) for _ in range(2)], proceed)
+    assert len(sent) == 2
+
+    started = time.monotonic()
+    assert batcher(make_call("Tell me a joke", model='oai-gpt4'), proceed) == "reply to Tell me a joke"
+    assert time.monotonic() - started < 0.05
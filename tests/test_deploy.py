@@ -0,0 +1,98 @@
+import pytest
+
+from hello_autogen import deploy
+
+
+def test_workers_follow_the_balancer_port(monkeypatch):
+    built = {}
+
+    def build_workers(script, port, workers, base_port, origins):
+        built.update(port=port, workers=workers, base_port=base_port)
+        return []
+
+    monkeypatch.setattr(deploy, 'build_workers', build_workers)
+    monkeypatch.setattr(deploy, 'serve', lambda workers, address, port: None)
+    monkeypatch.setattr(deploy.asyncio, 'run', lambda coroutine: None)
+
+    deploy.main(['app.py', '--port', '5007', '--workers', '4'])
+
+    assert built == {'port': 5007, 'workers': 4, 'base_port': 5008}
+
+
+@pytest.mark.parametrize('argv', [
+    ['app.py', '--port', '65530', '--workers', '8'],
+    ['app.py', '--port', '5007', '--base-port', '65535', '--workers', '2'],
+    ['app.py', '--port', '5007', '--base-port', '5005', '--workers', '4'],
+])
+def test_rejects_unusable_worker_ports(argv, capsys):
+    with pytest.raises(SystemExit):
+        deploy.main(argv)
+
+    assert 'port' in capsys.readouterr().err
+
+
+def test_worker_env_gives_each_worker_its_own_log(monkeypatch, tmp_path):
+    monkeypatch.delenv('LOG_FILE', raising=False)
+    monkeypatch.delenv('METRICS_PROMETHEUS', raising=False)
+
+    envs = [deploy.worker_env(index, 2, str(tmp_path)) for index in range(2)]
+
+    assert [env['LOG_FILE'] for env in envs] == [
+        str(tmp_path / 'debug.worker0.log'), str(tmp_path / 'debug.worker1.log'),
+    ]
+    assert [env['PANEL_WORKER'] for env in envs] == ['0', '1']
+    assert envs[0]['CONVERSATION_STORE'] == envs[1]['CONVERSATION_STORE']
+
+
+class FakeWorker:
+    def __init__(self, index, connections=0, available=True):
+        self.index = index
+        self.connections = connections
+        self.available = available
+
+
+def head(target='/', cookie=None):
+    lines = [f"GET {target} HTTP/1.1", "Host: localhost:5007"]
+    if cookie is not None:
+        lines.append(f"Cookie: theme=dark; {deploy.COOKIE}={cookie}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def test_new_browsers_go_to_the_least_busy_worker():
+    workers = [FakeWorker(0, connections=3), FakeWorker(1, connections=1), FakeWorker(2, connections=2)]
+
+    assert deploy.StickyBalancer(workers).pick(head()) == (workers[1], True)
+
+
+def test_the_cookie_pins_a_browser_to_its_worker():
+    workers = [FakeWorker(0, connections=3), FakeWorker(1)]
+    balancer = deploy.StickyBalancer(workers)
+
+    assert balancer.pick(head(cookie=0)) == (workers[0], False)
+
+    workers[0].available = False
+    assert balancer.pick(head(cookie=0)) == (workers[1], True)
+    assert balancer.stats['failovers'] == 1
+
+
+def test_session_urls_hash_to_the_same_worker():
+    workers = [FakeWorker(index) for index in range(4)]
+    balancer = deploy.StickyBalancer(workers)
+
+    picked = {balancer.pick(head('/app?session=abc123'))[0] for _ in range(5)}
+    assert len(picked) == 1
+    spread = {balancer.pick(head(f'/app?session=user{n}'))[0].index for n in range(40)}
+    assert len(spread) > 1
+
+
+def test_no_worker_available():
+    assert deploy.StickyBalancer([FakeWorker(0, available=False)]).pick(head()) == (None, False)
+
+
+def test_adds_the_cookie_to_the_response_head():
+    response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n"
+
+    assert deploy._with_cookie(response, 2) == (
+        b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n"
+        b"Set-Cookie: hello_autogen_worker=2; Path=/; HttpOnly; SameSite=Lax\r\n\r\n"
+    )
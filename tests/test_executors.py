@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+import pytest
+
+from hello_autogen.executors import ExecutorPool, ExecutorQueueFull
+
+# the workers' limits and process groups are POSIX only
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason="POSIX only")
+
+
+@pytest.fixture
+def pool():
+    pool = ExecutorPool(warm=1, max_concurrency=2, timeout=5, cpu_seconds=5, memory_mb=256,
+                        languages=('python', 'sh'))
+    yield pool
+    pool.close()
+
+
+def test_returns_stdout_on_success(pool):
+    assert pool.run('python', "print('hello')") == (0, "hello\n")
+    assert pool.run('bash', "echo from sh") == (0, "from sh\n")
+
+
+def test_returns_the_exit_code_and_stderr_on_failure(pool):
+    assert pool.run('python', "import sys; sys.exit(3)") == (3, "")
+    exitcode, logs = pool.run('python', "raise ValueError('bad input')")
+    assert exitcode == 1
+    assert "ValueError: bad input" in logs
+    assert pool.run('cobol', "DISPLAY 'HI'") == (1, "unknown language cobol")
+
+
+def test_kills_blocks_that_run_too_long(pool):
+    assert pool.run('python', "import time; time.sleep(30)", timeout=0.5) == (1, "Timeout")
+    assert pool.stats['timeouts'] == 1
+
+
+def test_blocks_run_with_limits_in_their_own_session(pool):
+    code = (
+        "import os, resource\n"
+        "print(os.getsid(0) == os.getpid(), resource.getrlimit(resource.RLIMIT_CPU)[0])\n"
+    )
+    assert pool.run('python', code) == (0, "True 5\n")
+    exitcode, logs = pool.run('python', "data = bytearray(512 * 2 ** 20)")
+    assert exitcode == 1
+    assert "MemoryError" in logs
+
+
+def test_blocks_dont_see_the_apps_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv('OPEN_AI_API_KEY', 'sk-secret')
+    pool = ExecutorPool(warm=1, languages=('python', 'sh'), base_dir=str(tmp_path), env={'MPLBACKEND': 'Agg'})
+    try:
+        code = (
+            "import os\n"
+            "print(os.environ.get('OPEN_AI_API_KEY'), os.environ['MPLBACKEND'], os.environ['HOME'] == os.getcwd())\n"
+        )
+        assert pool.run('python', code) == (0, "None Agg True\n")
+        assert pool.run('sh', "echo \"[$OPEN_AI_API_KEY]\"") == (0, "[]\n")
+    finally:
+        pool.close()
+
+
+def test_copies_the_files_a_block_writes(pool, tmp_path):
+    code = "open('result.txt', 'w').write('42')"
+
+    assert pool.run('python', code, results_dir=str(tmp_path))[0] == 0
+    assert (tmp_path / 'result.txt').read_text() == '42'
+    assert not os.path.exists(os.path.join(os.getcwd(), 'result.txt'))
+
+
+def test_rejects_blocks_when_the_queue_wait_runs_out():
+    pool = ExecutorPool(warm=0, max_concurrency=1, queue_timeout=0.1, languages=('python',))
+    try:
+        thread = threading.Thread(target=pool.run, args=('python', "import time; time.sleep(1)"))
+        thread.start()
+        while pool.stats['runs'] == 0:
+            time.sleep(0.01)
+        with pytest.raises(ExecutorQueueFull):
+            pool.run('python', "print('late')")
+        thread.join()
+        assert pool.stats['rejected'] == 1
+    finally:
+        pool.close()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import autogen
+
+from hello_autogen.fanout import FanOutManager, FanOutResult, merge_replies
+
+TASK = [{'role': 'user', 'content': "Reverse a string"}]
+
+
+def agent(name, reply, delay=0.0):
+    agent = autogen.ConversableAgent(name, llm_config=False, human_input_mode='NEVER')
+
+    def answer(recipient, messages=None, sender=None, config=None):
+        time.sleep(delay)
+        return True, reply
+
+    async def a_answer(recipient, messages=None, sender=None, config=None):
+        await asyncio.sleep(delay)
+        return True, reply
+
+    agent.register_reply([autogen.Agent, None], answer)
+    agent.register_reply([autogen.Agent, None], a_answer, ignore_async_in_sync_chat=True)
+    return agent
+
+
+def test_sync_round_stops_waiting_at_the_timeout():
+    manager = FanOutManager(
+        [agent('python', "s[::-1]"), agent('javascript', "too late", delay=1.0)], timeouts={'javascript': 0.2},
+    )
+
+    for _ in range(2):
+        started = time.monotonic()
+        results = manager.fan_out(TASK)
+        # the thread stuck on the first round doesn't hold up the second
+        assert time.monotonic() - started < 0.8
+        assert [result.ok for result in results] == [True, False]
+        assert results[1].error == 'timed out'
+
+    assert manager.stats['rounds'] == 2 and manager.stats['timeouts'] == 2
+
+
+def test_async_round_stops_waiting_at_the_timeout():
+    manager = FanOutManager(
+        [agent('python', "s[::-1]"), agent('javascript', "too late", delay=1.0)], timeouts={'javascript': 0.2},
+    )
+
+    started = time.monotonic()
+    results = asyncio.run(manager.a_fan_out(TASK))
+
+    assert time.monotonic() - started < 0.8
+    assert results[0].reply == "s[::-1]"
+    assert results[1].error == 'timed out'
+
+
+def test_merge_keeps_the_answers_that_came_back():
+    python, javascript = agent('python', None), agent('javascript', None)
+
+    merged = merge_replies("task", [
+        FanOutResult(python, "s[::-1]"), FanOutResult(javascript, error='timed out'),
+    ])
+    assert merged == "### python\n\ns[::-1]"
+    assert merge_replies("task", [FanOutResult(javascript, error='timed out')]) == (
+        "None of the agents could answer: javascript (timed out)"
+    )
+
+
+def test_run_fan_out_replies_with_the_merged_answers():
+    manager = FanOutManager([agent('python', "s[::-1]"), agent('javascript', {'content': "[...s].reverse()"})])
+
+    assert manager.run_fan_out(messages=TASK) == (
+        True, "### python\n\ns[::-1]\n\n### javascript\n\n[...s].reverse()",
+    )
+    assert manager.run_fan_out(messages=[{'role': 'user', 'content': "TERMINATE"}]) == (True, None)
@@ -0,0 +1,44 @@
+import pytest
+import tiktoken
+
+from hello_autogen import history
+from hello_autogen.history import count_tokens
+
+
+@pytest.fixture
+def fresh_encodings():
+    history._count_tokens.cache_clear()
+    history._encodings.clear()
+    yield
+    history._count_tokens.cache_clear()
+    history._encodings.clear()
+
+
+class WordEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+def test_counts_with_the_model_encoding(fresh_encodings, monkeypatch):
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', lambda model: WordEncoding())
+
+    assert count_tokens("three short words") == 3
+
+
+def test_estimates_when_the_encoding_cannot_load(fresh_encodings, monkeypatch):
+    loads = []
+
+    def unavailable(name):
+        loads.append(name)
+        raise OSError("could not download the encoding")
+
+    def unknown_model(model):
+        raise KeyError(model)
+
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', unknown_model)
+    monkeypatch.setattr(tiktoken, 'get_encoding', unavailable)
+
+    assert count_tokens("x" * 40, model='some-local-model') == 11
+    assert count_tokens("y" * 7, model='some-local-model') == 2
+    # the failed load is remembered rather than retried for every text
+    assert loads == ['cl100k_base']
@@ -0,0 +1,82 @@
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from hello_autogen.images import ImageCache
+
+
+def picture(path, size, color=(200, 80, 40)):
+    Image.new('RGB', size, color).save(path, format='PNG')
+    return str(path)
+
+
+def size_of(path):
+    with Image.open(path) as image:
+        return image.size
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(directory=str(tmp_path / 'cache'))
+
+
+def test_downscales_to_what_the_model_sees(cache, tmp_path):
+    # longest side to 2048, then shortest side to at most 768
+    assert size_of(cache.path(picture(tmp_path / 'wide.png', (3000, 1000)))) == (2048, 683)
+    assert size_of(cache.path(picture(tmp_path / 'square.png', (1600, 1600)))) == (768, 768)
+    # never upscaled
+    assert size_of(cache.path(picture(tmp_path / 'small.png', (300, 200)))) == (300, 200)
+
+
+def test_fetches_each_image_once(cache, tmp_path):
+    source = picture(tmp_path / 'lunch.png', (1200, 900))
+
+    path = cache.path(source)
+    assert cache.path(f"file://{source}") == path
+    first = cache.data_uri(source)
+    assert cache.data_uri(source) == first and first.startswith('data:image/jpeg;base64,')
+    assert cache.stats['fetches'] == 1 and cache.stats['disk_hits'] == 3 and cache.stats['memory_hits'] == 1
+
+    # the same picture from another source is stored once
+    assert cache.path(picture(tmp_path / 'copy.png', (1200, 900))) == path
+    assert len([name for name in os.listdir(cache.directory) if name.endswith('.jpg')]) == 1
+
+    # a new process finds it on disk
+    again = ImageCache(directory=cache.directory)
+    assert again.path(source) == path and again.stats['fetches'] == 0
+
+
+def test_an_edited_file_is_fetched_again(cache, tmp_path):
+    source = picture(tmp_path / 'lunch.png', (100, 100))
+    before = cache.path(source)
+    picture(tmp_path / 'lunch.png', (100, 50), color=(0, 0, 255))
+
+    assert cache.path(source) != before
+    assert size_of(cache.path(source)) == (100, 50)
+
+
+def test_formats_img_tags_from_the_cache(cache, tmp_path):
+    source = picture(tmp_path / 'lunch.png', (100, 100))
+    prompt = f"What is this? <img {source}> And <img {tmp_path / 'missing.png'}>"
+
+    text, image, rest = cache.gpt4v_formatter(prompt, detail='low')
+    assert text == {'type': 'text', 'text': "What is this? "}
+    assert image['image_url']['detail'] == 'low'
+    assert Image.open(io.BytesIO(base64.b64decode(image['image_url']['url'].split(',', 1)[1]))).size == (100, 100)
+    # an image that can't be loaded is left out, its tag stays in the text
+    assert rest['text'].startswith(" And <img ")
+
+    assert cache.rewrite(f"<img {source}>") == f"<img {cache.path(source)}>"
+
+
+def test_evicts_the_least_recently_used_files_past_the_disk_limit(cache, tmp_path):
+    first = cache.path(picture(tmp_path / 'a.png', (64, 64), color=(255, 0, 0)))
+    os.utime(first, (0, 0))
+    # room for about one file
+    cache.max_disk_bytes = os.path.getsize(first) * 3 // 2
+    second = cache.path(picture(tmp_path / 'b.png', (64, 64), color=(0, 255, 0)))
+
+    assert not os.path.exists(first) and os.path.exists(second)
@@ -0,0 +1,68 @@
+import logging
+import queue
+
+from hello_autogen.logging_setup import (
+    BatchedRotatingFileHandler, BatchingListener, DeferredQueueHandler, lazy, pretty,
+)
+
+
+def record(message, level=logging.INFO, args=()):
+    return logging.makeLogRecord({
+        'msg': message, 'args': args, 'levelno': level, 'levelname': logging.getLevelName(level),
+    })
+
+
+def test_rotates_by_size_within_a_batch(tmp_path):
+    path = tmp_path / 'debug.log'
+    handler = BatchedRotatingFileHandler(str(path), maxBytes=100, backupCount=2, encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    handler.emit_batch([record(f"line {index} " + 'x' * 30) for index in range(8)])
+    handler.close()
+
+    files = [path, tmp_path / 'debug.log.1', tmp_path / 'debug.log.2']
+    assert [p.exists() for p in files] == [True, True, True]
+    assert not (tmp_path / 'debug.log.3').exists()
+    assert all(0 < p.stat().st_size < 100 for p in files)
+    # the newest records are in the current file, the oldest ones rotated out past backupCount
+    assert path.read_text().startswith('line 6')
+    assert 'line 1' not in ''.join(p.read_text() for p in files)
+
+
+def test_listener_writes_queued_records_and_renders_lazily(tmp_path):
+    path = tmp_path / 'debug.log'
+    handler = BatchedRotatingFileHandler(str(path), encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    handler.setLevel(logging.INFO)
+    rendered = []
+    records = queue.Queue()
+    listener = BatchingListener(records, [handler])
+
+    records.put(record("reply: %s", args=(pretty({'content': 'x' * 50}, max_chars=20),)))
+    records.put(record("skipped: %s", logging.DEBUG, (lazy(rendered.append, 'debug'),)))
+    listener.start()
+    listener.stop()
+
+    assert path.read_text() == "INFO reply: {'content': 'xxxxxxx... [45 more characters]\n"
+    # filtered out before formatting, so never rendered
+    assert rendered == []
+
+
+def test_a_full_queue_drops_records_and_reports_it(tmp_path):
+    path = tmp_path / 'debug.log'
+    handler = BatchedRotatingFileHandler(str(path), encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    records = queue.Queue(maxsize=1)
+    queue_handler = DeferredQueueHandler(records)
+
+    for index in range(3):
+        queue_handler.handle(record(f"record {index}"))
+    assert queue_handler.dropped == 2
+
+    listener = BatchingListener(records, [handler], queue_handler=queue_handler)
+    listener.start()
+    listener.stop()
+
+    assert path.read_text().splitlines() == [
+        "INFO record 0", "WARNING logging queue full, dropped 2 records",
+    ]
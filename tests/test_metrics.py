@@ -0,0 +1,84 @@
+import json
+
+import autogen
+import pytest
+
+from hello_autogen.metrics import CallMetrics
+from hello_autogen.pipeline import LLMCall
+
+
+def make_call(name="Writer", model='mistral'):
+    agent = autogen.ConversableAgent(name, system_message="You write.", llm_config=False, human_input_mode='NEVER')
+    return LLMCall(agent, [{'role': 'user', 'content': "Write a haiku about the sea"}], None, model)
+
+
+def test_records_each_reply_with_its_tokens(tmp_path):
+    path = tmp_path / 'calls.jsonl'
+    metrics = CallMetrics(jsonl_path=str(path))
+    session = metrics.for_session('s1')
+
+    assert session(make_call(), lambda call: "Waves fold into foam") == "Waves fold into foam"
+
+    record, = metrics.records
+    assert record['session'] == 's1' and record['agent'] == 'Writer' and record['model'] == 'mistral'
+    assert record['round'] == 1 and record['cache'] is None and record['error'] is None
+    assert record['prompt_tokens'] > 0 and record['completion_tokens'] > 0
+    assert json.loads(path.read_text()) == record
+
+
+def test_cache_hits_send_no_prompt_tokens():
+    metrics = CallMetrics()
+
+    def cached(call):
+        call.meta['cache'] = 'hit'
+        return "Waves fold into foam"
+
+    metrics(make_call(), cached)
+
+    assert metrics.records[0]['prompt_tokens'] == 0
+    assert metrics.totals[('Writer', 'mistral')]['cache_hits'] == 1
+
+
+def test_records_errors_and_reraises():
+    metrics = CallMetrics()
+
+    def failing(call):
+        raise TimeoutError("timed out")
+
+    with pytest.raises(TimeoutError):
+        metrics(make_call(), failing)
+    with metrics.measure('chat_manager', 'mistral', [{'role': 'user', 'content': "Who's next?"}], kind='speaker'):
+        pass
+
+    assert metrics.records[0]['error'] == "TimeoutError: timed out"
+    assert metrics.records[1]['kind'] == 'speaker' and metrics.records[1]['prompt_tokens'] > 0
+    assert metrics.totals[('Writer', 'mistral')]['errors'] == 1
+
+
+def test_summary_is_per_session_and_slowest_first():
+    metrics = CallMetrics()
+    metrics.record(session='s1', agent='Writer', model='mistral', wall_time=1.0)
+    metrics.record(session='s1', agent='Critic', model='oai-gpt4', wall_time=3.0)
+    metrics.record(session='s2', agent='Writer', model='mistral', wall_time=5.0)
+
+    rows = metrics.summary(session='s1')
+    assert [(row['agent'], row['share']) for row in rows] == [('Critic', 0.75), ('Writer', 0.25)]
+    assert metrics.summary()[0]['wall_time'] == 6.0
+    assert '| Critic | oai-gpt4 | 1 |' in metrics.markdown(session='s1')
+    assert CallMetrics().markdown() == 'No LLM calls yet.'
+
+
+def test_exports_totals_in_the_prometheus_format(tmp_path):
+    metrics = CallMetrics()
+    metrics.record(agent='Writer "2"', model='mistral', wall_time=1.5, prompt_tokens=10)
+    metrics.record(agent='Writer "2"', model='mistral', wall_time=0.5, cache='hit')
+
+    text = metrics.prometheus()
+    assert '# TYPE hello_autogen_llm_calls_total counter' in text
+    assert 'hello_autogen_llm_calls_total{agent="Writer \\"2\\"",model="mistral"} 2' in text
+    assert 'hello_autogen_llm_wall_seconds_total{agent="Writer \\"2\\"",model="mistral"} 2.0' in text
+    assert 'hello_autogen_llm_cache_hits_total{agent="Writer \\"2\\"",model="mistral"} 1' in text
+
+    path = tmp_path / 'llm.prom'
+    metrics.write_prometheus(str(path))
+    assert path.read_text() == text
@@ -0,0 +1,91 @@
+import pytest
+
+from hello_autogen import models
+from hello_autogen.models import EndpointHealth, ModelRegistry
+
+
+def local(port):
+    url = f"http://localhost:{port}"
+    return {
+        'llm_config': {'base_url': url, 'model': f"model-{port}", 'api_key': 'NULL'},
+        'cache_seed': port, 'health_urls': [url + '/models'],
+    }
+
+
+LOCAL_MODELS = {'first': local(1), 'slow': local(2), 'down': local(3), 'fast': local(4)}
+
+
+@pytest.fixture(autouse=True)
+def fresh_health(monkeypatch):
+    monkeypatch.delenv('MODEL_BASE_URL', raising=False)
+    models.reset_health()
+    yield
+    models.reset_health()
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    latencies = {'1': 0.5, '2': 0.3, '3': None, '4': 0.1}
+    probed = []
+
+    def probe(url, headers=None, timeout=None):
+        probed.append(url)
+        latency = latencies[url.split(':')[-1].split('/')[0]]
+        if latency is None:
+            return EndpointHealth(False, 2.0, 0.0, error='connection refused')
+        return EndpointHealth(True, latency, 0.0)
+
+    monkeypatch.setattr(models, 'probe', probe)
+    return probed
+
+
+def test_ranks_healthy_fallbacks_fastest_first(probes):
+    registry = ModelRegistry(LOCAL_MODELS)
+
+    # the preferred model keeps its place, the unhealthy one is dropped
+    assert registry.rank(['first', 'slow', 'down', 'fast']) == ['first', 'fast', 'slow']
+    config = registry.llm_config('first', fallbacks=['slow', 'down', 'fast'], temperature=0)
+    assert [entry['model'] for entry in config['config_list']] == ['model-1', 'model-4', 'model-2']
+    assert config['temperature'] == 0 and config['cache_seed'] == 1
+
+
+def test_health_is_probed_once_per_ttl(probes):
+    registry = ModelRegistry(LOCAL_MODELS)
+
+    assert not registry.health('down').healthy
+    assert not ModelRegistry(LOCAL_MODELS).health('down').healthy
+    assert probes == ['http://localhost:3/models']
+    registry.health('down', refresh=True)
+    assert len(probes) == 2
+
+
+def test_keeps_the_order_when_nothing_is_healthy(monkeypatch):
+    monkeypatch.setattr(models, 'probe', lambda url, headers=None, timeout=None: EndpointHealth(False, 0.0, 0.0))
+
+    assert ModelRegistry(LOCAL_MODELS).rank(['slow', 'first']) == ['slow', 'first']
+
+
+def test_openai_models_need_a_key(monkeypatch):
+    monkeypatch.delenv('OPEN_AI_API_KEY', raising=False)
+    registry = ModelRegistry()
+
+    with pytest.raises(ValueError):
+        registry.model_config('oai-gpt4')
+    assert 'oai-gpt4' not in registry.model_configs and 'mistral' in registry.model_configs
+
+    monkeypatch.setenv('OPEN_AI_API_KEY', 'sk-test')
+    assert ModelRegistry().model_config('oai-gpt4')['llm_config']['api_key'] == 'sk-test'
+
+
+def test_model_base_url_points_every_model_at_one_server(monkeypatch):
+    monkeypatch.delenv('OPEN_AI_API_KEY', raising=False)
+    monkeypatch.setenv('MODEL_BASE_URL', 'http://localhost:8000/v1/')
+    registry = ModelRegistry()
+
+    for name in ('oai-gpt4', 'mistral'):
+        entry = registry.model_config(name)
+        assert entry['llm_config']['base_url'] == 'http://localhost:8000/v1/'
+        assert entry['health_urls'] == ['http://localhost:8000/v1/models']
+    assert registry.model_config('oai-gpt4')['llm_config']['api_key'] == 'NULL'
+    # the built config still maps back to its registry name
+    assert registry.name_for(registry.llm_config('oai-gpt4', check_health=False)) == 'oai-gpt4'
@@ -0,0 +1,69 @@
+import asyncio
+
+import autogen
+
+from hello_autogen.pipeline import ReplyPipeline
+
+LLM_CONFIG = {'config_list': [{'model': 'gpt-3.5-turbo', 'api_key': 'test'}], 'cache_seed': None}
+
+
+def make_agent():
+    return autogen.ConversableAgent("Assistant", llm_config=LLM_CONFIG, human_input_mode="NEVER")
+
+
+def reply_names(agent):
+    return [entry['reply_func'].__name__ for entry in agent._reply_func_list]
+
+
+def test_installs_right_before_the_llm_reply():
+    agent = ReplyPipeline().install(make_agent())
+    names = reply_names(agent)
+
+    position = names.index('a_generate_pipeline_reply')
+    assert names[position:position + 3] == [
+        'a_generate_pipeline_reply', 'generate_pipeline_reply', 'a_generate_oai_reply',
+    ]
+    # termination checks and code execution still come first
+    assert names.index('check_termination_and_human_reply') < position
+
+
+def test_skips_agents_without_llm():
+    agent = autogen.ConversableAgent("User", llm_config=False, human_input_mode="NEVER")
+
+    assert reply_names(ReplyPipeline().install(agent)) == reply_names(
+        autogen.ConversableAgent("User", llm_config=False, human_input_mode="NEVER")
+    )
+
+
+def test_stages_run_in_order():
+    order = []
+
+    def stage(name):
+        def run(call, proceed):
+            order.append(name)
+            call.meta[name] = True
+            return proceed(call) if name != 'last' else f"reply to {call.messages[-1]['content']}"
+        return run
+
+    agent = ReplyPipeline([stage('first'), stage('second'), stage('last')]).install(make_agent())
+    reply = agent.generate_reply([{'role': 'user', 'content': "hi"}], sender=agent)
+
+    assert reply == "reply to hi"
+    assert order == ['first', 'second', 'last']
+
+
+def test_runs_once_per_reply():
+    runs = []
+
+    def stage(call, proceed):
+        runs.append(call)
+        return "reply" if call.messages[-1]['content'] == "hi" else None
+
+    agent = ReplyPipeline([stage]).install(make_agent())
+
+    assert agent.generate_reply([{'role': 'user', 'content': "hi"}], sender=agent) == "reply"
+    assert len(runs) == 1
+
+    # an async chat runs the sync reply functions too, which must not run the pipeline again after it gave no reply
+    assert asyncio.run(agent.a_generate_reply([{'role': 'user', 'content': "nothing"}], sender=agent)) is None
+    assert len(runs) == 2
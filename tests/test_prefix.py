@@ -0,0 +1,58 @@
+import autogen
+
+from hello_autogen.history import count_tokens, message_tokens
+from hello_autogen.pipeline import LLMCall
+from hello_autogen.prefix import PrefixTracker
+
+TASK = {'role': 'user', 'content': "Write a haiku about the sea"}
+REPLY = {'role': 'assistant', 'content': "Waves fold into foam"}
+
+
+def agent(name="Writer"):
+    return autogen.ConversableAgent(name, system_message="You write.", llm_config=False, human_input_mode='NEVER')
+
+
+def prefix_tokens(tracker, writer, messages, model='mistral'):
+    call = LLMCall(writer, messages, None, model)
+    tracker(call, lambda call: "reply")
+    return call.meta['prefix_tokens']
+
+
+def test_counts_the_tokens_the_prompt_shares_with_the_previous_one():
+    tracker = PrefixTracker()
+    writer = agent()
+    system_tokens = count_tokens("You write.", 'gpt-3.5-turbo')
+
+    assert prefix_tokens(tracker, writer, [TASK]) == 0
+    assert prefix_tokens(tracker, writer, [TASK, REPLY, {'role': 'user', 'content': "Another"}]) == (
+        system_tokens + message_tokens(TASK, 'gpt-3.5-turbo')
+    )
+    # a rewritten history only shares the system message
+    assert prefix_tokens(tracker, writer, [{'role': 'user', 'content': "Summary"}, REPLY]) == system_tokens
+    assert tracker.stats['calls'] == 3 and tracker.stats['prefix_tokens'] > 0
+
+
+def test_keeps_agents_and_models_apart():
+    tracker = PrefixTracker()
+    writer, critic = agent(), agent("Critic")
+
+    prefix_tokens(tracker, writer, [TASK])
+    assert prefix_tokens(tracker, writer, [TASK], model='oai-gpt4') == 0
+    assert prefix_tokens(tracker, critic, [TASK]) == 0
+
+
+def test_a_new_agent_starts_afresh():
+    tracker = PrefixTracker()
+    for _ in range(3):
+        # earlier agents are gone, so a new one may get the same id()
+        assert prefix_tokens(tracker, agent(), [TASK]) == 0
+
+
+def test_keeps_a_bounded_number_of_conversations():
+    tracker = PrefixTracker(max_conversations=2)
+    writers = [agent(f"Writer{index}") for index in range(3)]
+    for writer in writers:
+        prefix_tokens(tracker, writer, [TASK])
+
+    assert prefix_tokens(tracker, writers[0], [TASK]) == 0
+    assert prefix_tokens(tracker, writers[2], [TASK]) > 0
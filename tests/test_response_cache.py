@@ -0,0 +1,74 @@
+import pytest
+
+from hello_autogen.response_cache import SemanticCache, SharedReplies, hashed_embedding
+
+NOTICE = '\nReply TERMINATE when the task is done.'
+
+
+def test_exact_and_normalized_hits():
+    cache = SemanticCache(boilerplate=[NOTICE])
+    cache.put('mistral', 'context', "Tell me a joke." + NOTICE, "Why did the chicken...")
+
+    assert cache.get('mistral', 'context', "tell me   a joke") == "Why did the chicken..."
+    assert cache.get('mistral', 'context', "Tell me a joke!" + NOTICE) == "Why did the chicken..."
+    assert cache.stats()['exact_hits'] == 2
+
+
+def test_misses_on_another_model_or_context():
+    cache = SemanticCache()
+    cache.put('mistral', 'context', "Tell me a joke", "joke")
+
+    assert cache.get('oai-gpt4', 'context', "Tell me a joke") is None
+    assert cache.get('mistral', 'other context', "Tell me a joke") is None
+    assert cache.stats()['misses'] == 2
+
+
+def test_rephrasings_miss_by_default():
+    cache = SemanticCache()
+    cache.put('mistral', 'context', "Please tell me a joke", "joke")
+
+    assert cache.get('mistral', 'context', "Tell me a joke") is None
+
+
+@pytest.mark.parametrize('cached, asked', [
+    ("Write a python function that prints 1 to 100 in reverse", "Write a python function that prints 1 to 100"),
+    ("Write a python function that prints 1 to 100", "Write a python function that prints 1 to 100 in reverse"),
+    ("How do I sort a list", "I sort a list"),
+    ("Is it safe to delete the cache", "Is it not safe to delete the cache"),
+])
+@pytest.mark.parametrize('embed', [None, hashed_embedding])
+def test_near_misses_do_not_hit(cached, asked, embed):
+    cache = SemanticCache(embed=embed)
+    cache.put('mistral', 'context', cached, "reply")
+
+    assert cache.get('mistral', 'context', asked) is None
+
+
+def test_semantic_matching_when_enabled():
+    cache = SemanticCache(embed=hashed_embedding)
+    cache.put('mistral', 'context', "Write a poem about the sea", "poem")
+
+    assert cache.get('mistral', 'context', "Please write a poem about the sea") == "poem"
+    assert cache.stats()['semantic_hits'] == 1
+
+
+def test_expiry_and_eviction():
+    cache = SemanticCache(max_entries=2, ttl=0)
+    cache.put('mistral', 'context', "one", "1")
+    assert cache.get('mistral', 'context', "one") is None
+
+    cache = SemanticCache(max_entries=2)
+    for prompt in ("one", "two", "three"):
+        cache.put('mistral', 'context', prompt, prompt)
+    assert cache.get('mistral', 'context', "one") is None
+    assert cache.get('mistral', 'context', "three") == "three"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_shared_between_caches(tmp_path):
+    path = str(tmp_path / 'replies.db')
+    first, second = SemanticCache(shared=SharedReplies(path)), SemanticCache(shared=SharedReplies(path))
+    first.put('mistral', 'context', "Tell me a joke", "joke")
+
+    assert second.get('mistral', 'context', "tell me a joke") == "joke"
+    assert second.stats()['shared_loads'] == 1
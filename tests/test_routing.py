@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hello_autogen.routing import ModelRouter
+
+MODELS = {'mistral', 'codellama', 'oai-gpt35', 'oai-gpt4'}
+
+
+class FakeModels:
+    def __init__(self, configured=MODELS):
+        self.configured = configured
+
+    def model_config(self, name):
+        if name not in self.configured:
+            raise ValueError(f"{name} is not configured")
+        return {'model': name}
+
+    def llm_config(self, name, check_health=True, **params):
+        return dict(params, config_list=[{'model': name, 'api_key': 'test'}])
+
+    def name_for(self, llm_config):
+        return llm_config['config_list'][0]['model']
+
+
+def make_call(content, name="Writer"):
+    agent = SimpleNamespace(
+        name=name, system_message="You write.", llm_config={'config_list': [{'model': 'mistral'}], 'temperature': 0},
+    )
+    return SimpleNamespace(agent=agent, messages=[{'role': 'user', 'content': content}], sender=None,
+                           model='mistral', client=None, llm_config=agent.llm_config, meta={})
+
+
+def answering(replies):
+    tried = []
+
+    def proceed(call):
+        tried.append(call.model)
+        reply = replies[call.model]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    return proceed, tried
+
+
+def test_simple_requests_stay_local():
+    proceed, tried = answering({'mistral': "Hello!"})
+
+    assert ModelRouter(FakeModels(), check_health=False)(make_call("Say hello"), proceed) == "Hello!"
+    assert tried == ['mistral']
+
+
+def test_hard_code_requests_start_higher():
+    proceed, tried = answering({'oai-gpt35': "def f(): pass"})
+
+    ModelRouter(FakeModels(), check_health=False)(make_call("Explain and refactor this python function"), proceed)
+
+    assert tried == ['oai-gpt35']
+
+
+def test_escalates_empty_refused_and_failed_replies():
+    router = ModelRouter(FakeModels(), check_health=False)
+    proceed, tried = answering({'mistral': "", 'oai-gpt35': "I'm sorry, I can't do that", 'oai-gpt4': "Done."})
+    call = make_call("Say hello")
+
+    assert router(call, proceed) == "Done."
+    assert tried == ['mistral', 'oai-gpt35', 'oai-gpt4']
+    assert call.meta['route']['escalated'] == 'refusal'
+    assert router.stats['escalations'] == 2
+    assert router.stats['rejected'] == {'empty reply': 1, 'refusal': 1}
+
+    proceed, tried = answering({'mistral': TimeoutError("timed out"), 'oai-gpt35': "Hi"})
+    assert router(make_call("Say hello"), proceed) == "Hi"
+    assert tried == ['mistral', 'oai-gpt35']
+
+
+def test_skips_models_that_are_not_configured():
+    proceed, tried = answering({'mistral': "", 'oai-gpt4': "Hi"})
+    router = ModelRouter(FakeModels(MODELS - {'oai-gpt35'}), check_health=False)
+
+    assert router(make_call("Say hello"), proceed) == "Hi"
+    assert tried == ['mistral', 'oai-gpt4']
+    assert router.stats['skipped'] == 1
+
+
+def test_the_last_tier_keeps_its_reply_or_error():
+    router = ModelRouter(FakeModels(), check_health=False)
+    proceed, tried = answering({'mistral': "", 'oai-gpt35': "", 'oai-gpt4': ""})
+    assert router(make_call("Say hello"), proceed) == ""
+
+    proceed, tried = answering({'mistral': "", 'oai-gpt35': "", 'oai-gpt4': TimeoutError("timed out")})
+    with pytest.raises(TimeoutError):
+        router(make_call("Say hello"), proceed)
+
+
+def test_each_tier_gets_a_fresh_call():
+    seen = []
+
+    def proceed(call):
+        seen.append((call.model, len(call.messages), dict(call.meta)))
+        # what a later stage does to a rejected attempt, e.g. compacting its history
+        call.messages.append({'role': 'user', 'content': "summary"})
+        call.meta['usage'] = call.model
+        return "" if call.model == 'mistral' else "Hi"
+
+    call = make_call("Say hello")
+    call.meta['budget'] = 'kept'
+
+    assert ModelRouter(FakeModels(), check_health=False)(call, proceed) == "Hi"
+    assert [(model, count) for model, count, _ in seen] == [('mistral', 1), ('oai-gpt35', 1)]
+    assert 'usage' not in seen[1][2] and seen[1][2]['budget'] == 'kept'
+    # the stages in front see the tier that answered
+    assert call.model == 'oai-gpt35' and call.meta['usage'] == 'oai-gpt35'
+    assert call.meta['route']['tier'] == 'gpt-3.5'
+    assert len(call.messages) == 1 and 'validate' not in call.meta
+
+
+def test_the_cache_only_stores_replies_the_router_keeps():
+    from hello_autogen.response_cache import SemanticCache
+
+    cache = SemanticCache()
+    proceed, tried = answering({'mistral': "I'm sorry, I can't do that", 'oai-gpt35': "Hello!"})
+    router = ModelRouter(FakeModels(), check_health=False)
+    call = make_call("Say hello")
+
+    assert router(call, lambda call: cache(call, proceed)) == "Hello!"
+    assert tried == ['mistral', 'oai-gpt35']
+    assert cache.stats()['size'] == 1
+
+    # asked again: the local tier misses the cache and is rejected again, the accepted reply is a hit
+    assert router(make_call("Say hello"), lambda call: cache(call, proceed)) == "Hello!"
+    assert tried == ['mistral', 'oai-gpt35', 'mistral']
+    assert cache.stats()['exact_hits'] == 1
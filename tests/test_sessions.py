@@ -0,0 +1,74 @@
+import pytest
+
+from hello_autogen import sessions
+from hello_autogen.sessions import SessionPool, SessionPoolFull
+
+
+def test_builds_a_session_once_and_reuses_it():
+    pool = SessionPool()
+    built = []
+
+    def factory():
+        built.append(1)
+        return {'agents': len(built)}
+
+    first = pool.acquire('a', factory)
+    pool.release(first)
+    again = pool.acquire('a', factory)
+
+    assert again is first and again.state == {'agents': 1}
+    assert len(built) == 1
+
+
+def test_evicts_the_least_recently_used_idle_session():
+    pool = SessionPool(max_sessions=2)
+    for session_id in ('a', 'b'):
+        pool.release(pool.acquire(session_id, dict))
+    # 'a' is used again, so 'b' is now the least recently used
+    pool.release(pool.acquire('a', dict))
+    pool.release(pool.acquire('c', dict))
+
+    assert len(pool) == 2
+    assert pool.stats()['evictions'] == 1
+    assert pool.acquire('a', lambda: 'rebuilt').state == {}
+    assert pool.acquire('b', lambda: 'rebuilt').state == 'rebuilt'
+
+
+def test_refuses_new_sessions_when_all_are_busy():
+    pool = SessionPool(max_sessions=2)
+    pool.acquire('a', dict)
+    pool.acquire('b', dict)
+
+    with pytest.raises(SessionPoolFull):
+        pool.acquire('c', dict)
+    assert len(pool) == 2 and pool.stats()['active'] == 2
+
+
+def test_drops_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, 'monotonic', lambda: now[0])
+    pool = SessionPool(idle_timeout=60)
+    pool.release(pool.acquire('idle', dict))
+    busy = pool.acquire('busy', dict)
+
+    now[0] += 61
+    pool.acquire('new', dict)
+
+    assert len(pool) == 2 and busy.active == 1
+    assert pool.stats()['evictions'] == 1
+
+
+def test_a_failed_build_leaves_no_session():
+    pool = SessionPool()
+
+    def factory():
+        raise RuntimeError("no model")
+
+    with pytest.raises(RuntimeError):
+        pool.acquire('a', factory)
+    assert len(pool) == 0
+
+
+def test_one_pool_per_name():
+    assert sessions.get_pool('test-sessions', max_sessions=3) is sessions.get_pool('test-sessions')
+    assert sessions.get_pool('test-sessions').max_sessions == 3
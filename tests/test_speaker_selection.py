@@ -0,0 +1,21 @@
+import autogen
+from autogen.agentchat.contrib.multimodal_conversable_agent import MultimodalConversableAgent
+
+from hello_autogen.speaker_selection import KeywordSpeakerSelector
+
+
+def test_selects_among_multimodal_agents():
+    explainer = MultimodalConversableAgent(
+        name="ImageExplainer", llm_config=False, system_message="You describe photos and pictures.",
+        description="explains what an image shows",
+    )
+    chef = autogen.AssistantAgent(
+        name="Chef", llm_config=False, system_message="You are a chef.", description="cooks recipes and meals",
+    )
+    selector = KeywordSpeakerSelector()
+    messages = [{'role': 'user', 'content': "Describe the photos in this picture"}]
+
+    agent, confidence = selector.select(None, [explainer, chef], messages)
+
+    assert agent is explainer
+    assert confidence > 0
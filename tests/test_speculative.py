@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+from hello_autogen.pipeline import LLMCall
+from hello_autogen.speculative import SpeculativeRacer
+
+MODELS = {'mistral', 'codellama', 'oai-gpt35', 'oai-gpt4'}
+
+
+class FakeModels:
+    def __init__(self, configured=MODELS):
+        self.configured = configured
+
+    def model_config(self, name):
+        if name not in self.configured:
+            raise ValueError(f"{name} is not configured")
+        return {'model': name}
+
+    def llm_config(self, name, check_health=True, **params):
+        return dict(params, config_list=[{'model': name, 'api_key': 'test'}])
+
+
+def make_call():
+    agent = SimpleNamespace(
+        name="Writer", system_message="You write.", llm_config={'config_list': [{'model': 'mistral'}]},
+    )
+    return LLMCall(agent, [{'role': 'user', 'content': "Say hello"}], None, 'mistral')
+
+
+def answering(replies):
+    started = []
+
+    def proceed(call):
+        started.append((call.model, call.meta.get('speculative')))
+        delay, reply = replies[call.model]
+        time.sleep(delay)
+        return reply
+    return proceed, started
+
+
+def racer(models=MODELS, **kwargs):
+    return SpeculativeRacer(
+        FakeModels(models), {'Writer': ['mistral', 'oai-gpt35']}, check_health=False, **kwargs,
+    )
+
+
+def test_the_first_good_reply_wins():
+    speculative = racer()
+    proceed, started = answering({'mistral': (0.5, "Hello from mistral"), 'oai-gpt35': (0.0, "Hello!")})
+    call = make_call()
+
+    began = time.monotonic()
+    assert speculative(call, proceed) == "Hello!"
+    assert time.monotonic() - began < 0.4
+    assert sorted(started) == [('mistral', True), ('oai-gpt35', True)]
+    # the stages in front see the winner, not a candidate
+    assert call.model == 'oai-gpt35' and call.meta['race']['model'] == 'oai-gpt35'
+    assert 'speculative' not in call.meta
+    assert speculative.stats['wins'] == {'oai-gpt35': 1}
+
+
+def test_a_fast_reply_that_fails_the_checks_loses():
+    speculative = racer()
+    proceed, _ = answering({'mistral': (0.0, "I'm sorry, I can't"), 'oai-gpt35': (0.1, "Hello!")})
+
+    assert speculative(make_call(), proceed) == "Hello!"
+    assert speculative.stats['rejected'] == 1
+
+
+def test_keeps_the_first_reply_when_none_passes():
+    speculative = racer()
+    proceed, _ = answering({'mistral': (0.0, ""), 'oai-gpt35': (0.1, "I'm sorry, I can't")})
+
+    assert speculative(make_call(), proceed) == ""
+    assert speculative.stats['rejected'] == 2
+
+
+def test_hedges_only_when_the_first_candidate_is_slow():
+    proceed, started = answering({'mistral': (0.0, "Hello!"), 'oai-gpt35': (0.0, "Hi")})
+    assert racer(hedge_after=0.2)(make_call(), proceed) == "Hello!"
+    assert started == [('mistral', True)]
+
+    speculative = racer(hedge_after=0.05)
+    proceed, started = answering({'mistral': (0.5, "Hello!"), 'oai-gpt35': (0.0, "Hi")})
+    assert speculative(make_call(), proceed) == "Hi"
+    assert speculative.stats['hedged'] == 1
+
+
+def test_races_only_with_two_candidates_available():
+    proceed, started = answering({'mistral': (0.0, "Hello!")})
+
+    assert racer(MODELS - {'oai-gpt35'})(make_call(), proceed) == "Hello!"
+    assert started == [('mistral', None)]
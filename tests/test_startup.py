@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from hello_autogen import startup
+from hello_autogen.startup import LazyValue, StartupTimer, lazy_value, prewarm
+
+
+class Builder:
+    def __init__(self, delay=0.0, fail=0):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.threads = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        self.threads.append(threading.current_thread().name)
+        time.sleep(self.delay)
+        if self.calls <= self.fail:
+            raise ConnectionError("not yet")
+        return (args, kwargs, self.calls)
+
+
+def test_builds_once_even_when_asked_at_once():
+    builder = Builder(delay=0.1)
+    value = LazyValue('models', builder, ('oai-gpt4',), {'cache': True})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(value.get())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [(('oai-gpt4',), {'cache': True}, 1)] * 4
+    assert builder.calls == 1 and value.ready and value.build_time >= 0.1
+
+
+def test_resolves_module_attribute_strings():
+    value = lazy_value('test-startup:join', 'os.path:join', 'a', 'b')
+
+    assert value.get() == 'a/b'
+    assert lazy_value('test-startup:join', 'os.path:join') is value
+
+
+def test_a_failed_build_is_tried_again():
+    value = LazyValue('flaky', Builder(fail=1))
+
+    with pytest.raises(RuntimeError):
+        value.get()
+    assert value.get()[2] == 2
+
+
+def test_an_old_value_is_rebuilt_in_the_background():
+    builder = Builder()
+    value = LazyValue('config', builder, max_age=0.05)
+    first = value.get()
+    time.sleep(0.1)
+
+    # the old value is served while the new one builds
+    assert value.get() == first
+    value.start().wait(1)
+    assert value.get()[2] == 2
+
+
+def test_prewarm_builds_one_value_after_another_off_the_caller(monkeypatch):
+    monkeypatch.setattr(startup, '_panel_server', lambda: False)
+    builders = [Builder(delay=0.05), Builder(delay=0.05)]
+    values = [LazyValue(f"value{index}", builder) for index, builder in enumerate(builders)]
+
+    started = time.monotonic()
+    prewarm(*values)
+    assert time.monotonic() - started < 0.05
+
+    deadline = time.monotonic() + 1
+    while not values[1].ready and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [builder.threads for builder in builders] == [['prewarm'], ['prewarm']]
+    assert values[1].built_at - values[0].built_at >= 0.05
+
+
+def test_timer_counts_runs_over_budget():
+    timer = StartupTimer('test-startup', budget=0.0)
+    timer.mark('imports')
+
+    assert timer.finish() > 0
+    assert [section for section, _ in timer.sections] == ['imports']
+    assert startup.startup_stats['test-startup']['over_budget'] == 1
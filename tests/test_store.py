@@ -0,0 +1,49 @@
+import autogen
+
+from hello_autogen.speaker_selection import HeuristicGroupChat
+from hello_autogen.store import ConversationStore, seed_group_chat
+
+
+def build_chat(conversation_log=None):
+    writer = autogen.ConversableAgent("Writer", llm_config=False, human_input_mode="NEVER")
+    critic = autogen.ConversableAgent("Critic", llm_config=False, human_input_mode="NEVER")
+    user_proxy = autogen.ConversableAgent(
+        "UserProxy", llm_config=False, human_input_mode="NEVER", default_auto_reply="",
+    )
+    for agent in (writer, critic):
+        agent.register_reply(
+            [autogen.Agent, None],
+            lambda recipient, messages, sender, config: (True, f"{recipient.name} reply {len(messages)}"),
+        )
+    groupchat = HeuristicGroupChat(
+        agents=[user_proxy, writer, critic], messages=[], max_round=3, speaker_selection_method='round_robin',
+        conversation_log=conversation_log,
+    )
+    manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=False)
+    return user_proxy, writer, groupchat, manager
+
+
+def test_resumes_a_stored_conversation(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.db'))
+    log = store.log('session', 'chat')
+    user_proxy, _, groupchat, manager = build_chat(log)
+    user_proxy.initiate_chat(manager, message="Write a poem", silent=True)
+    said = [message['content'] for message in groupchat.messages]
+    assert said == ["Write a poem", "Writer reply 1", "Critic reply 2"]
+
+    # a new session (or worker) builds new agents and picks the conversation up from the store
+    user_proxy, writer, groupchat, manager = build_chat(log)
+    seed_group_chat(manager, log.load())
+
+    assert [message['content'] for message in groupchat.messages] == said
+    assert [message['role'] for message in writer.chat_messages[manager]] == ['user', 'assistant', 'user']
+    # seeding doesn't record the messages a second time
+    assert len(store.load('session', 'chat')) == 3
+
+    # the agents answer with the seeded history in front of the new message
+    user_proxy.initiate_chat(manager, message="Shorter please", clear_history=False, silent=True)
+    assert [message['content'] for message in groupchat.messages][3:] == [
+        "Shorter please", "Writer reply 4", "Critic reply 5",
+    ]
+    assert len(store.load('session', 'chat')) == 6
+    store.close()
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+import autogen
+import httpx
+import openai
+import pytest
+
+from hello_autogen.pipeline import LLMCall
+from hello_autogen.streaming import PanelStreamer
+
+
+def chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if text is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeCompletions:
+    def __init__(self, chunks, stream_options=True):
+        # an exception in the chunks is raised when the stream gets to it
+        self.chunks = chunks
+        self.stream_options = stream_options
+        self.requests = []
+
+    def create(self, **params):
+        self.requests.append(params)
+        if 'stream_options' in params and not self.stream_options:
+            request = httpx.Request('POST', 'http://localhost/v1/chat/completions')
+            raise openai.BadRequestError(
+                "unknown parameter", response=httpx.Response(400, request=request), body=None,
+            )
+        return self._iterate()
+
+    def _iterate(self):
+        for item in self.chunks:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class FakeClientPool:
+    def __init__(self, completions):
+        self.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def openai_client(self, base_url=None, api_key=None, timeout=600):
+        return self.client
+
+
+class FakeChat:
+    def __init__(self):
+        self.messages = []
+
+    @property
+    def text(self):
+        return ''.join(self.messages)
+
+    def stream(self, text, user, avatar=None, message=None, replace=False):
+        if message is None:
+            self.messages.append(text)
+            return len(self.messages) - 1
+        self.messages[message] = text if replace else self.messages[message] + text
+        return message
+
+
+def make_call():
+    agent = autogen.ConversableAgent(
+        "Writer", system_message="You write.", human_input_mode="NEVER",
+        llm_config={'config_list': [{'model': 'gpt-4', 'api_key': 'test'}], 'cache_seed': None},
+    )
+    return LLMCall(agent, [{'role': 'user', 'content': "Write a haiku"}], None, 'oai-gpt4')
+
+
+def never(call):
+    raise AssertionError("the call should have been streamed")
+
+
+def test_records_the_usage_the_endpoint_reports():
+    usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=500)
+    completions = FakeCompletions([chunk("Autumn "), chunk("moon"), chunk(usage=usage)])
+    chat = FakeChat()
+    streamer = PanelStreamer(chat, {}, client_pool=FakeClientPool(completions))
+    call = make_call()
+
+    assert streamer(call, never) == "Autumn moon"
+    assert chat.text == "Autumn moon"
+    assert completions.requests[0]['stream_options'] == {'include_usage': True}
+    assert call.meta['usage'] == {
+        'model': 'gpt-4', 'prompt_tokens': 1000, 'completion_tokens': 500, 'estimated': False,
+    }
+    # gpt-4 costs $0.03 / $0.06 per 1000 prompt / completion tokens
+    assert streamer.cost() == pytest.approx(0.06)
+
+
+def test_estimates_usage_when_the_endpoint_rejects_stream_options():
+    completions = FakeCompletions([chunk("Autumn "), chunk("moon")], stream_options=False)
+    streamer = PanelStreamer(FakeChat(), {}, client_pool=FakeClientPool(completions))
+
+    for _ in range(2):
+        call = make_call()
+        assert streamer(call, never) == "Autumn moon"
+        assert call.meta['usage']['estimated']
+        assert call.meta['usage']['prompt_tokens'] > 0 and call.meta['usage']['completion_tokens'] > 0
+
+    # asked once, then remembered for the endpoint
+    assert ['stream_options' in request for request in completions.requests] == [True, False, False]
+    assert streamer.usage['gpt-4']['calls'] == streamer.usage['gpt-4']['estimated_calls'] == 2
+    assert streamer.cost() > 0
+
+
+def test_budget_charges_the_streamed_usage():
+    from hello_autogen.budgets import ChatBudget
+
+    usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=500)
+    streamer = PanelStreamer(
+        FakeChat(), {}, client_pool=FakeClientPool(FakeCompletions([chunk("moon"), chunk(usage=usage)])),
+    )
+    budget = ChatBudget(None, check_health=False)
+
+    budget(make_call(), lambda call: streamer(call, never))
+
+    assert budget.usage()['tokens'] == 1500
+    assert budget.usage()['dollars'] == pytest.approx(0.06)
+
+
+def test_stream_that_breaks_off_is_marked_and_falls_back():
+    from hello_autogen.streaming import INTERRUPTED
+
+    completions = FakeCompletions([chunk("Autumn "), chunk("mo"), ConnectionError("connection reset")])
+    chat = FakeChat()
+    streamer = PanelStreamer(chat, {}, client_pool=FakeClientPool(completions))
+    call = make_call()
+
+    assert streamer(call, lambda call: "Autumn moon") == "Autumn moon"
+    # the partial message is finished rather than left half-rendered; the retried reply is printed by autogen
+    assert chat.messages == ["Autumn mo" + INTERRUPTED]
+    assert 'usage' not in call.meta and 'time_to_first_token' not in call.meta
+    assert not streamer.was_shown("Autumn mo")
@@ -0,0 +1,74 @@
+import pytest
+
+from hello_autogen.termination import TerminationDetector, done, gratitude, repetition_rule
+
+TASK = {'role': 'user', 'content': "Write a function that reverses a string"}
+
+
+def detector_after_task(**kwargs):
+    detector = TerminationDetector(**kwargs)
+    assert detector.check(TASK) is None
+    return detector
+
+
+@pytest.mark.parametrize('text', [
+    "Thank you!",
+    "Thanks so much for your help.",
+    "You're welcome! Glad I could help.",
+    "Cheers, Bob",
+    "My pleasure, happy to help.",
+])
+def test_ends_on_thanks_alone(text):
+    assert gratitude(text, {}, [])
+
+
+@pytest.mark.parametrize('text', [
+    "Thanks, but the code fails on line 3",
+    "Thanks! Now add a test for the empty string.",
+    "No problem. Here is the fix:\n```python\nprint(1)\n```",
+    "Write a function that reverses a string",
+])
+def test_carries_on_when_thanks_come_with_more(text):
+    assert not gratitude(text, {}, [])
+
+
+@pytest.mark.parametrize('language', ['python', 'sh', 'javascript', 'js', 'node', ''])
+def test_done_waits_for_code_to_run(language):
+    text = f"Here you go:\n```{language}\nrun()\n```\nHope this helps!"
+
+    assert not done(text, {}, [])
+
+
+def test_done_without_code_left_to_run():
+    assert done("The task is complete. Let me know if you need anything else.", {}, [])
+    assert done("Example:\n```text\nhello\n```\nHope this helps!", {}, [])
+    assert not done("Here is the plan.", {}, [])
+
+
+def test_repetition():
+    rule = repetition_rule(window=2)
+    history = ["The answer is a function that reverses the input string", "ok"]
+
+    assert rule("The answer is a function that reverses the input string!", {}, history)
+    assert not rule("A loop that walks the string from its end", {}, history)
+
+
+def test_detector_only_lets_the_keyword_end_the_task():
+    detector = TerminationDetector(boilerplate=[" Reply TERMINATE when done."])
+
+    assert detector.check({'content': "Thanks in advance"}) is None
+    assert detector.check({'content': "Thank you! Reply TERMINATE when done."}) == 'gratitude'
+    assert detector.check({'content': "All good. TERMINATE"}) == 'keyword'
+    assert detector.stats['early'] == 1 and detector.stats['terminations'] == {'gratitude': 1, 'keyword': 1}
+
+    detector.reset()
+    assert detector.check({'content': "Thank you!"}) is None
+
+
+def test_detector_checks_a_message_once_per_turn():
+    detector = detector_after_task(max_round=10)
+    message = {'content': "You're welcome!"}
+
+    assert detector(message) and detector(message)
+    assert detector.stats['checks'] == 2
+    assert detector.stats['rounds_saved'] == 8
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+panel = pytest.importorskip('panel')
+
+from hello_autogen.ui import MessageBatcher, preview  # noqa: E402
+
+
+def batcher(**kwargs):
+    return MessageBatcher(panel.chat.ChatInterface(), {'Writer': '✍️'}, **kwargs)
+
+
+def test_preview_cuts_at_a_line_break_and_closes_code_blocks():
+    content = "Here you go:\n```python\n" + "print(1)\n" * 100 + "```"
+
+    head = preview(content, chars=60)
+    assert head.endswith("print(1)\n```\n\n...")
+    assert head.count('```') == 2
+    assert preview("short", chars=60) == "short\n\n..."
+
+
+def test_a_sync_chat_shows_each_message_right_away():
+    messages = batcher()
+
+    message = messages.post("Hello", 'Writer')
+
+    assert messages.chat_interface.objects == [message]
+    assert message.user == 'Writer' and message.avatar == '✍️'
+    assert messages.stats['flushes'] == 1
+
+
+def test_an_async_chat_adds_a_frame_of_messages_at_once():
+    messages = batcher(interval=0.05)
+
+    async def chat():
+        for index in range(3):
+            messages.post(f"message {index}", 'Writer')
+        assert messages.chat_interface.objects == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(chat())
+
+    assert [message.object for message in messages.chat_interface.objects] == ["message 0", "message 1", "message 2"]
+    assert messages.stats['flushes'] == 1
+
+
+def test_long_messages_are_collapsed_until_opened():
+    messages = batcher(collapse_chars=100, preview_chars=50)
+    content = "line\n" * 100
+
+    body = messages.post(content, 'Writer').object
+    head, full = body.objects
+    assert head.object == preview(content, 50)
+    assert full.collapsed and full.objects == []
+
+    full.collapsed = False
+    assert full.objects[0].object == content and not head.visible
+    assert messages.stats['collapsed'] == messages.stats['expanded'] == 1
+
+
+def test_old_messages_make_way_for_a_note():
+    messages = batcher(max_messages=3)
+    for index in range(5):
+        messages.post(f"message {index}", 'Writer')
+
+    notice, *shown = messages.chat_interface.objects
+    assert notice.object == "2 earlier messages are no longer shown."
+    assert [message.object for message in shown] == ["message 2", "message 3", "message 4"]
+
+    messages.post("message 5", 'Writer')
+    assert messages.chat_interface.objects[0].object == "3 earlier messages are no longer shown."
+    assert len(messages.chat_interface.objects) == 4